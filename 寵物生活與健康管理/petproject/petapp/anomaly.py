@@ -0,0 +1,153 @@
+# petapp/anomaly.py
+"""
+體溫／體重異常偵測：所有寵物的量測一次載入，以 NumPy 整批計算
+
+資料依 (寵物, 量測種類, 日期) 排序後，每個 (寵物, 種類) 是一段連續的序列。
+每一筆的基準是同序列、前 baseline_days 天內「之前」的量測（不含自己），
+用累積和一次算出所有點的滾動平均與標準差，再算 z-score 與相鄰兩筆的每日變化率；
+物種門檻先展開成與資料等長的陣列，判斷全部是向量運算，沒有逐寵物的迴圈或查詢。
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+
+from .models import DailyRecord, HealthAlert, Pet
+
+# 基準至少要有幾筆才算 z-score；標準差下限（佔基準平均的比例），避免數值幾乎不變時一點波動就觸發
+MIN_HISTORY = 5
+STD_FLOOR = 0.005
+
+KINDS = DailyRecord.MEASUREMENT_CATEGORIES
+SPECIES = tuple(HealthAlert.DEFAULT_RULES)
+# 規則優先順序：同一筆觸發多項時只記最嚴重的一項
+RULE_ORDER = ('high', 'low', 'change', 'zscore')
+
+
+def threshold_table(name):
+    """門檻查表陣列 table[物種, 種類]，未設定的門檻為 NaN（比較結果永遠為 False）"""
+    table = np.full((len(SPECIES), len(KINDS)), np.nan)
+    for s, species in enumerate(SPECIES):
+        rules = HealthAlert.rules(species)
+        for k, kind in enumerate(KINDS):
+            table[s, k] = rules[kind].get(name, np.nan)
+    return table
+
+
+def score(series, kinds, species, days, values, baseline_days):
+    """
+    series／kinds／species／days／values 為等長陣列，需依 (series, days) 排序；
+    series 為 (寵物, 種類) 的序列編號，kinds、species 為 KINDS、SPECIES 的索引，days 為日期序數。
+    回傳 {'baseline', 'zscore', 'rate', 'rule'}，rule 為 RULE_ORDER 的索引，-1 表示正常
+    """
+    n = len(values)
+    index = np.arange(n)
+
+    # 每一筆的基準視窗為 [start, index)：同序列、日期在 baseline_days 天內的前幾筆
+    key = series.astype(np.int64) * 1_000_000 + days
+    start = np.searchsorted(key, key - baseline_days, side='left')
+    history = index - start
+
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    squares = np.concatenate(([0.0], np.cumsum(values * values)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        baseline = (sums[index] - sums[start]) / history
+        variance = (squares[index] - squares[start]) / history - baseline * baseline
+        std = np.maximum(np.sqrt(np.clip(variance, 0, None)), np.abs(baseline) * STD_FLOOR)
+        zscore = np.where(history >= MIN_HISTORY, (values - baseline) / std, np.nan)
+
+        # 每日變化率：與同序列前一筆相比，除以間隔天數（同日多筆視為 1 天）與基準平均
+        previous = np.maximum(index - 1, 0)
+        same_series = (index > 0) & (series[previous] == series)
+        gap = np.maximum(days - days[previous], 1)
+        rate = np.where(same_series & (history > 0), (values - values[previous]) / gap / baseline, np.nan)
+
+    low = threshold_table('low')[species, kinds]
+    high = threshold_table('high')[species, kinds]
+    checks = {
+        'high': values > high,
+        'low': values < low,
+        'change': np.abs(rate) > threshold_table('rate')[species, kinds],
+        'zscore': np.abs(zscore) > threshold_table('zscore')[species, kinds],
+    }
+    rule = np.full(n, -1, dtype=np.int64)
+    for position in reversed(range(len(RULE_ORDER))):
+        rule[checks[RULE_ORDER[position]]] = position
+
+    return {'baseline': baseline, 'zscore': zscore, 'rate': rate, 'rule': rule}
+
+
+def load_readings(score_from, until, baseline_days):
+    """
+    期間內有量測的寵物，連同基準期的量測一次載入，回傳等長陣列 (pet_ids, kinds, species, days, values)
+    依 (寵物, 種類, 日期, 建立時間) 排序
+    """
+    since = score_from - timedelta(days=baseline_days)
+    recent_pets = DailyRecord.objects.filter(
+        category__in=KINDS, value__isnull=False, date__range=(score_from, until)
+    ).values('pet_id')
+    rows = DailyRecord.objects.filter(
+        pet_id__in=recent_pets, category__in=KINDS, value__isnull=False, date__range=(since, until)
+    ).order_by('pet_id', 'category', 'date', 'created_at').values_list(
+        'pet_id', 'category', 'date', 'value', 'pet__species'
+    )
+
+    kind_index = {kind: k for k, kind in enumerate(KINDS)}
+    species_index = {name: s for s, name in enumerate(SPECIES)}
+    other = species_index['other']
+    pet_ids, kinds, species, days, values = [], [], [], [], []
+    for pet_id, kind, record_date, value, pet_species in rows.iterator(chunk_size=10000):
+        pet_ids.append(pet_id)
+        kinds.append(kind_index[kind])
+        species.append(species_index.get(pet_species, other))
+        days.append(record_date.toordinal())
+        values.append(value)
+
+    return (
+        np.asarray(pet_ids, dtype=np.int64),
+        np.asarray(kinds, dtype=np.int64),
+        np.asarray(species, dtype=np.int64),
+        np.asarray(days, dtype=np.int64),
+        np.asarray(values, dtype=np.float64),
+    )
+
+
+def series_ids(pet_ids, kinds):
+    """依排序後的 (寵物, 種類) 給每段連續序列一個遞增編號"""
+    if not len(pet_ids):
+        return np.zeros(0, dtype=np.int64)
+    boundary = np.concatenate(([False], (pet_ids[1:] != pet_ids[:-1]) | (kinds[1:] != kinds[:-1])))
+    return np.cumsum(boundary)
+
+
+def detect(score_from, until, baseline_days=30):
+    """
+    計算 [score_from, until] 期間的量測是否異常，回傳未存檔的 HealthAlert 清單
+    同一寵物、種類、日期有多筆異常時取最後一筆
+    """
+    pet_ids, kinds, species, days, values = load_readings(score_from, until, baseline_days)
+    if not len(values):
+        return []
+
+    result = score(series_ids(pet_ids, kinds), kinds, species, days, values, baseline_days)
+    flagged = np.flatnonzero((result['rule'] >= 0) & (days >= score_from.toordinal()))
+    if not len(flagged):
+        return []
+
+    owners = dict(Pet.objects.filter(id__in=set(pet_ids[flagged].tolist())).values_list('id', 'owner_id'))
+    alerts = {}
+    for i in flagged.tolist():
+        baseline = result['baseline'][i]
+        zscore = result['zscore'][i]
+        record_date = date.fromordinal(int(days[i]))
+        alerts[(int(pet_ids[i]), int(kinds[i]), record_date)] = HealthAlert(
+            pet_id=int(pet_ids[i]),
+            owner_id=owners[int(pet_ids[i])],
+            kind=KINDS[kinds[i]],
+            date=record_date,
+            rule=RULE_ORDER[result['rule'][i]],
+            value=float(values[i]),
+            baseline=round(float(baseline), 3) if np.isfinite(baseline) else None,
+            zscore=round(float(zscore), 2) if np.isfinite(zscore) else None,
+        )
+    return list(alerts.values())
@@ -17,6 +17,72 @@ class PetappConfig(AppConfig):
             if model in admin.site._registry:
                 admin.site.unregister(model)
 
+        # 飼主姓名、帳號、電話變更時同步診所搜尋索引，並讓相關診所的快取換版本
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_save, post_delete
+        from .models import Profile, VetDoctor, VetClinic
+
+        post_save.connect(owner_search_index_handler, sender=User, dispatch_uid='petapp_user_search_index')
+        post_save.connect(owner_search_index_handler, sender=Profile, dispatch_uid='petapp_profile_search_index')
+
+        # 身分資料變動時讓 session 內的身分快照失效（見 petapp.middleware）
+        for model in (Profile, VetDoctor, VetClinic):
+            post_save.connect(identity_version_handler, sender=model, dispatch_uid=f'petapp_identity_{model.__name__}_save')
+            post_delete.connect(identity_version_handler, sender=model, dispatch_uid=f'petapp_identity_{model.__name__}_delete')
+
+        # 寵物與健康紀錄異動寫入同步紀錄（離線 App 差異同步，見 petapp.sync）
+        from .models import Pet, DailyRecord, VaccineRecord, DewormRecord, Report
+
+        for model in (Pet, DailyRecord, VaccineRecord, DewormRecord, Report):
+            post_save.connect(sync_change_handler, sender=model, dispatch_uid=f'petapp_sync_{model.__name__}_save')
+            post_delete.connect(sync_change_handler, sender=model, dispatch_uid=f'petapp_sync_{model.__name__}_delete')
+
+
+def owner_search_index_handler(sender, instance, created, **kwargs):
+    """User 或 Profile 儲存後，重建該飼主在各診所的搜尋索引，並換相關診所的快取版本（預約列表含姓名）"""
+    if created or kwargs.get('raw'):
+        return
+    from .models import ClinicSearchToken, bump_user_clinic_cache_versions
+
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {
+        'first_name', 'last_name', 'username', 'phone_number'
+    }.intersection(update_fields):
+        return
+    user_id = getattr(instance, 'user_id', instance.pk)
+    ClinicSearchToken.schedule_owner(user_id)
+    bump_user_clinic_cache_versions(user_id)
+
+def identity_version_handler(sender, instance, **kwargs):
+    """Profile、VetDoctor 變動換使用者的身分版本，VetClinic 變動換診所的身分版本"""
+    from .models import VetClinic, bump_identity_version
+
+    if isinstance(instance, VetClinic):
+        bump_identity_version(clinic_id=instance.pk)
+    else:
+        bump_identity_version(user_id=instance.user_id)
+
+def sync_change_handler(sender, instance, **kwargs):
+    """post_save 記為 upsert、post_delete 記為 delete"""
+    from django.contrib.auth.models import User
+    from django.db.models import QuerySet
+    from .models import Pet, SyncChange
+
+    if kwargs.get('raw'):
+        return
+    deleted = 'created' not in kwargs
+    origin = kwargs.get('origin')
+    if deleted and origin is not None:
+        origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+        # 帳號刪除時不需要同步；寵物刪除時連帶刪除的紀錄由寵物的墓碑涵蓋
+        if origin_model is User or (origin_model is Pet and sender is not Pet):
+            return
+
+    owner_id = instance.owner_id if sender is Pet else instance.pet.owner_id
+    SyncChange.record(
+        owner_id, SyncChange.MODEL_NAMES[sender.__name__], [instance.pk], 'delete' if deleted else 'upsert'
+    )
+
 @receiver(email_confirmed)
 def email_confirmed_handler(request, email_address, **kwargs):
     """確保郵件確認後狀態正確更新"""
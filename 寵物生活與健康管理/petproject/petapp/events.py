@@ -0,0 +1,160 @@
+# petapp/events.py
+"""
+即時事件推播（Server-Sent Events）
+
+預約建立、取消、確認等變動在交易提交後發佈到頻道，/api/events/stream/ 的 SSE 連線訂閱自己的頻道：
+  user:<user_id>      飼主本人
+  doctor:<doctor_id>  看診獸醫師
+  clinic:<clinic_id>  診所管理員
+閒置連線只是在 asyncio.Queue 上等待，不會查資料庫。
+
+後端可由 settings.EVENT_BROKER_BACKEND 切換：
+  petapp.events.MemoryBackend（預設，單一程序）
+  petapp.events.RedisBackend（多程序／多台主機，需安裝 redis 套件）
+"""
+
+import asyncio
+import json
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+class MemoryBackend:
+    """程序內的事件中心：每個訂閱者一個 asyncio.Queue，可從任何執行緒發佈"""
+
+    QUEUE_SIZE = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> {queue: loop}
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, {}).items())
+        for queue, loop in targets:
+            loop.call_soon_threadsafe(self._put, queue, message)
+
+    @staticmethod
+    def _put(queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass  # 前端太慢就丟掉，反正收到下一個事件時會重新整理
+
+    async def subscribe(self, channels):
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, {})[queue] = loop
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            with self._lock:
+                for channel in channels:
+                    subscribers = self._subscribers.get(channel, {})
+                    subscribers.pop(queue, None)
+                    if not subscribers:
+                        self._subscribers.pop(channel, None)
+
+
+class RedisBackend:
+    """以 Redis pub/sub 跨程序轉發事件（位置為 EVENT_BROKER_LOCATION，未設定時沿用 redis 快取位置）"""
+
+    PREFIX = 'petapp:events:'
+
+    def __init__(self):
+        import redis
+        import redis.asyncio
+
+        self.location = getattr(settings, 'EVENT_BROKER_LOCATION', None)
+        if not self.location:
+            cache_location = settings.CACHES.get('default', {}).get('LOCATION', '')
+            self.location = cache_location if str(cache_location).startswith('redis') else 'redis://127.0.0.1:6379/1'
+        self._client = redis.Redis.from_url(self.location)
+        self._async_redis = redis.asyncio
+
+    def publish(self, channel, message):
+        self._client.publish(self.PREFIX + channel, message)
+
+    async def subscribe(self, channels):
+        client = self._async_redis.Redis.from_url(self.location)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*[self.PREFIX + channel for channel in channels])
+        try:
+            async for item in pubsub.listen():
+                if item.get('type') == 'message':
+                    data = item['data']
+                    yield data.decode('utf-8') if isinstance(data, bytes) else data
+        finally:
+            await pubsub.unsubscribe()
+            await client.aclose()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                path = getattr(settings, 'EVENT_BROKER_BACKEND', 'petapp.events.MemoryBackend')
+                _backend = import_string(path)()
+    return _backend
+
+
+def publish(channels, event_type, data=None):
+    """
+    立即發佈事件到多個頻道；推播失敗不影響主要流程
+    同一事件可能經由多個頻道送到同一位使用者，訂閱端以 id 去除重複
+    """
+    message = json.dumps({'id': uuid.uuid4().hex, 'type': event_type, 'data': data or {}}, ensure_ascii=False)
+    backend = get_backend()
+    for channel in set(channels):
+        try:
+            backend.publish(channel, message)
+        except Exception as e:
+            print(f"❌ 事件推播失敗 {channel}: {e}")
+
+
+def subscribe(channels):
+    return get_backend().subscribe(list(channels))
+
+
+def publish_appointment_event(appointment, event_type, appointment_id=None):
+    """
+    預約變動事件：交易提交後推給飼主、看診醫師與診所管理員
+    明天的預約有變動時，另外送 tomorrow_count 讓通知徽章重新整理
+    已刪除的預約 pk 會是 None，需另外傳入 appointment_id
+    """
+    slot = appointment.slot
+    channels = [
+        f'user:{appointment.owner_id}',
+        f'doctor:{slot.doctor_id}',
+        f'clinic:{slot.clinic_id}',
+    ]
+    data = {
+        'appointment_id': appointment_id or appointment.pk,
+        'status': appointment.status,
+        'date': slot.date.isoformat(),
+        'start_time': slot.start_time.strftime('%H:%M'),
+        'clinic_id': slot.clinic_id,
+        'doctor_id': slot.doctor_id,
+    }
+    is_tomorrow = slot.date == timezone.localdate() + timedelta(days=1)
+
+    def send():
+        publish(channels, event_type, data)
+        if is_tomorrow:
+            publish(channels[:2], 'tomorrow_count', {'date': data['date']})
+
+    transaction.on_commit(send)
@@ -6,13 +6,17 @@ from django.contrib.auth import login
 from .models import (
     VetClinic, VetDoctor, Profile, Pet, Species, SterilizationStatus, 
     Gender, DailyRecord, VaccineRecord, DewormRecord, Report, 
-    MedicalRecord, VetSchedule, AppointmentSlot, VetAppointment,VetScheduleException
+    MedicalRecord, VetSchedule, AppointmentSlot, VetAppointment,VetScheduleException,
+    SlotHold,
 )
 from allauth.account.forms import SignupForm
 import re
 import requests
 from datetime import date, time, datetime, timedelta
-from django.db import transaction
+from django.db import models, transaction
+from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 # 縣市選項常數
 CITY_CHOICES = [
@@ -861,6 +865,9 @@ class AppointmentBookingForm(forms.Form):
         }),
         help_text='如需變更預約時的聯絡電話'
     )
+
+    # 選擇時段時取得的保留代碼（由前端自動填入）
+    hold_token = forms.CharField(required=False, widget=forms.HiddenInput())
     
     def __init__(self, *args, **kwargs):
         # 處理自定義參數
@@ -893,7 +900,18 @@ class AppointmentBookingForm(forms.Form):
                     clinic_id=clinic_id,
                     date=appointment_date,
                     is_available=True
-                ).filter(current_bookings__lt=models.F('max_bookings'))
+                )
+
+                # 未額滿的時段，或自己目前保留中的時段（保留會計入預約數）
+                open_slots = Q(current_bookings__lt=models.F('max_bookings'))
+                hold_token = self.data.get('hold_token')
+                if hold_token and self.user:
+                    open_slots |= Q(
+                        holds__token=hold_token,
+                        holds__user=self.user,
+                        holds__expires_at__gt=timezone.now()
+                    )
+                slots_query = slots_query.filter(open_slots).distinct()
                 
                 if doctor_id:
                     slots_query = slots_query.filter(doctor_id=doctor_id)
@@ -931,8 +949,9 @@ class AppointmentBookingForm(forms.Form):
         time_slot = cleaned_data.get('time_slot')
         
         if time_slot:
-            # 驗證時段是否仍可預約
-            if not time_slot.can_book():
+            # 驗證時段是否仍可預約（自己保留中的時段視為可預約）
+            holding = SlotHold.is_held_by(cleaned_data.get('hold_token'), self.user, time_slot)
+            if not holding and not time_slot.can_book():
                 raise ValidationError('此時段已被預約，請重新選擇')
             
             # 如果指定了醫師，確認時段屬於該醫師
@@ -0,0 +1,42 @@
+# petapp/management/commands/backfill_measurement_values.py
+
+from django.core.management.base import BaseCommand
+
+from petapp.models import DailyRecord
+
+
+class Command(BaseCommand):
+    help = '將既有體溫／體重紀錄的文字內容解析後寫入數值欄位（DailyRecord.value），可重複執行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='每批處理筆數')
+        parser.add_argument('--all', action='store_true', help='重新解析全部紀錄（預設只處理 value 為空的）')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        records = DailyRecord.objects.filter(category__in=DailyRecord.MEASUREMENT_CATEGORIES)
+        if not options['all']:
+            records = records.filter(value__isnull=True)
+
+        updated = skipped = 0
+        last_id = 0
+        while True:
+            batch = list(
+                records.filter(id__gt=last_id).order_by('id').only('id', 'category', 'content', 'value')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            changed = []
+            for record in batch:
+                value = DailyRecord.parse_value(record.category, record.content)
+                if value is None:
+                    skipped += 1
+                if value != record.value:
+                    record.value = value
+                    changed.append(record)
+            DailyRecord.objects.bulk_update(changed, ['value'], batch_size=500)
+            updated += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ 已回填 {updated} 筆量測數值，{skipped} 筆內容無法解析"))
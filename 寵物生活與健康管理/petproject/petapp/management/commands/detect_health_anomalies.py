@@ -0,0 +1,40 @@
+# petapp/management/commands/detect_health_anomalies.py
+
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from petapp.anomaly import detect
+from petapp.models import HealthAlert, refresh_notification_counts
+
+
+class Command(BaseCommand):
+    help = '每日執行：以近期基準偵測體溫／體重異常，寫入健康異常提醒（重跑同期間會覆蓋結果）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1, help='偵測最近幾天的量測（含今天）')
+        parser.add_argument('--baseline-days', type=int, default=30, help='基準期天數')
+        parser.add_argument('--date', help='偵測的最後一天（YYYY-MM-DD，預設今天）')
+
+    def handle(self, *args, **options):
+        until = datetime.strptime(options['date'], '%Y-%m-%d').date() if options['date'] else timezone.localdate()
+        score_from = until - timedelta(days=max(1, options['days']) - 1)
+
+        started = time.monotonic()
+        alerts = detect(score_from, until, baseline_days=max(1, options['baseline_days']))
+        elapsed = time.monotonic() - started
+
+        with transaction.atomic():
+            stale = HealthAlert.objects.filter(date__range=(score_from, until))
+            owner_ids = set(stale.values_list('owner_id', flat=True))
+            stale.delete()
+            HealthAlert.objects.bulk_create(alerts, batch_size=1000)
+            owner_ids.update(alert.owner_id for alert in alerts)
+            refresh_notification_counts(owner_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {score_from} ~ {until} 偵測完成：{len(alerts)} 筆異常提醒，{len(owner_ids)} 位飼主，計算 {elapsed:.2f} 秒"
+        ))
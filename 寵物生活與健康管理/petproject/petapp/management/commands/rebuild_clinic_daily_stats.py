@@ -0,0 +1,75 @@
+# petapp/management/commands/rebuild_clinic_daily_stats.py
+
+from collections import defaultdict
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from petapp.models import AppointmentSlot, VetAppointment, ClinicDailyStats, minutes_between
+
+
+class Command(BaseCommand):
+    help = '由預約與時段原始資料重建診所每日統計（ClinicDailyStats），可指定診所與日期範圍'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clinic', type=int, help='只重建指定診所 ID')
+        parser.add_argument('--from', dest='date_from', help='開始日期 YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', help='結束日期 YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        try:
+            date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date() if options['date_from'] else None
+            date_to = datetime.strptime(options['date_to'], '%Y-%m-%d').date() if options['date_to'] else None
+        except ValueError:
+            raise CommandError('日期格式錯誤，請使用 YYYY-MM-DD')
+
+        scope = {}
+        if options['clinic']:
+            scope['clinic_id'] = options['clinic']
+        if date_from:
+            scope['date__gte'] = date_from
+        if date_to:
+            scope['date__lte'] = date_to
+        slot_scope = {f'slot__{key}': value for key, value in scope.items()}
+
+        rows = defaultdict(lambda: defaultdict(int))
+
+        appointments = VetAppointment.objects.filter(**slot_scope).values_list(
+            'slot__clinic_id', 'slot__doctor_id', 'slot__date',
+            'slot__start_time', 'slot__end_time', 'status'
+        )
+        for clinic_id, doctor_id, day, start_time, end_time, status in appointments.iterator(chunk_size=2000):
+            row = rows[(clinic_id, doctor_id, day)]
+            if status in ClinicDailyStats.STATUS_FIELDS:
+                row[status] += 1
+            if status in ClinicDailyStats.ACTIVE_STATUSES:
+                row['booked_minutes'] += minutes_between(start_time, end_time)
+
+        slots = AppointmentSlot.objects.filter(is_available=True, **scope).values_list(
+            'clinic_id', 'doctor_id', 'date', 'start_time', 'end_time', 'max_bookings'
+        )
+        for clinic_id, doctor_id, day, start_time, end_time, max_bookings in slots.iterator(chunk_size=2000):
+            rows[(clinic_id, doctor_id, day)]['capacity_minutes'] += minutes_between(start_time, end_time) * max_bookings
+
+        with transaction.atomic():
+            existing = ClinicDailyStats.objects.select_for_update().filter(**scope)
+
+            # 取消預約在本系統會直接刪除，原始資料已無法還原，保留既有的取消計數
+            kept_cancelled = {
+                (clinic_id, doctor_id, day): cancelled
+                for clinic_id, doctor_id, day, cancelled in existing.values_list(
+                    'clinic_id', 'doctor_id', 'date', 'cancelled'
+                )
+            }
+            for key, cancelled in kept_cancelled.items():
+                if cancelled:
+                    rows[key]['cancelled'] = max(rows[key]['cancelled'], cancelled)
+
+            existing.delete()
+            ClinicDailyStats.objects.bulk_create([
+                ClinicDailyStats(clinic_id=clinic_id, doctor_id=doctor_id, date=day, **counts)
+                for (clinic_id, doctor_id, day), counts in rows.items()
+            ], batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ 已重建 {len(rows)} 筆診所每日統計"))
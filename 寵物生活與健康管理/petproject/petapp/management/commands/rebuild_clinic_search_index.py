@@ -0,0 +1,16 @@
+# petapp/management/commands/rebuild_clinic_search_index.py
+
+from django.core.management.base import BaseCommand
+
+from petapp.models import ClinicSearchToken
+
+
+class Command(BaseCommand):
+    help = '由預約、寵物、飼主資料重建診所櫃台搜尋索引（ClinicSearchToken），可指定診所'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clinic', type=int, help='只重建指定診所 ID')
+
+    def handle(self, *args, **options):
+        count = ClinicSearchToken.rebuild(clinic_id=options['clinic'])
+        self.stdout.write(self.style.SUCCESS(f"✅ 已重建 {count} 筆搜尋索引項目"))
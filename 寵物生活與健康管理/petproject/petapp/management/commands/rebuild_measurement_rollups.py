@@ -0,0 +1,44 @@
+# petapp/management/commands/rebuild_measurement_rollups.py
+
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from petapp.models import DailyRecord, MeasurementRollup
+
+
+class Command(BaseCommand):
+    help = '由體溫／體重原始紀錄重建日、週、月彙總（MeasurementRollup），可指定寵物'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pet', type=int, help='只重建指定寵物 ID')
+
+    def handle(self, *args, **options):
+        scope = {}
+        if options['pet']:
+            scope['pet_id'] = options['pet']
+
+        records = DailyRecord.objects.filter(
+            category__in=DailyRecord.MEASUREMENT_CATEGORIES, value__isnull=False, **scope
+        ).order_by('date', 'created_at').values_list('pet_id', 'category', 'date', 'value')
+
+        buckets = defaultdict(list)
+        for pet_id, kind, record_date, value in records.iterator(chunk_size=5000):
+            for period in MeasurementRollup.PERIODS:
+                bucket_start, _ = MeasurementRollup.bucket_range(period, record_date)
+                buckets[(pet_id, kind, period, bucket_start)].append(value)
+
+        rows = [
+            MeasurementRollup(
+                pet_id=pet_id, kind=kind, period=period, bucket_start=bucket_start,
+                **MeasurementRollup.summarize(points)
+            )
+            for (pet_id, kind, period, bucket_start), points in buckets.items()
+        ]
+
+        with transaction.atomic():
+            MeasurementRollup.objects.filter(**scope).delete()
+            MeasurementRollup.objects.bulk_create(rows, batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ 已重建 {len(rows)} 筆量測彙總"))
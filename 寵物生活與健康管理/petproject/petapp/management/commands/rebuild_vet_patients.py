@@ -0,0 +1,45 @@
+# petapp/management/commands/rebuild_vet_patients.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Min
+
+from petapp.models import VetPatient
+
+
+class Command(BaseCommand):
+    help = '由預約原始資料重建獸醫師看診病患表（VetPatient），可指定醫師'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, help='只重建指定醫師 ID')
+
+    def handle(self, *args, **options):
+        scope = {}
+        if options['doctor']:
+            scope['doctor_id'] = options['doctor']
+        slot_scope = {f'slot__{key}': value for key, value in scope.items()}
+
+        summaries = VetPatient.visits().filter(**slot_scope).values(
+            'slot__doctor_id', 'pet_id'
+        ).annotate(
+            first_visit=Min('slot__date'),
+            last_visit=Max('slot__date'),
+            visit_count=Count('id'),
+        ).order_by()
+
+        rows = [
+            VetPatient(
+                doctor_id=row['slot__doctor_id'],
+                pet_id=row['pet_id'],
+                first_visit=row['first_visit'],
+                last_visit=row['last_visit'],
+                visit_count=row['visit_count'],
+            )
+            for row in summaries.iterator(chunk_size=2000)
+        ]
+
+        with transaction.atomic():
+            VetPatient.objects.filter(**scope).delete()
+            VetPatient.objects.bulk_create(rows, batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ 已重建 {len(rows)} 筆看診病患紀錄"))
@@ -0,0 +1,15 @@
+# petapp/management/commands/rollover_notification_counts.py
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from petapp.models import prime_notification_counts
+
+
+class Command(BaseCommand):
+    help = '每日午夜執行：以分組查詢預先算好當天所有使用者的通知計數並寫入快取（建議接在 sweep_care_reminders 之後）'
+
+    def handle(self, *args, **options):
+        day = timezone.localdate()
+        count = prime_notification_counts(day)
+        self.stdout.write(self.style.SUCCESS(f"✅ {day} 已預熱 {count} 位使用者的通知計數"))
@@ -1,45 +1,147 @@
 # petapp/management/commands/send_appointment_reminders.py
 
-from django.core.management.base import BaseCommand
-from django.utils.timezone import now
-from django.core.mail import send_mail
-from petapp.models import VetAppointment
-from datetime import timedelta
+import time as time_module
+from datetime import datetime, timedelta
+
 from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.timezone import localdate
+
+from petapp.models import VetAppointment
+
 
 class Command(BaseCommand):
-    help = 'Send email reminders to owners one day before appointments'
+    help = '寄送看診前一天的提醒信：分批查詢、共用同一個 SMTP 連線，寄出後標記 reminder_sent，可安全重跑'
 
-    def handle(self, *args, **kwargs):
-        tomorrow = now().date() + timedelta(days=1)
-        appointments = VetAppointment.objects.filter(date=tomorrow)
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='看診日期 YYYY-MM-DD（預設明天）')
+        parser.add_argument('--batch-size', type=int, default=200, help='每批寄送封數（預設 200）')
+        parser.add_argument('--dry-run', action='store_true', help='只列出會寄送的數量，不寄信也不標記')
 
-        for appt in appointments:
-            owner = appt.owner
-            pet = appt.pet
-            vet = appt.vet
+    def handle(self, *args, **options):
+        try:
+            target_date = (
+                datetime.strptime(options['date'], '%Y-%m-%d').date() if options['date']
+                else localdate() + timedelta(days=1)
+            )
+        except ValueError:
+            raise CommandError('日期格式錯誤，請使用 YYYY-MM-DD')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('batch-size 必須大於 0')
 
-            subject = f"【毛日好】提醒您明日看診：{pet.name}"
-            message = f"""親愛的 {owner.last_name or ''}{owner.first_name or owner.username}，您好：
+        pending = VetAppointment.objects.filter(
+            slot__date=target_date,
+            status__in=['pending', 'confirmed'],
+            reminder_sent=False
+        )
+        if options['dry_run']:
+            self.stdout.write(f"🧪 {target_date} 尚有 {pending.count()} 筆預約未寄提醒")
+            return
 
-這是您預約的提醒通知：
+        totals = {'sent': 0, 'skipped': 0, 'failed': 0}
+        started = time_module.perf_counter()
+        connection = get_connection(fail_silently=False)
+        last_id = 0
+        batch_no = 0
 
-🐾 寵物：{pet.name}  
-📅 日期：{appt.date}  
-🕒 時間：{appt.time.strftime('%H:%M')}  
-🏥 診所：{vet.clinic_name or '（未填寫）'}
+        try:
+            while True:
+                batch_started = time_module.perf_counter()
+                claimed = self._claim_batch(pending, last_id, batch_size)
+                if not claimed:
+                    break
+                batch_no += 1
+                last_id = claimed[-1].id
 
-請準時到診，如需取消請盡早操作，謝謝您！
+                messages, skipped_ids = self._build_messages(claimed, connection)
+                sent, failed = self._send(connection, messages)
 
-— 毛日好（Paw&Day）系統
-"""
+                totals['sent'] += sent
+                totals['skipped'] += len(skipped_ids)
+                totals['failed'] += failed
+                self.stdout.write(
+                    f"  第 {batch_no} 批：取得 {len(claimed)} 筆，寄出 {sent}，"
+                    f"無信箱略過 {len(skipped_ids)}，失敗 {failed}，"
+                    f"耗時 {(time_module.perf_counter() - batch_started) * 1000:.0f} ms"
+                )
+        finally:
+            connection.close()
 
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [owner.email],
-                fail_silently=False
+        elapsed = time_module.perf_counter() - started
+        summary = (
+            f"{target_date} 提醒信：寄出 {totals['sent']} 封，略過 {totals['skipped']} 筆，"
+            f"失敗 {totals['failed']} 封，共 {batch_no} 批，耗時 {elapsed:.2f} 秒"
+        )
+        if totals['failed']:
+            self.stdout.write(self.style.WARNING(f"⚠️ {summary}（失敗的預約已還原，可重新執行補寄）"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"✅ {summary}"))
+
+    def _claim_batch(self, pending, last_id, batch_size):
+        """
+        鎖住下一批未寄送的預約並先標記 reminder_sent，
+        同時執行多個排程也不會重複寄送（skip_locked 跳過別人正在處理的列）
+        """
+        with transaction.atomic():
+            batch = list(
+                pending.filter(id__gt=last_id)
+                .select_related('pet', 'owner', 'slot__clinic', 'slot__doctor__user')
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('id')[:batch_size]
             )
+            if batch:
+                VetAppointment.objects.filter(id__in=[appt.id for appt in batch]).update(reminder_sent=True)
+        return batch
+
+    def _build_messages(self, appointments, connection):
+        messages = []
+        skipped_ids = []
+        for appt in appointments:
+            recipient = appt.contact_email or appt.owner.email
+            if not recipient:
+                skipped_ids.append(appt.id)
+                continue
+
+            owner = appt.owner
+            doctor_user = appt.slot.doctor.user
+            context = {
+                'owner_name': f"{owner.last_name or ''}{owner.first_name or ''}" or owner.username,
+                'pet_name': appt.pet.name,
+                'date': appt.slot.date,
+                'start_time': appt.slot.start_time,
+                'clinic_name': appt.slot.clinic.clinic_name,
+                'clinic_address': appt.slot.clinic.clinic_address,
+                'clinic_phone': appt.slot.clinic.clinic_phone,
+                'doctor_name': doctor_user.get_full_name() or doctor_user.username,
+            }
+            subject = render_to_string('appointments/email/reminder_subject.txt', context).strip()
+            body = render_to_string('appointments/email/reminder_message.txt', context)
+            message = EmailMessage(
+                subject, body, settings.DEFAULT_FROM_EMAIL, [recipient], connection=connection
+            )
+            message.appointment_id = appt.id
+            messages.append(message)
+        return messages, skipped_ids
+
+    def _send(self, connection, messages):
+        """
+        共用同一個連線逐封寄出（與 send_outbox_emails 相同），
+        只還原寄送失敗那幾筆的 reminder_sent，重跑時不會重寄已送達的提醒
+        """
+        failed_ids = []
+        for message in messages:
+            try:
+                if not connection.send_messages([message]):
+                    failed_ids.append(message.appointment_id)
+            except Exception as e:
+                print(f"❌ 提醒信寄送失敗（預約 {message.appointment_id}）: {e}")
+                connection.close()  # 連線可能已壞，下一封重新連線
+                failed_ids.append(message.appointment_id)
 
-        self.stdout.write(self.style.SUCCESS(f"已寄出 {appointments.count()} 封提醒信件"))
+        if failed_ids:
+            VetAppointment.objects.filter(id__in=failed_ids).update(reminder_sent=False)
+        return len(messages) - len(failed_ids), len(failed_ids)
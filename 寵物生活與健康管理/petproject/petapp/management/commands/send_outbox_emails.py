@@ -0,0 +1,120 @@
+# petapp/management/commands/send_outbox_emails.py
+
+import time as time_module
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from petapp.models import EmailOutbox
+
+
+class Command(BaseCommand):
+    help = '寄出待寄信件佇列（EmailOutbox）：共用 SMTP 連線，失敗以指數退避重試；--loop 可常駐執行'
+
+    # 取出後的租約時間，worker 中斷時租約到期會被重新取出
+    LEASE_SECONDS = 600
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='每批取出封數（預設 50）')
+        parser.add_argument('--loop', action='store_true', help='常駐執行，佇列清空後每隔 --interval 秒再檢查')
+        parser.add_argument('--interval', type=float, default=5, help='常駐模式的檢查間隔秒數（預設 5）')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('batch-size 必須大於 0')
+
+        self.max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+        self.backoff_seconds = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_SECONDS', 60)
+        self.backoff_max_seconds = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_MAX_SECONDS', 3600)
+
+        connection = get_connection(fail_silently=False)
+        totals = {'sent': 0, 'retry': 0, 'failed': 0}
+        try:
+            while True:
+                batch = self._claim_batch(batch_size)
+                if batch:
+                    started = time_module.perf_counter()
+                    result = self._send_batch(connection, batch)
+                    for key, value in result.items():
+                        totals[key] += value
+                    self.stdout.write(
+                        f"  寄出 {result['sent']}，稍後重試 {result['retry']}，放棄 {result['failed']}，"
+                        f"耗時 {(time_module.perf_counter() - started) * 1000:.0f} ms"
+                    )
+                    continue
+
+                if not options['loop']:
+                    break
+                # 閒置時關閉連線，避免 SMTP 伺服器逾時斷線
+                connection.close()
+                time_module.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('⏹️ 已停止')
+        finally:
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ 待寄信件：寄出 {totals['sent']} 封，稍後重試 {totals['retry']} 封，放棄 {totals['failed']} 封"
+        ))
+
+    def _claim_batch(self, batch_size):
+        """取出到期的待寄信件並延後 next_attempt_at（租約），多個 worker 同時執行也不會重複寄送"""
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                EmailOutbox.objects.filter(status='pending', next_attempt_at__lte=now)
+                .select_for_update(skip_locked=True)
+                .order_by('next_attempt_at', 'id')[:batch_size]
+            )
+            if batch:
+                EmailOutbox.objects.filter(id__in=[email.id for email in batch]).update(
+                    attempts=F('attempts') + 1,
+                    next_attempt_at=now + timedelta(seconds=self.LEASE_SECONDS)
+                )
+                for email in batch:
+                    email.attempts += 1
+        return batch
+
+    def _send_batch(self, connection, batch):
+        result = {'sent': 0, 'retry': 0, 'failed': 0}
+        for email in batch:
+            message = EmailMessage(
+                email.subject,
+                email.body,
+                email.from_email or settings.DEFAULT_FROM_EMAIL,
+                email.recipients,
+                connection=connection
+            )
+            try:
+                # 逐封送出才能分辨失敗的是哪一封，但共用同一個已開啟的連線
+                connection.send_messages([message])
+            except Exception as e:
+                print(f"❌ 信件 #{email.id} 寄送失敗（第 {email.attempts} 次）: {e}")
+                connection.close()  # 連線可能已壞，下一封重新連線
+                result[self._mark_failed(email, e)] += 1
+                continue
+
+            EmailOutbox.objects.filter(pk=email.pk).update(
+                status='sent', sent_at=timezone.now(), last_error=''
+            )
+            result['sent'] += 1
+        return result
+
+    def _mark_failed(self, email, error):
+        """未超過次數上限就依指數退避排定下次寄送，否則標記為失敗"""
+        if email.attempts >= self.max_attempts:
+            EmailOutbox.objects.filter(pk=email.pk).update(status='failed', last_error=str(error))
+            return 'failed'
+
+        delay = min(self.backoff_seconds * 2 ** (email.attempts - 1), self.backoff_max_seconds)
+        EmailOutbox.objects.filter(pk=email.pk).update(
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+            last_error=str(error)
+        )
+        return 'retry'
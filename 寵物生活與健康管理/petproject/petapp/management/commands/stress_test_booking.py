@@ -0,0 +1,131 @@
+# petapp/management/commands/stress_test_booking.py
+
+import threading
+import time as time_module
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from petapp.models import (
+    VetClinic, VetDoctor, AppointmentSlot, VetAppointment, Pet,
+    Species, SterilizationStatus, Gender,
+)
+
+
+class Command(BaseCommand):
+    help = '對同一個預約時段發出 N 筆併發預約，驗證不會超賣並回報吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attempts', type=int, default=50, help='併發預約筆數（預設 50）')
+        parser.add_argument('--workers', type=int, default=16, help='同時執行的執行緒數（預設 16）')
+        parser.add_argument('--capacity', type=int, default=1, help='時段最大預約數（預設 1）')
+        parser.add_argument('--keep', action='store_true', help='保留測試資料（預設會清除）')
+
+    def handle(self, *args, **options):
+        attempts = options['attempts']
+        workers = options['workers']
+        capacity = options['capacity']
+        if attempts < 1 or workers < 1 or capacity < 1:
+            raise CommandError('attempts、workers、capacity 都必須大於 0')
+
+        run_id = uuid.uuid4().hex[:8]
+        clinic, slot, pets = self._create_fixtures(run_id, attempts, capacity)
+        self.stdout.write(f"🧪 [{run_id}] {attempts} 筆預約 × {workers} 執行緒 → 時段容量 {capacity}")
+
+        results = {'booked': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(min(workers, attempts))
+
+        def book(pet):
+            try:
+                # 讓第一批執行緒同時起跑，盡量製造競爭
+                try:
+                    barrier.wait(timeout=5)
+                except threading.BrokenBarrierError:
+                    pass
+                # 每個執行緒各自讀一份時段，模擬不同請求看到的舊資料
+                slot_copy = AppointmentSlot.objects.get(pk=slot.pk)
+                VetAppointment.objects.create(
+                    pet=pet, owner=pet.owner, slot=slot_copy,
+                    reason='stress test', booking_type='online', status='confirmed'
+                )
+                outcome = 'booked'
+            except ValidationError:
+                outcome = 'rejected'
+            except Exception as e:
+                print(f"❌ 預約發生錯誤: {e}")
+                outcome = 'errors'
+            finally:
+                close_old_connections()
+            with lock:
+                results[outcome] += 1
+
+        started = time_module.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(book, pets))
+        elapsed = time_module.perf_counter() - started
+
+        slot.refresh_from_db()
+        appointment_count = VetAppointment.objects.filter(slot=slot).count()
+
+        self.stdout.write(f"  成功預約：{results['booked']}")
+        self.stdout.write(f"  額滿拒絕：{results['rejected']}")
+        self.stdout.write(f"  其他錯誤：{results['errors']}")
+        self.stdout.write(f"  時段計數：{slot.current_bookings} / {slot.max_bookings}，實際預約 {appointment_count} 筆")
+        self.stdout.write(f"  耗時 {elapsed:.3f} 秒，吞吐量 {attempts / elapsed:.1f} 次/秒")
+
+        overbooked = (
+            appointment_count > slot.max_bookings
+            or slot.current_bookings != appointment_count
+            or results['booked'] != appointment_count
+        )
+
+        if not options['keep']:
+            User.objects.filter(username__startswith=f'stress_{run_id}_').delete()
+            clinic.delete()
+
+        if overbooked:
+            raise CommandError('❌ 偵測到超賣或計數不一致！')
+        self.stdout.write(self.style.SUCCESS('✅ 沒有超賣，計數一致'))
+
+    def _create_fixtures(self, run_id, attempts, capacity):
+        """建立一次性的診所、醫師、時段與飼主寵物"""
+        doctor_user = User.objects.create(
+            username=f'stress_{run_id}_vet', email=f'stress_{run_id}_vet@example.com'
+        )
+        clinic = VetClinic.objects.create(
+            clinic_name=f'壓測診所 {run_id}',
+            license_number=f'STRESS-{run_id}',
+            clinic_phone='0000000000',
+            clinic_address='壓測用地址',
+            clinic_email=f'stress_{run_id}@example.com'
+        )
+        doctor = VetDoctor.objects.create(user=doctor_user, clinic=clinic)
+        slot = AppointmentSlot.objects.create(
+            clinic=clinic,
+            doctor=doctor,
+            date=date.today() + timedelta(days=1),
+            start_time=time(9, 0),
+            end_time=time(9, 30),
+            max_bookings=capacity,
+            source='manual'
+        )
+
+        User.objects.bulk_create([
+            User(username=f'stress_{run_id}_owner{i}', email=f'stress_{run_id}_owner{i}@example.com')
+            for i in range(attempts)
+        ])
+        # bulk_create 在 MySQL 上拿不到主鍵，重新查一次
+        owners = list(User.objects.filter(username__startswith=f'stress_{run_id}_owner'))
+        Pet.objects.bulk_create([
+            Pet(owner=owner, species=Species.DOG, breed='test', name=f'壓測{i}',
+                sterilization_status=SterilizationStatus.UNKNOWN, gender=Gender.UNKNOWN)
+            for i, owner in enumerate(owners)
+        ])
+        pets = list(Pet.objects.filter(owner__in=owners).select_related('owner'))
+        return clinic, slot, pets
@@ -0,0 +1,31 @@
+# petapp/management/commands/sweep_care_reminders.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from petapp.models import CareDueDate, VaccineRecord, DewormRecord
+
+
+class Command(BaseCommand):
+    help = '每日執行：將進入提醒期的疫苗／驅蟲項目標記為提醒中；--rebuild 由施打紀錄重建所有到期日'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='由施打紀錄重建全部到期日（首次上線或調整間隔設定後使用）')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+
+        if options['rebuild']:
+            entries = []
+            for kind, record_model in (('vaccine', VaccineRecord), ('deworm', DewormRecord)):
+                for row in record_model.objects.values('pet_id', 'pet__owner_id').annotate(last_date=Max('date')):
+                    entries.append(CareDueDate.build(row['pet_id'], row['pet__owner_id'], kind, row['last_date'], today))
+            with transaction.atomic():
+                CareDueDate.objects.all().delete()
+                CareDueDate.objects.bulk_create(entries, batch_size=1000)
+            self.stdout.write(self.style.SUCCESS(f"✅ 已重建 {len(entries)} 筆保健到期日"))
+
+        owner_ids = CareDueDate.sweep(today)
+        self.stdout.write(self.style.SUCCESS(f"✅ {today} 新進入提醒期：{len(owner_ids)} 位飼主"))
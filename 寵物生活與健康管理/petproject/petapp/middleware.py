@@ -0,0 +1,137 @@
+# petapp/middleware.py
+"""
+每個請求的使用者身分（request.identity）
+
+登入使用者的 Profile、VetDoctor、VetClinic 以一個 select_related 查詢取回，
+並以 JSON 快照存在 session；快照帶著身分版本號（見 models.get_identity_versions），
+資料沒有變動時後續請求只需讀一次快取，不必再查資料庫。
+版本號必須放在跨程序共用的快取（redis／file）才看得到其他程序的異動，
+因此 locmem 時每個請求都重新查詢；快照也只沿用 IDENTITY_SNAPSHOT_TTL 秒，逾時一律重新查詢。
+取回的物件同時放進 request.user 的關聯快取，request.user.profile、
+request.user.vet_profile.clinic 等舊寫法也不會再觸發查詢。
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import serializers
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Profile, VetDoctor, cache_is_shared, get_identity_versions
+
+SESSION_KEY = '_petapp_identity'
+
+
+class Identity:
+    """使用者身分：profile、vet_profile、clinic 皆可能為 None"""
+
+    def __init__(self, profile=None, vet_profile=None, clinic=None):
+        self.profile = profile
+        self.vet_profile = vet_profile
+        self.clinic = clinic
+
+    @property
+    def account_type(self):
+        return self.profile.account_type if self.profile else None
+
+    @property
+    def is_clinic_admin(self):
+        return bool(self.vet_profile and self.vet_profile.is_clinic_admin)
+
+    def __bool__(self):
+        return any((self.profile, self.vet_profile, self.clinic))
+
+
+def _load(user):
+    """一個查詢取回 Profile、VetDoctor 與所屬診所"""
+    row = User.objects.select_related('profile', 'vet_profile__clinic').filter(pk=user.pk).first()
+    profile = getattr(row, 'profile', None) if row else None
+    vet_profile = getattr(row, 'vet_profile', None) if row else None
+    clinic = vet_profile.clinic if vet_profile else None
+    return Identity(profile, vet_profile, clinic)
+
+
+def _dump(identity):
+    objects = [obj for obj in (identity.profile, identity.vet_profile, identity.clinic) if obj is not None]
+    return serializers.serialize('json', objects)
+
+
+def _restore(data):
+    identity = Identity()
+    for item in serializers.deserialize('json', data):
+        obj = item.object
+        obj._state.adding = False
+        obj._state.db = DEFAULT_DB_ALIAS
+        if isinstance(obj, Profile):
+            identity.profile = obj
+        elif isinstance(obj, VetDoctor):
+            identity.vet_profile = obj
+        else:
+            identity.clinic = obj
+    return identity
+
+
+def _attach(user, identity):
+    """把身分物件放進關聯快取，存取 user.profile 等屬性時不再查詢（沒有的關聯會照常拋出 DoesNotExist）"""
+    User.profile.related.set_cached_value(user, identity.profile)
+    User.vet_profile.related.set_cached_value(user, identity.vet_profile)
+    if identity.profile:
+        Profile.user.field.set_cached_value(identity.profile, user)
+    if identity.vet_profile:
+        VetDoctor.user.field.set_cached_value(identity.vet_profile, user)
+        VetDoctor.clinic.field.set_cached_value(identity.vet_profile, identity.clinic)
+
+
+def get_identity(request):
+    user = request.user
+    if not user.is_authenticated:
+        return Identity()
+
+    if not cache_is_shared():
+        # 版本號只存在於本程序，其他程序的角色／診所異動看不到，不能信任快照
+        request.session.pop(SESSION_KEY, None)
+        identity = _load(user)
+        _attach(user, identity)
+        return identity
+
+    now = time.time()
+    snapshot = request.session.get(SESSION_KEY)
+    if (not snapshot or snapshot.get('user_id') != user.pk
+            or now - snapshot.get('loaded_at', 0) > getattr(settings, 'IDENTITY_SNAPSHOT_TTL', 60)):
+        snapshot = {}
+    # 版本要在查詢之前取得，查詢期間若有異動，下個請求會因版本不同而重新查詢
+    user_version, clinic_version = get_identity_versions(user.pk, snapshot.get('clinic_id'))
+    if snapshot and [snapshot.get('user_version'), snapshot.get('clinic_version')] == [user_version, clinic_version]:
+        try:
+            identity = _restore(snapshot['objects'])
+            _attach(user, identity)
+            return identity
+        except Exception as e:
+            print(f"❌ 身分快照還原失敗，重新查詢: {e}")
+
+    identity = _load(user)
+    clinic_id = identity.clinic.pk if identity.clinic else None
+    if clinic_id != snapshot.get('clinic_id'):
+        _, clinic_version = get_identity_versions(user.pk, clinic_id)
+    request.session[SESSION_KEY] = {
+        'user_id': user.pk,
+        'clinic_id': clinic_id,
+        'user_version': user_version,
+        'clinic_version': clinic_version,
+        'loaded_at': now,
+        'objects': _dump(identity),
+    }
+    _attach(user, identity)
+    return identity
+
+
+class IdentityMiddleware:
+    """放在 AuthenticationMiddleware 之後，未登入時 request.identity 為空身分"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.identity = get_identity(request)
+        return self.get_response(request)
@@ -1,15 +1,24 @@
 # petapp/models.py
 # 匯入 Django 所需模組
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 
+import math
 import requests
+import time as time_module
+import uuid
+from collections import defaultdict
+from calendar import monthrange
 from datetime import datetime, timedelta
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .events import publish_appointment_event
+
 # ===== 全域常數定義
 WEEKDAYS = [
     (0, "星期一"),
@@ -253,6 +262,16 @@ class BusinessHoursRecord(models.Model):
         verbose_name = '診所營業時間'
         verbose_name_plural = '診所營業時間'
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_clinic_cache_version(self.clinic_id)
+
+    def delete(self, *args, **kwargs):
+        clinic_id = self.clinic_id
+        result = super().delete(*args, **kwargs)
+        bump_clinic_cache_version(clinic_id)
+        return result
+
 class VetSchedule(models.Model):
     """獸醫師排班表"""
     
@@ -285,6 +304,16 @@ class VetSchedule(models.Model):
     def clean(self):
         if self.start_time and self.end_time and self.start_time >= self.end_time:
             raise ValidationError('結束時間必須晚於開始時間')
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_clinic_cache_version(self.doctor.clinic_id)
+
+    def delete(self, *args, **kwargs):
+        clinic_id = self.doctor.clinic_id
+        result = super().delete(*args, **kwargs)
+        bump_clinic_cache_version(clinic_id)
+        return result
     
     def __str__(self):
         doctor_name = self.doctor.user.get_full_name() or self.doctor.user.username
@@ -384,6 +413,289 @@ class VetScheduleException(models.Model):
         return f"{self.doctor.user.get_full_name()} - {self.get_exception_type_display()} ({self.start_date} ~ {self.end_date})"
 
 
+class ScheduleTemplate(models.Model):
+    """診所層級的每週排班範本（可一次套用到多位醫師、多週）"""
+
+    clinic = models.ForeignKey(VetClinic, on_delete=models.CASCADE, related_name='schedule_templates')
+    name = models.CharField(max_length=50, verbose_name='範本名稱')
+    description = models.CharField(max_length=200, blank=True, verbose_name='說明')
+    is_active = models.BooleanField(default=True, verbose_name='啟用')
+
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, verbose_name='建立者')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = '排班範本'
+        verbose_name_plural = '排班範本'
+        unique_together = ['clinic', 'name']
+
+    def __str__(self):
+        return f"{self.clinic.clinic_name} - {self.name}"
+
+
+class ScheduleTemplateEntry(models.Model):
+    """排班範本中的單一時段"""
+
+    template = models.ForeignKey(ScheduleTemplate, on_delete=models.CASCADE, related_name='entries')
+    weekday = models.IntegerField(choices=VetSchedule.WEEKDAY_CHOICES, verbose_name='星期')
+    start_time = models.TimeField(verbose_name='開始時間')
+    end_time = models.TimeField(verbose_name='結束時間')
+    appointment_duration = models.IntegerField(default=30, verbose_name='預約時長(分鐘)')
+    max_appointments_per_slot = models.IntegerField(default=1, verbose_name='每時段最大預約數')
+    notes = models.TextField(blank=True, verbose_name='備註')
+
+    class Meta:
+        verbose_name = '排班範本時段'
+        verbose_name_plural = '排班範本時段'
+        ordering = ['weekday', 'start_time']
+
+    # 預約時長的合理範圍（分鐘）；時長 <= 0 會讓時段產生無法結束
+    MIN_DURATION = 5
+    MAX_DURATION = 240
+
+    def clean(self):
+        if self.weekday not in dict(VetSchedule.WEEKDAY_CHOICES):
+            raise ValidationError('星期必須介於 0（星期一）到 6（星期日）')
+        if self.start_time and self.end_time and self.start_time >= self.end_time:
+            raise ValidationError('結束時間必須晚於開始時間')
+        if not self.MIN_DURATION <= self.appointment_duration <= self.MAX_DURATION:
+            raise ValidationError(f'預約時長必須介於 {self.MIN_DURATION} 到 {self.MAX_DURATION} 分鐘')
+        if self.max_appointments_per_slot < 1:
+            raise ValidationError('每時段最大預約數至少為 1')
+
+    def __str__(self):
+        return f"{self.template.name} - {self.get_weekday_display()} {self.start_time}-{self.end_time}"
+
+
+# ===== 診所資料快取版本 =====
+# 診所的預約、時段、排班、營業時間有任何變動就換版本，舊版本的快取自然失效
+def _clinic_cache_version_key(clinic_id):
+    return f'petapp:clinic:{clinic_id}:version'
+
+
+def get_clinic_cache_version(clinic_id):
+    """取得診所目前的快取版本；初始值用時間戳，快取被清掉後重建也不會撞到舊版本"""
+    key = _clinic_cache_version_key(clinic_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time_module.time_ns() // 1000, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_clinic_cache_version(clinic_id):
+    """診所資料變動後換版本（交易提交後才換，避免讀到未提交的資料又被快取）"""
+    def _bump():
+        key = _clinic_cache_version_key(clinic_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time_module.time_ns() // 1000, None)
+
+    if clinic_id:
+        transaction.on_commit(_bump)
+
+
+def bump_user_clinic_cache_versions(user_id):
+    """飼主（含其寵物）或獸醫師的顯示資料變動：換所有相關診所的快取版本（交易提交後才查詢）"""
+    def _bump():
+        clinic_ids = set(VetAppointment.objects.filter(owner_id=user_id).values_list(
+            'slot__clinic_id', flat=True
+        ).distinct())
+        clinic_ids.update(VetDoctor.objects.filter(user_id=user_id).values_list('clinic_id', flat=True))
+        for clinic_id in clinic_ids:
+            bump_clinic_cache_version(clinic_id)
+
+    if user_id:
+        transaction.on_commit(_bump)
+
+
+# ===== 使用者身分快取版本 =====
+# session 內的身分快照（Profile／VetDoctor／VetClinic）帶著版本號，
+# 使用者的 Profile、VetDoctor 或所屬診所資料變動就換版本，下一個請求重新查詢
+def _identity_version_key(scope, object_id):
+    return f'petapp:identity:{scope}:{object_id}:version'
+
+
+def get_identity_versions(user_id, clinic_id=None):
+    """一次取回使用者與診所的身分版本，回傳 (user_version, clinic_version)"""
+    keys = {'user': _identity_version_key('user', user_id)}
+    if clinic_id:
+        keys['clinic'] = _identity_version_key('clinic', clinic_id)
+    found = cache.get_many(keys.values())
+
+    versions = {}
+    for scope, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            cache.add(key, time_module.time_ns() // 1000, None)
+            version = cache.get(key)
+        versions[scope] = version
+    return versions['user'], versions.get('clinic')
+
+
+def bump_identity_version(user_id=None, clinic_id=None):
+    """身分資料變動後換版本（交易提交後才換）"""
+    def _bump():
+        for scope, object_id in (('user', user_id), ('clinic', clinic_id)):
+            if not object_id:
+                continue
+            key = _identity_version_key(scope, object_id)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time_module.time_ns() // 1000, None)
+
+    if user_id or clinic_id:
+        transaction.on_commit(_bump)
+
+
+# ===== 獸醫師工作台統計快取版本 =====
+# 醫師的預約、時段或病歷有變動就換版本，vet_home 的統計快取（依醫師、日期）自然失效
+def _doctor_stats_version_key(doctor_id):
+    return f'petapp:doctor:{doctor_id}:stats_version'
+
+
+def get_doctor_stats_version(doctor_id):
+    key = _doctor_stats_version_key(doctor_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time_module.time_ns() // 1000, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_doctor_stats_version(*doctor_ids):
+    """交易提交後才換版本；需排在 VetPatient.schedule_refresh 之後呼叫，才不會先快取到舊的病患數"""
+    doctor_ids = [doctor_id for doctor_id in doctor_ids if doctor_id]
+
+    def _bump():
+        for doctor_id in doctor_ids:
+            key = _doctor_stats_version_key(doctor_id)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time_module.time_ns() // 1000, None)
+
+    if doctor_ids:
+        transaction.on_commit(_bump)
+
+
+# ===== 通知徽章計數快取 =====
+# 每位使用者每天一個計數：飼主＝明日預約＋提醒中的疫苗／驅蟲，獸醫師／管理員＝明日看診
+# 預約、取消、狀態變更與保健提醒異動時重算；每日午夜由 rollover_notification_counts 預先算好全部非零計數，
+# 快取裡沒有的計數（被淘汰或計數為 0）在第一次讀取時查資料庫並寫回
+# locmem 只存在於單一程序，其他程序重算的結果看不到，因此改用短效期，讓過期計數很快重新查詢
+NOTIFICATION_COUNT_TTL = 60 * 60 * 48
+NOTIFICATION_LOCAL_TTL = 60
+
+
+def cache_is_shared():
+    """預設快取是否跨程序共用（locmem／dummy 只存在於單一程序）"""
+    from django.conf import settings
+    backend = settings.CACHES['default']['BACKEND']
+    return not backend.endswith(('LocMemCache', 'DummyCache'))
+
+
+def _notification_count_key(user_id, day):
+    return f'petapp:notify:{day.isoformat()}:{user_id}'
+
+
+def _notification_count_ttl():
+    return NOTIFICATION_COUNT_TTL if cache_is_shared() else NOTIFICATION_LOCAL_TTL
+
+
+def compute_notification_counts(user_ids=None, day=None):
+    """
+    以分組查詢計算通知數量，回傳 {user_id: count}
+    指定 user_ids 時包含計數為 0 的使用者；未指定時只回傳非零計數（午夜預熱用）
+    """
+    day = day or timezone.localdate()
+    tomorrow = day + timedelta(days=1)
+
+    appointments = VetAppointment.objects.filter(slot__date=tomorrow, status__in=['pending', 'confirmed'])
+    due_items = CareDueDate.objects.filter(is_due=True)
+    alerts = HealthAlert.objects.filter(date__gt=day - timedelta(days=HealthAlert.SHOW_DAYS))
+    if user_ids is not None:
+        user_ids = set(user_ids)
+        appointments = appointments.filter(models.Q(owner_id__in=user_ids) | models.Q(slot__doctor__user_id__in=user_ids))
+        due_items = due_items.filter(owner_id__in=user_ids)
+        alerts = alerts.filter(owner_id__in=user_ids)
+
+    owner_counts = defaultdict(int)
+    doctor_counts = defaultdict(int)
+    for owner_id, doctor_user_id in appointments.values_list('owner_id', 'slot__doctor__user_id'):
+        owner_counts[owner_id] += 1
+        doctor_counts[doctor_user_id] += 1
+    for owner_id, count in due_items.values('owner_id').annotate(
+        count=models.Count('id')
+    ).values_list('owner_id', 'count'):
+        owner_counts[owner_id] += count
+    for owner_id, count in alerts.values('owner_id').annotate(
+        count=models.Count('id')
+    ).values_list('owner_id', 'count'):
+        owner_counts[owner_id] += count
+
+    candidates = user_ids if user_ids is not None else set(owner_counts) | set(doctor_counts)
+    counts = {user_id: 0 for user_id in (user_ids or ())}
+    for user_id, account_type in Profile.objects.filter(user_id__in=candidates).values_list('user_id', 'account_type'):
+        if account_type == 'owner':
+            counts[user_id] = owner_counts.get(user_id, 0)
+        elif account_type in ('veterinarian', 'clinic_admin'):
+            counts[user_id] = doctor_counts.get(user_id, 0)
+    return counts
+
+
+def get_notification_count_cached(user_id, day=None):
+    """讀取通知計數：命中時只有一次快取讀取；沒有計數時查資料庫重算並寫回快取"""
+    day = day or timezone.localdate()
+    key = _notification_count_key(user_id, day)
+    count = cache.get(key)
+    if count is not None:
+        return count
+
+    count = compute_notification_counts([user_id], day).get(user_id, 0)
+    cache.set(key, count, _notification_count_ttl())
+    return count
+
+
+def refresh_notification_counts(user_ids):
+    """交易提交後重算指定使用者當天的通知計數"""
+    user_ids = {user_id for user_id in user_ids if user_id}
+    if not user_ids:
+        return
+
+    def _refresh():
+        day = timezone.localdate()
+        counts = compute_notification_counts(user_ids, day)
+        cache.set_many(
+            {_notification_count_key(user_id, day): count for user_id, count in counts.items()},
+            _notification_count_ttl()
+        )
+
+    transaction.on_commit(_refresh)
+
+
+def prime_notification_counts(day=None):
+    """午夜預熱：寫入當天所有非零計數，回傳寫入筆數"""
+    day = day or timezone.localdate()
+    counts = compute_notification_counts(day=day)
+    ttl = _notification_count_ttl()
+    for start in range(0, len(counts), 1000):
+        chunk = list(counts.items())[start:start + 1000]
+        cache.set_many(
+            {_notification_count_key(user_id, day): count for user_id, count in chunk},
+            ttl
+        )
+    return len(counts)
+
+
+def minutes_between(start_time, end_time):
+    """兩個 time 之間相差的分鐘數"""
+    return (end_time.hour * 60 + end_time.minute) - (start_time.hour * 60 + start_time.minute)
+
+
 class AppointmentSlot(models.Model):
     """預約時段模型"""
     
@@ -411,6 +723,10 @@ class AppointmentSlot(models.Model):
         verbose_name = '預約時段'
         verbose_name_plural = '預約時段'
         unique_together = ['doctor', 'date', 'start_time']
+        indexes = [
+            # 跨診所「最早可預約」搜尋：依 (date, start_time, id) 順序掃描可預約時段
+            models.Index(fields=['is_available', 'date', 'start_time'], name='slot_open_date_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.doctor.user.get_full_name()} - {self.date} {self.start_time}-{self.end_time}"
@@ -418,11 +734,210 @@ class AppointmentSlot(models.Model):
     @property
     def is_fully_booked(self):
         return self.current_bookings >= self.max_bookings
+
+    @property
+    def duration_minutes(self):
+        return minutes_between(self.start_time, self.end_time)
     
     def can_book(self):
         """檢查是否可以預約"""
         return self.is_available and not self.is_fully_booked
 
+    # ===== 月曆可預約摘要（依診所／月份快取）=====
+    MONTH_AVAILABILITY_CACHE_TTL = 300
+
+    @staticmethod
+    def _month_availability_key(clinic_id, year, month):
+        return f'petapp:availability:{clinic_id}:{year}-{month:02d}'
+
+    @classmethod
+    def invalidate_month_availability(cls, clinic_id, start_date, end_date=None):
+        """預約數或時段變動後清除該診所受影響月份的快取，並更新診所快取版本（交易提交後才清）"""
+        bump_clinic_cache_version(clinic_id)
+        end_date = end_date or start_date
+        keys = []
+        year, month = start_date.year, start_date.month
+        while (year, month) <= (end_date.year, end_date.month):
+            keys.append(cls._month_availability_key(clinic_id, year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @classmethod
+    def month_availability(cls, clinic_id, year, month):
+        """
+        某診所某月每天、每位醫師的剩餘名額與最早可預約時間
+        以一次分組聚合取得，結果依診所／月份快取
+        回傳 [{'date', 'doctor_id', 'remaining', 'earliest'}]
+        """
+        key = cls._month_availability_key(clinic_id, year, month)
+        rows = cache.get(key)
+        if rows is None:
+            first_day = datetime(year, month, 1).date()
+            last_day = first_day.replace(day=monthrange(year, month)[1])
+            rows = list(cls.objects.filter(
+                clinic_id=clinic_id,
+                date__range=(first_day, last_day),
+                is_available=True,
+                current_bookings__lt=models.F('max_bookings')
+            ).values('date', 'doctor_id').annotate(
+                remaining=models.Sum(models.F('max_bookings') - models.F('current_bookings')),
+                earliest=models.Min('start_time')
+            ).order_by('date', 'doctor_id'))
+            cache.set(key, rows, cls.MONTH_AVAILABILITY_CACHE_TTL)
+        return rows
+
+    def reserve(self):
+        """
+        原子性佔用一個名額：單一條件式 UPDATE，只有在時段可預約且未滿時才會 +1
+        回傳 True 表示成功佔位，False 表示已額滿或已關閉
+        """
+        updated = AppointmentSlot.objects.filter(
+            pk=self.pk,
+            is_available=True,
+            current_bookings__lt=models.F('max_bookings')
+        ).update(current_bookings=models.F('current_bookings') + 1)
+
+        if updated:
+            # 只同步記憶體中的值，資料庫以 UPDATE 結果為準
+            self.current_bookings += 1
+            self.invalidate_month_availability(self.clinic_id, self.date)
+        return bool(updated)
+
+    def release(self):
+        """原子性釋放一個名額（不會減到負數）"""
+        updated = AppointmentSlot.objects.filter(
+            pk=self.pk,
+            current_bookings__gt=0
+        ).update(current_bookings=models.F('current_bookings') - 1)
+
+        if updated:
+            if self.current_bookings > 0:
+                self.current_bookings -= 1
+            self.invalidate_month_availability(self.clinic_id, self.date)
+        return bool(updated)
+
+
+class SlotHold(models.Model):
+    """
+    預約時段暫時保留：飼主選好時段後先佔住名額，填完表單再以 token 確認
+    保留期間計入 current_bookings，逾期的保留在下次查詢時順手回收（不依賴排程）
+    """
+
+    slot = models.ForeignKey(AppointmentSlot, on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='slot_holds')
+    token = models.CharField(max_length=32, unique=True, verbose_name='保留代碼')
+    expires_at = models.DateTimeField(verbose_name='保留到期時間')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = '時段保留'
+        verbose_name_plural = '時段保留'
+        indexes = [
+            models.Index(fields=['expires_at'], name='slothold_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.slot_id} (至 {self.expires_at})"
+
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+    @staticmethod
+    def default_ttl():
+        from django.conf import settings
+        return getattr(settings, 'SLOT_HOLD_TTL_SECONDS', 300)
+
+    @classmethod
+    def _release(cls, queryset, limit=None):
+        """
+        刪除保留並把名額還給時段：先鎖定要刪的列（skip_locked 避免重複回收），
+        再依時段分組一次扣回
+        """
+        with transaction.atomic():
+            rows = queryset.select_for_update(skip_locked=True).values_list(
+                'id', 'slot_id', 'slot__clinic_id', 'slot__date'
+            )
+            if limit:
+                rows = rows[:limit]
+            rows = list(rows)
+            if not rows:
+                return 0
+
+            cls.objects.filter(id__in=[row[0] for row in rows]).delete()
+
+            per_slot = defaultdict(int)
+            for _, slot_id, clinic_id, slot_date in rows:
+                per_slot[slot_id] += 1
+                AppointmentSlot.invalidate_month_availability(clinic_id, slot_date)
+            for slot_id, count in per_slot.items():
+                AppointmentSlot.objects.filter(pk=slot_id).update(
+                    current_bookings=Greatest(models.F('current_bookings') - count, 0)
+                )
+        return len(rows)
+
+    @classmethod
+    def release_expired(cls, limit=200, slot_id=None):
+        """回收已過期的保留（走 expires_at 索引的範圍查詢）；指定 slot_id 時只回收該時段的保留"""
+        expired = cls.objects.filter(expires_at__lte=timezone.now()).order_by('expires_at')
+        if slot_id:
+            expired = expired.filter(slot_id=slot_id)
+        released = cls._release(expired, limit=limit)
+        if released:
+            print(f"♻️ 已回收 {released} 筆過期時段保留")
+        return released
+
+    @classmethod
+    def place(cls, slot, user, ttl=None):
+        """
+        為使用者保留時段；同一位使用者同時只保留一個時段
+        回傳 SlotHold，若時段已滿則回傳 None
+        """
+        cls.release_expired()
+        expires_at = timezone.now() + timedelta(seconds=ttl or cls.default_ttl())
+
+        # 已經保留同一時段就延長時效
+        existing = cls.objects.filter(user=user, slot=slot, expires_at__gt=timezone.now()).first()
+        if existing:
+            cls.objects.filter(pk=existing.pk).update(expires_at=expires_at)
+            existing.expires_at = expires_at
+            return existing
+
+        # 換時段時先放掉舊的保留
+        cls._release(cls.objects.filter(user=user))
+
+        with transaction.atomic():
+            if not slot.reserve():
+                return None
+            return cls.objects.create(
+                slot=slot,
+                user=user,
+                token=uuid.uuid4().hex,
+                expires_at=expires_at
+            )
+
+    @classmethod
+    def is_held_by(cls, token, user, slot):
+        """檢查 token 是否為該使用者在此時段的有效保留"""
+        if not token:
+            return False
+        return cls.objects.filter(
+            token=token, user=user, slot=slot, expires_at__gt=timezone.now()
+        ).exists()
+
+    @classmethod
+    def confirm(cls, token, user, slot):
+        """
+        將保留轉為正式預約：只刪除保留、不釋放名額（名額直接轉給預約）
+        回傳 True 表示保留有效並已消耗
+        """
+        if not token:
+            return False
+        deleted, _ = cls.objects.filter(
+            token=token, user=user, slot=slot, expires_at__gt=timezone.now()
+        ).delete()
+        return bool(deleted)
+
 
 class VetAppointment(models.Model):
     """預約記錄模型"""
@@ -462,6 +977,9 @@ class VetAppointment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
   
 
+    # 會寫進診所搜尋索引的欄位
+    SEARCH_FIELDS = {'reason', 'notes', 'contact_phone', 'pet', 'owner'}
+
     class Meta:
         verbose_name = '預約記錄'
         verbose_name_plural = '預約記錄'
@@ -469,26 +987,74 @@ class VetAppointment(models.Model):
     def __str__(self):
         return f"{self.pet.name} - {self.slot.doctor.user.get_full_name()} ({self.slot.date} {self.slot.start_time})"
     
-    def save(self, *args, **kwargs):
+    def refresh_notification_counts(self):
+        """明日的預約有異動時，重算飼主與看診醫師的通知計數"""
+        if self.slot.date == timezone.localdate() + timedelta(days=1):
+            refresh_notification_counts([self.owner_id, self.slot.doctor.user_id])
+    
+    def save(self, *args, slot_reserved=False, **kwargs):
+        """slot_reserved=True 表示名額已由 SlotHold 佔好，不需再扣一次"""
         is_new = self.pk is None
-        super().save(*args, **kwargs)
-        
-        # 新預約時更新時段的預約數量
-        if is_new:
-            self.slot.current_bookings += 1
-            self.slot.save()
+        if not is_new:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'status' not in update_fields:
+                super().save(*args, **kwargs)
+                if self.SEARCH_FIELDS.intersection(update_fields):
+                    ClinicSearchToken.schedule_appointment(self.pk)
+                return
+
+            # 狀態變更時同步更新每日統計（鎖住原列取得舊狀態，避免併發重複計算）
+            with transaction.atomic():
+                old_status = VetAppointment.objects.select_for_update().filter(
+                    pk=self.pk
+                ).values_list('status', flat=True).first()
+                super().save(*args, **kwargs)
+                if old_status and old_status != self.status:
+                    ClinicDailyStats.record_status_change(self.slot, old_status, self.status)
+                    publish_appointment_event(
+                        self, 'appointment_confirmed' if self.status == 'confirmed' else 'appointment_status_changed'
+                    )
+                    self.refresh_notification_counts()
+                    VetPatient.schedule_refresh(self.slot.doctor_id, self.pet_id)
+                    bump_doctor_stats_version(self.slot.doctor_id)
+                bump_clinic_cache_version(self.slot.clinic_id)
+                if update_fields is None or self.SEARCH_FIELDS.intersection(update_fields):
+                    ClinicSearchToken.schedule_appointment(self.pk)
+            return
+
+        # 新預約：先以條件式 UPDATE 佔位，再寫入預約，兩者在同一交易內
+        with transaction.atomic():
+            if not slot_reserved and not self.slot.reserve():
+                raise ValidationError('此時段已被預約，請重新選擇')
+            super().save(*args, **kwargs)
+            ClinicDailyStats.record_status_change(self.slot, None, self.status)
+            ClinicSearchToken.schedule_appointment(self.pk)
+            publish_appointment_event(self, 'appointment_created')
+            self.refresh_notification_counts()
+            VetPatient.schedule_refresh(self.slot.doctor_id, self.pet_id)
+            bump_doctor_stats_version(self.slot.doctor_id)
+            # 經 SlotHold 確認的預約不會再呼叫 slot.reserve()，列表與統計快取要在這裡失效
+            bump_clinic_cache_version(self.slot.clinic_id)
     
     def delete(self, *args, **kwargs):
-        # 刪除預約時減少時段的預約數量
-        self.slot.current_bookings -= 1
-        self.slot.save()
-        super().delete(*args, **kwargs)
+        # 刪除預約時原子性減少時段的預約數量（重複刪除不會重複扣）
+        # 本系統取消預約即刪除，統計上視為改成「已取消」
+        status = self.status
+        appointment_id = self.pk  # super().delete() 之後 pk 會變成 None
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            if result[0]:
+                self.slot.release()
+                ClinicDailyStats.record_status_change(self.slot, status, 'cancelled')
+                ClinicSearchToken.remove(self.slot.clinic_id, 'appointment', appointment_id)
+                publish_appointment_event(self, 'appointment_cancelled', appointment_id=appointment_id)
+                self.refresh_notification_counts()
+                VetPatient.schedule_refresh(self.slot.doctor_id, self.pet_id)
+                bump_doctor_stats_version(self.slot.doctor_id)
+        return result
     
     def send_clinic_notification(self):
-        """發送通知給診所"""
-        from django.core.mail import send_mail
-        from django.conf import settings
-        
+        """通知診所有新預約（寫入待寄佇列，由 send_outbox_emails 寄出）"""
         subject = f"【毛日好】新預約通知 - {self.pet.name}"
         message = f"""
 {self.slot.clinic.clinic_name} 您好：
@@ -508,21 +1074,435 @@ class VetAppointment(models.Model):
         """
         
         try:
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [self.slot.clinic.clinic_email],
-                fail_silently=False
+            EmailOutbox.enqueue(
+                subject, message, self.slot.clinic.clinic_email, category='appointment_created'
             )
             self.clinic_notified = True
-            self.save()
+            self.save(update_fields=['clinic_notified'])
             return True
         except Exception as e:
             print(f"發送診所通知失敗: {e}")
             return False
 
 
+class ClinicDailyStats(models.Model):
+    """
+    診所每日統計（依醫師、日期彙總）
+    由預約建立、取消、確認、完成時即時累加；排班產生或移除時段時重算可預約分鐘數。
+    資料不一致時可用 rebuild_clinic_daily_stats 指令重建。
+    """
+
+    STATUS_FIELDS = ('pending', 'confirmed', 'completed', 'cancelled', 'no_show')
+    # 會佔用看診時間的狀態
+    ACTIVE_STATUSES = ('pending', 'confirmed', 'completed', 'no_show')
+
+    clinic = models.ForeignKey(VetClinic, on_delete=models.CASCADE, related_name='daily_stats')
+    doctor = models.ForeignKey(VetDoctor, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField(verbose_name='日期')
+
+    pending = models.IntegerField(default=0, verbose_name='待確認')
+    confirmed = models.IntegerField(default=0, verbose_name='已確認')
+    completed = models.IntegerField(default=0, verbose_name='已完成')
+    cancelled = models.IntegerField(default=0, verbose_name='已取消')
+    no_show = models.IntegerField(default=0, verbose_name='未到診')
+
+    booked_minutes = models.IntegerField(default=0, verbose_name='已預約分鐘數')
+    capacity_minutes = models.IntegerField(default=0, verbose_name='可預約分鐘數')
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = '診所每日統計'
+        verbose_name_plural = '診所每日統計'
+        unique_together = ['clinic', 'doctor', 'date']
+        indexes = [
+            models.Index(fields=['clinic', 'date'], name='clinicstats_clinic_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.clinic_id} - {self.doctor_id} ({self.date})"
+
+    @property
+    def active_appointments(self):
+        return sum(getattr(self, status) for status in self.ACTIVE_STATUSES)
+
+    @classmethod
+    def active_expression(cls, prefix=''):
+        """各有效狀態加總的 F 運算式，可用於 Sum()"""
+        expression = None
+        for status in cls.ACTIVE_STATUSES:
+            field = models.F(f'{prefix}{status}')
+            expression = field if expression is None else expression + field
+        return expression
+
+    @classmethod
+    def record_status_change(cls, slot, old_status, new_status):
+        """
+        依預約狀態變化累加計數：old_status=None 表示新預約
+        以 get_or_create 取得當日列，再用 F() 原子更新
+        """
+        if old_status == new_status:
+            return
+
+        deltas = defaultdict(int)
+        if old_status in cls.STATUS_FIELDS:
+            deltas[old_status] -= 1
+        if new_status in cls.STATUS_FIELDS:
+            deltas[new_status] += 1
+
+        was_active = old_status in cls.ACTIVE_STATUSES
+        is_active = new_status in cls.ACTIVE_STATUSES
+        if was_active != is_active:
+            minutes = slot.duration_minutes
+            deltas['booked_minutes'] += minutes if is_active else -minutes
+
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if not deltas:
+            return
+
+        row, _ = cls.objects.get_or_create(
+            clinic_id=slot.clinic_id, doctor_id=slot.doctor_id, date=slot.date
+        )
+        cls.objects.filter(pk=row.pk).update(
+            updated_at=timezone.now(),
+            **{field: models.F(field) + delta for field, delta in deltas.items()}
+        )
+
+    @classmethod
+    def refresh_capacity(cls, doctor_ids, start_date, end_date):
+        """重新計算指定醫師、日期範圍內的可預約分鐘數（時段新增、刪除或停用後呼叫）"""
+        capacity = defaultdict(int)
+        for clinic_id, doctor_id, day, start_time, end_time, max_bookings in AppointmentSlot.objects.filter(
+            doctor_id__in=doctor_ids,
+            date__range=(start_date, end_date),
+            is_available=True
+        ).values_list('clinic_id', 'doctor_id', 'date', 'start_time', 'end_time', 'max_bookings'):
+            capacity[(clinic_id, doctor_id, day)] += minutes_between(start_time, end_time) * max_bookings
+
+        to_update = []
+        for row in cls.objects.filter(doctor_id__in=doctor_ids, date__range=(start_date, end_date)):
+            minutes = capacity.pop((row.clinic_id, row.doctor_id, row.date), 0)
+            if row.capacity_minutes != minutes:
+                row.capacity_minutes = minutes
+                to_update.append(row)
+
+        # 只更新 capacity_minutes，不會覆蓋同時進行中的計數累加
+        cls.objects.bulk_update(to_update, ['capacity_minutes'], batch_size=500)
+        cls.objects.bulk_create([
+            cls(clinic_id=clinic_id, doctor_id=doctor_id, date=day, capacity_minutes=minutes)
+            for (clinic_id, doctor_id, day), minutes in capacity.items()
+        ], batch_size=500, ignore_conflicts=True)
+        # 工作台的本週工時依時段計算
+        bump_doctor_stats_version(*doctor_ids)
+
+
+class VetPatient(models.Model):
+    """
+    獸醫師看診過的寵物（每位醫師、每隻寵物一列）
+    預約建立、狀態變更、刪除時在交易提交後重算；「我的病患」、權限檢查直接查這張表。
+    資料不一致時可用 rebuild_vet_patients 指令重建。
+    """
+
+    doctor = models.ForeignKey(VetDoctor, on_delete=models.CASCADE, related_name='patients')
+    pet = models.ForeignKey('Pet', on_delete=models.CASCADE, related_name='vet_links')
+    first_visit = models.DateField(verbose_name='首次看診日')
+    last_visit = models.DateField(verbose_name='最近看診日')
+    visit_count = models.IntegerField(default=0, verbose_name='看診次數')
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = '看診病患'
+        verbose_name_plural = '看診病患'
+        unique_together = ['doctor', 'pet']
+        indexes = [
+            models.Index(fields=['doctor', '-last_visit'], name='vetpatient_doctor_last_idx'),
+            models.Index(fields=['doctor', 'first_visit'], name='vetpatient_doctor_first_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor_id} - {self.pet_id} ({self.visit_count})"
+
+    @classmethod
+    def visits(cls):
+        """計入看診紀錄的預約（取消的不算）"""
+        return VetAppointment.objects.exclude(status='cancelled')
+
+    @classmethod
+    def refresh(cls, doctor_id, pet_id):
+        """由預約原始資料重算單一醫師與寵物的看診紀錄，沒有預約就刪除"""
+        summary = cls.visits().filter(slot__doctor_id=doctor_id, pet_id=pet_id).aggregate(
+            first_visit=models.Min('slot__date'),
+            last_visit=models.Max('slot__date'),
+            visit_count=models.Count('id'),
+        )
+        if not summary['visit_count']:
+            cls.objects.filter(doctor_id=doctor_id, pet_id=pet_id).delete()
+            return
+        cls.objects.update_or_create(doctor_id=doctor_id, pet_id=pet_id, defaults=summary)
+
+    @classmethod
+    def schedule_refresh(cls, doctor_id, pet_id):
+        """交易提交後才重算，不拉長預約交易"""
+        transaction.on_commit(lambda: cls.refresh(doctor_id, pet_id))
+
+    @classmethod
+    def has_patient(cls, doctor, pet):
+        return cls.objects.filter(doctor=doctor, pet=pet).exists()
+
+
+class ClinicSearchToken(models.Model):
+    """
+    診所櫃台搜尋索引：每筆預約、寵物、飼主在每間往來診所底下拆成二字元（bigram）詞元，
+    以 (clinic, token) 索引查詢，不必每次都對預約歷史做 LIKE 全表掃描。
+    預約、寵物、飼主資料儲存後會自動更新，資料不一致時可用 rebuild_clinic_search_index 指令重建。
+    """
+
+    KIND_CHOICES = [
+        ('appointment', '預約'),
+        ('pet', '寵物'),
+        ('owner', '飼主'),
+    ]
+
+    # 各欄位的權重：名字、晶片、電話命中比預約原因重要
+    WEIGHTS = {
+        'pet_name': 5,
+        'chip': 5,
+        'owner_name': 4,
+        'phone': 4,
+        'username': 3,
+        'reason': 1,
+        'notes': 1,
+    }
+    MAX_TEXT_LENGTH = 100  # 長文字只取前段建索引，避免詞元暴增
+    MAX_QUERY_TOKENS = 10
+
+    clinic = models.ForeignKey(VetClinic, on_delete=models.CASCADE, related_name='search_tokens')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    token = models.CharField(max_length=8)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        verbose_name = '診所搜尋索引'
+        verbose_name_plural = '診所搜尋索引'
+        unique_together = ['clinic', 'kind', 'object_id', 'token']
+        indexes = [
+            models.Index(fields=['clinic', 'token'], name='searchtoken_clinic_token_idx'),
+            models.Index(fields=['kind', 'object_id'], name='searchtoken_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.clinic_id} {self.kind}:{self.object_id} {self.token}"
+
+    @staticmethod
+    def normalize(text):
+        """轉小寫並移除空白與標點（電話的 - 也會移除），只保留文字與數字"""
+        return ''.join(ch for ch in str(text or '').lower() if ch.isalnum())
+
+    @classmethod
+    def tokenize(cls, text):
+        """拆成二字元詞元；只有一個字時就用該字本身"""
+        text = cls.normalize(text)[:cls.MAX_TEXT_LENGTH]
+        if len(text) == 1:
+            return {text}
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    @staticmethod
+    def _owner_fields(user, phone=None):
+        return {
+            'owner_name': f"{user.first_name} {user.last_name}".strip(),
+            'username': user.username,
+            'phone': phone or '',
+        }
+
+    @classmethod
+    def _weighted_tokens(cls, fields):
+        tokens = {}
+        for field, text in fields.items():
+            weight = cls.WEIGHTS[field]
+            for token in cls.tokenize(text):
+                tokens[token] = max(tokens.get(token, 0), weight)
+        return tokens
+
+    @classmethod
+    def _write(cls, entries):
+        """entries: {(clinic_id, kind, object_id): {欄位: 文字}}，整批替換這些物件的詞元"""
+        if not entries:
+            return
+        with transaction.atomic():
+            for (clinic_id, kind, object_id) in entries:
+                cls.objects.filter(clinic_id=clinic_id, kind=kind, object_id=object_id).delete()
+            cls.objects.bulk_create([
+                cls(clinic_id=clinic_id, kind=kind, object_id=object_id, token=token, weight=weight)
+                for (clinic_id, kind, object_id), fields in entries.items()
+                for token, weight in cls._weighted_tokens(fields).items()
+            ], batch_size=1000)
+
+    @classmethod
+    def _entries_for_appointments(cls, appointments):
+        """由預約查詢組出預約、寵物、飼主三種索引項目（一次 JOIN 查詢）"""
+        entries = {}
+        for row in appointments.values(
+            'id', 'reason', 'notes', 'contact_phone', 'slot__clinic_id',
+            'pet_id', 'pet__name', 'pet__chip',
+            'owner_id', 'owner__username', 'owner__first_name', 'owner__last_name',
+            'owner__profile__phone_number',
+        ).iterator(chunk_size=2000):
+            clinic_id = row['slot__clinic_id']
+            owner_fields = {
+                'owner_name': f"{row['owner__first_name']} {row['owner__last_name']}".strip(),
+                'username': row['owner__username'],
+            }
+            entries[(clinic_id, 'appointment', row['id'])] = {
+                'pet_name': row['pet__name'],
+                **owner_fields,
+                'phone': row['contact_phone'],
+                'reason': row['reason'],
+                'notes': row['notes'],
+            }
+            entries[(clinic_id, 'pet', row['pet_id'])] = {
+                'pet_name': row['pet__name'],
+                'chip': row['pet__chip'],
+                **owner_fields,
+            }
+            entries[(clinic_id, 'owner', row['owner_id'])] = {
+                **owner_fields,
+                'phone': row['owner__profile__phone_number'] or row['contact_phone'],
+            }
+        return entries
+
+    @classmethod
+    def index_appointments(cls, appointment_ids):
+        """重建指定預約（連同其寵物、飼主）在所屬診所的索引"""
+        cls._write(cls._entries_for_appointments(
+            VetAppointment.objects.filter(id__in=appointment_ids)
+        ))
+
+    @classmethod
+    def index_owner_related(cls, user_id):
+        """飼主或其寵物資料變更：重建所有相關診所裡此飼主的預約、寵物、飼主索引"""
+        cls._write(cls._entries_for_appointments(
+            VetAppointment.objects.filter(owner_id=user_id)
+        ))
+
+    @classmethod
+    def schedule_appointment(cls, appointment_id):
+        """交易提交後才更新索引，不拉長預約交易"""
+        transaction.on_commit(lambda: cls.index_appointments([appointment_id]))
+
+    @classmethod
+    def schedule_owner(cls, user_id):
+        transaction.on_commit(lambda: cls.index_owner_related(user_id))
+
+    @classmethod
+    def remove(cls, clinic_id, kind, object_id):
+        cls.objects.filter(clinic_id=clinic_id, kind=kind, object_id=object_id).delete()
+
+    @classmethod
+    def rebuild(cls, clinic_id=None):
+        """重建索引（可限定診所），回傳索引物件數"""
+        appointments = VetAppointment.objects.all()
+        tokens = cls.objects.all()
+        if clinic_id:
+            appointments = appointments.filter(slot__clinic_id=clinic_id)
+            tokens = tokens.filter(clinic_id=clinic_id)
+        entries = cls._entries_for_appointments(appointments)
+        with transaction.atomic():
+            tokens.delete()
+            cls._write(entries)
+        return len(entries)
+
+    @classmethod
+    def query_tokens(cls, text):
+        text = cls.normalize(text)
+        if len(text) < 2:
+            return text, set()
+        return text, set(sorted(cls.tokenize(text))[:cls.MAX_QUERY_TOKENS])
+
+    @classmethod
+    def matches(cls, clinic, text, kind=None):
+        """
+        回傳符合查詢的 (kind, object_id, score) 分組查詢，依分數排序
+        所有查詢詞元都要命中；單一字元查詢改用字首比對
+        """
+        text, tokens = cls.query_tokens(text)
+        if not text:
+            return cls.objects.none()
+
+        rows = cls.objects.filter(clinic=clinic)
+        if kind:
+            rows = rows.filter(kind=kind)
+        if tokens:
+            rows = rows.filter(token__in=tokens)
+            required = len(tokens)
+        else:
+            rows = rows.filter(token__startswith=text)
+            required = 1
+
+        return rows.values('kind', 'object_id').annotate(
+            matched=models.Count('token'),
+            score=models.Sum('weight'),
+        ).filter(matched__gte=required).order_by('-score', '-object_id')
+
+
+class EmailOutbox(models.Model):
+    """
+    待寄信件佇列：業務流程只在同一個交易裡寫入一筆，交易成功才會寄出，
+    請求不必等待 SMTP。由 send_outbox_emails 指令取出寄送，失敗以指數退避重試。
+    """
+
+    STATUS_CHOICES = [
+        ('pending', '待寄送'),
+        ('sent', '已寄出'),
+        ('failed', '寄送失敗'),
+    ]
+
+    category = models.CharField(max_length=50, blank=True, verbose_name='信件類型')
+    subject = models.CharField(max_length=255, verbose_name='主旨')
+    body = models.TextField(verbose_name='內容')
+    from_email = models.CharField(max_length=255, blank=True, verbose_name='寄件者')
+    recipients = models.JSONField(default=list, verbose_name='收件者')
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='嘗試次數')
+    # 下次可寄送時間；worker 取出時會往後推一段租約時間，worker 中斷時租約到期即可被重新取出
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='下次寄送時間')
+    last_error = models.TextField(blank=True, verbose_name='最後錯誤')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='寄出時間')
+
+    class Meta:
+        verbose_name = '待寄信件'
+        verbose_name_plural = '待寄信件'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"[{self.get_status_display()}] {self.subject}"
+
+    @classmethod
+    def enqueue(cls, subject, body, recipients, category='', from_email=None):
+        """
+        加入待寄佇列（與呼叫端同一個交易），沒有有效收件者時不建立
+        recipients 可為單一信箱或清單
+        """
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        recipients = [address for address in recipients if address]
+        if not recipients:
+            return None
+        return cls.objects.create(
+            category=category,
+            subject=subject,
+            body=body,
+            from_email=from_email or '',
+            recipients=recipients,
+        )
+
+
 class Profile(models.Model):
     """使用者檔案模型 - 調整為新架構"""
     
@@ -640,7 +1620,258 @@ class ScheduleManager:
             is_available=True,
             current_bookings__lt=models.F('max_bookings')
         ).order_by('start_time')
-        
+
+    @staticmethod
+    def find_overlaps(intervals):
+        """
+        掃描線檢查時段重疊。
+        intervals 為 (key, start, end, label) 序列，key 通常是 (doctor_id, weekday)；
+        全部排序一次後線性掃描，回傳 [(key, 先前時段 label, 衝突時段 label), ...]。
+        """
+        conflicts = []
+        current_key = None
+        reach_end = None
+        reach_label = None
+
+        for key, start, end, label in sorted(intervals, key=lambda item: (item[0], item[1], item[2])):
+            if key != current_key:
+                current_key, reach_end, reach_label = key, end, label
+                continue
+            if start < reach_end:
+                conflicts.append((key, reach_label, label))
+            if end > reach_end:
+                reach_end, reach_label = end, label
+
+        return conflicts
+
+    @staticmethod
+    def _time_slots_for_range(date, start_time, end_time, duration_minutes):
+        """將時間範圍切成 (開始, 結束) 時段，不查詢資料庫；時長不是正數時不產生時段"""
+        if duration_minutes <= 0:
+            return []
+        current_time = datetime.combine(date, start_time)
+        end_datetime = datetime.combine(date, end_time)
+        ranges = []
+
+        while current_time < end_datetime:
+            slot_end = current_time + timedelta(minutes=duration_minutes)
+            if slot_end > end_datetime:
+                break
+            ranges.append((current_time.time(), slot_end.time()))
+            current_time = slot_end
+
+        return ranges
+
+    @staticmethod
+    def bulk_generate_slots(doctors, schedules, start_date, end_date):
+        """
+        依排班批次建立預約時段：已存在的時段與排班例外各只查詢一次，
+        最後以 bulk_create 一次寫入。回傳建立的時段數。
+        """
+        doctor_map = {doctor.id: doctor for doctor in doctors}
+        schedules_by_day = defaultdict(list)
+        for schedule in schedules:
+            schedules_by_day[(schedule.doctor_id, schedule.weekday)].append(schedule)
+
+        existing_keys = set(AppointmentSlot.objects.filter(
+            doctor_id__in=doctor_map.keys(),
+            date__range=(start_date, end_date)
+        ).values_list('doctor_id', 'date', 'start_time'))
+
+        exceptions_by_doctor = defaultdict(list)
+        for exception in VetScheduleException.objects.filter(
+            doctor_id__in=doctor_map.keys(),
+            start_date__lte=end_date,
+            end_date__gte=start_date,
+            is_active=True
+        ):
+            exceptions_by_doctor[exception.doctor_id].append(exception)
+
+        new_slots = []
+        current_date = start_date
+        while current_date <= end_date:
+            weekday = current_date.weekday()
+
+            for doctor_id, doctor in doctor_map.items():
+                day_schedules = schedules_by_day.get((doctor_id, weekday))
+                if not day_schedules:
+                    continue
+
+                exception = next((
+                    exc for exc in exceptions_by_doctor[doctor_id]
+                    if exc.start_date <= current_date <= exc.end_date
+                ), None)
+
+                for schedule in day_schedules:
+                    start_time, end_time = schedule.start_time, schedule.end_time
+                    if exception:
+                        if exception.exception_type in ['leave', 'holiday', 'unavailable']:
+                            continue
+                        if exception.exception_type == 'special':
+                            if not (exception.alternative_start_time and exception.alternative_end_time):
+                                continue
+                            start_time = exception.alternative_start_time
+                            end_time = exception.alternative_end_time
+
+                    for slot_start, slot_end in ScheduleManager._time_slots_for_range(
+                        current_date, start_time, end_time, schedule.appointment_duration
+                    ):
+                        key = (doctor_id, current_date, slot_start)
+                        if key in existing_keys:
+                            continue
+                        existing_keys.add(key)
+                        new_slots.append(AppointmentSlot(
+                            clinic_id=doctor.clinic_id,
+                            doctor_id=doctor_id,
+                            date=current_date,
+                            start_time=slot_start,
+                            end_time=slot_end,
+                            max_bookings=schedule.max_appointments_per_slot,
+                            current_bookings=0,
+                            source='schedule'
+                        ))
+
+            current_date += timedelta(days=1)
+
+        AppointmentSlot.objects.bulk_create(new_slots, batch_size=500)
+        for clinic_id in {doctor.clinic_id for doctor in doctor_map.values()}:
+            AppointmentSlot.invalidate_month_availability(clinic_id, start_date, end_date)
+        ClinicDailyStats.refresh_capacity(list(doctor_map.keys()), start_date, end_date)
+        return len(new_slots)
+
+    @staticmethod
+    def apply_template(template, doctors, start_date, weeks=1, overwrite=False):
+        """
+        將排班範本套用到多位醫師、多週。
+        先以掃描線一次驗證所有時段，再於同一交易內批次寫入排班與預約時段；
+        有衝突時拋出 ValidationError，不寫入任何資料。
+        """
+        entries = list(template.entries.all())
+        if not entries:
+            raise ValidationError('此範本尚未設定任何時段')
+
+        doctors = list(doctors)
+        doctor_ids = [doctor.id for doctor in doctors]
+        doctor_names = {
+            doctor.id: doctor.user.get_full_name() or doctor.user.username
+            for doctor in doctors
+        }
+        weekday_names = dict(VetSchedule.WEEKDAY_CHOICES)
+        end_date = start_date + timedelta(days=weeks * 7 - 1)
+
+        def label(doctor_id, weekday, start_time, end_time):
+            return (f"{doctor_names[doctor_id]} {weekday_names[weekday]} "
+                    f"{start_time.strftime('%H:%M')}-{end_time.strftime('%H:%M')}")
+
+        with transaction.atomic():
+            existing = list(VetSchedule.objects.select_for_update().filter(doctor_id__in=doctor_ids))
+
+            if overwrite:
+                # 覆蓋模式：移除原排班與範圍內尚未被預約的排班時段
+                VetSchedule.objects.filter(doctor_id__in=doctor_ids).delete()
+                AppointmentSlot.objects.filter(
+                    doctor_id__in=doctor_ids,
+                    date__range=(start_date, end_date),
+                    current_bookings=0,
+                    source='schedule'
+                ).delete()
+                existing = []
+
+            intervals = [
+                ((schedule.doctor_id, schedule.weekday), schedule.start_time, schedule.end_time,
+                 label(schedule.doctor_id, schedule.weekday, schedule.start_time, schedule.end_time))
+                for schedule in existing if schedule.is_active
+            ]
+            taken_keys = {
+                (schedule.doctor_id, schedule.weekday, schedule.start_time)
+                for schedule in existing
+            }
+
+            new_schedules = []
+            errors = []
+            for doctor_id in doctor_ids:
+                for entry in entries:
+                    entry_label = label(doctor_id, entry.weekday, entry.start_time, entry.end_time)
+                    if entry.start_time >= entry.end_time:
+                        errors.append(f'{entry_label}：結束時間必須晚於開始時間')
+                        continue
+                    if (doctor_id, entry.weekday, entry.start_time) in taken_keys:
+                        errors.append(f'{entry_label}：與既有（含停用）排班開始時間相同')
+                        continue
+                    intervals.append(((doctor_id, entry.weekday), entry.start_time, entry.end_time, entry_label))
+                    new_schedules.append(VetSchedule(
+                        doctor_id=doctor_id,
+                        weekday=entry.weekday,
+                        start_time=entry.start_time,
+                        end_time=entry.end_time,
+                        appointment_duration=entry.appointment_duration,
+                        max_appointments_per_slot=entry.max_appointments_per_slot,
+                        notes=entry.notes,
+                        is_active=True
+                    ))
+
+            for _, previous, conflicting in ScheduleManager.find_overlaps(intervals):
+                errors.append(f'時間衝突：{conflicting} 與 {previous} 重疊')
+
+            if errors:
+                raise ValidationError(errors)
+
+            VetSchedule.objects.bulk_create(new_schedules, batch_size=500)
+            slots_created = ScheduleManager.bulk_generate_slots(
+                doctors, new_schedules, start_date, end_date
+            )
+
+        return {
+            'schedules_created': len(new_schedules),
+            'slots_created': slots_created,
+        }
+
+    @staticmethod
+    def copy_week_slots(doctor, source_start, target_start, overwrite=False):
+        """將某一週（source_start 起 7 天）的預約時段複製到另一週，批次寫入"""
+        source_end = source_start + timedelta(days=6)
+        target_end = target_start + timedelta(days=6)
+        offset = target_start - source_start
+
+        with transaction.atomic():
+            if overwrite:
+                AppointmentSlot.objects.filter(
+                    doctor=doctor,
+                    date__range=(target_start, target_end),
+                    current_bookings=0
+                ).delete()
+
+            existing_keys = set(AppointmentSlot.objects.filter(
+                doctor=doctor,
+                date__range=(target_start, target_end)
+            ).values_list('date', 'start_time'))
+
+            new_slots = []
+            for slot in AppointmentSlot.objects.filter(
+                doctor=doctor,
+                date__range=(source_start, source_end)
+            ).order_by('date', 'start_time'):
+                target_date = slot.date + offset
+                if (target_date, slot.start_time) in existing_keys:
+                    continue
+                new_slots.append(AppointmentSlot(
+                    clinic_id=slot.clinic_id,
+                    doctor_id=slot.doctor_id,
+                    date=target_date,
+                    start_time=slot.start_time,
+                    end_time=slot.end_time,
+                    is_available=slot.is_available,
+                    max_bookings=slot.max_bookings,
+                    current_bookings=0,
+                    source=slot.source
+                ))
+
+            AppointmentSlot.objects.bulk_create(new_slots, batch_size=500)
+            AppointmentSlot.invalidate_month_availability(doctor.clinic_id, target_start, target_end)
+            ClinicDailyStats.refresh_capacity([doctor.id], target_start, target_end)
+
+        return len(new_slots)
+
 # 使用者註冊表單擴充，加上 email 欄位
 class RegisterForm(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -678,10 +1909,20 @@ class Pet(models.Model):
     weight = models.FloatField(null=True, blank=True)
     feature = models.TextField(blank=True)
     picture = models.ImageField(upload_to='pet_pictures/', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新時間')
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        is_new = self.pk is None
+        super().save(*args, **kwargs)
+        # 名字或晶片變更要同步診所搜尋索引，診所快取的預約列表也要換版本（新寵物還沒有預約，不需要）
+        update_fields = kwargs.get('update_fields')
+        if not is_new and (update_fields is None or {'name', 'chip'}.intersection(update_fields)):
+            ClinicSearchToken.schedule_owner(self.owner_id)
+            bump_user_clinic_cache_versions(self.owner_id)
+
 # 寵物的每日生活紀錄
 class DailyRecord(models.Model):
     CATEGORY_CHOICES = [
@@ -692,15 +1933,206 @@ class DailyRecord(models.Model):
         ('temperature', '體溫'),
         ('weight', '體重'),
     ]
+    # 體溫、體重另存數值欄位，圖表與統計直接查 value，不必逐筆解析 content
+    MEASUREMENT_CATEGORIES = ('temperature', 'weight')
+
     pet = models.ForeignKey(Pet, on_delete=models.CASCADE)
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
     category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
     content = models.TextField(blank=True)
+    value = models.FloatField(null=True, blank=True, verbose_name='數值')
+    # 裝置或 App 批次上傳時自帶的紀錄編號，重送同一筆不會重複寫入
+    client_id = models.CharField(max_length=64, null=True, blank=True, verbose_name='用戶端編號')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新時間')
+
+    class Meta:
+        unique_together = ['pet', 'client_id']
+        indexes = [
+            models.Index(fields=['pet', 'category', 'date'], name='dailyrecord_pet_cat_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.pet.name} 的生活記錄（{self.date}）"
 
+    @classmethod
+    def parse_value(cls, category, content):
+        """體溫／體重的文字內容轉成數值，無法解析或非量測類別回傳 None"""
+        if category not in cls.MEASUREMENT_CATEGORIES:
+            return None
+        try:
+            value = float(str(content).strip())
+        except (TypeError, ValueError):
+            return None
+        return value if math.isfinite(value) else None
+
+    def save(self, *args, **kwargs):
+        # content 與 value 同步寫入；只更新部分欄位且包含 content 時，一併更新 value
+        self.value = self.parse_value(self.category, self.content)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'value'}
+
+        # 修改時可能換了日期或類別，新舊兩處的彙總都要重算
+        old = None
+        if self.pk:
+            old = DailyRecord.objects.filter(pk=self.pk).values_list('category', 'date').first()
+        super().save(*args, **kwargs)
+
+        if old and old[0] in self.MEASUREMENT_CATEGORIES:
+            MeasurementRollup.schedule_refresh(self.pet_id, old[0], old[1])
+        if self.category in self.MEASUREMENT_CATEGORIES:
+            MeasurementRollup.schedule_refresh(self.pet_id, self.category, self.date)
+
+    def delete(self, *args, **kwargs):
+        pet_id, category, day = self.pet_id, self.category, self.date
+        result = super().delete(*args, **kwargs)
+        if category in self.MEASUREMENT_CATEGORIES:
+            MeasurementRollup.schedule_refresh(pet_id, category, day)
+        return result
+
+    @classmethod
+    def measurements(cls, pet, category, start_date, end_date):
+        """期間內有效的量測紀錄（依日期、建立時間排序）"""
+        return cls.objects.filter(
+            pet=pet, category=category, date__range=(start_date, end_date), value__isnull=False
+        ).order_by('date', 'created_at')
+
+    @classmethod
+    def measurement_summary(cls, pet, category, start_date, end_date):
+        """期間內的筆數、最小、最大、平均值（資料庫端計算）"""
+        return cls.measurements(pet, category, start_date, end_date).order_by().aggregate(
+            count=models.Count('id'),
+            min=models.Min('value'),
+            max=models.Max('value'),
+            avg=models.Avg('value'),
+        )
+
+
+class MeasurementRollup(models.Model):
+    """
+    體溫／體重的日、週、月彙總（筆數、最小、最大、平均、最後一筆）
+    DailyRecord 新增、修改、刪除時在交易提交後重算受影響的區間；長期間的圖表直接讀彙總。
+    資料不一致時可用 rebuild_measurement_rollups 指令重建。
+    """
+
+    PERIOD_CHOICES = [
+        ('day', '日'),
+        ('week', '週'),
+        ('month', '月'),
+    ]
+    # 由細到粗，以及每個區間大約的天數（挑選解析度用）
+    PERIODS = ('day', 'week', 'month')
+    PERIOD_DAYS = {'day': 1, 'week': 7, 'month': 30}
+
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='measurement_rollups')
+    kind = models.CharField(max_length=20, choices=[
+        choice for choice in DailyRecord.CATEGORY_CHOICES if choice[0] in DailyRecord.MEASUREMENT_CATEGORIES
+    ])
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    bucket_start = models.DateField(verbose_name='區間起日')
+
+    count = models.IntegerField(default=0, verbose_name='筆數')
+    min = models.FloatField(verbose_name='最小值')
+    max = models.FloatField(verbose_name='最大值')
+    avg = models.FloatField(verbose_name='平均值')
+    last = models.FloatField(verbose_name='最後一筆')
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = '量測彙總'
+        verbose_name_plural = '量測彙總'
+        unique_together = ['pet', 'kind', 'period', 'bucket_start']
+
+    def __str__(self):
+        return f"{self.pet_id} {self.kind} {self.period} {self.bucket_start}"
+
+    @staticmethod
+    def bucket_range(period, day):
+        """day 所在區間的 (起日, 迄日)；週以星期一為起日"""
+        if isinstance(day, datetime):
+            day = day.date()
+        if period == 'day':
+            return day, day
+        if period == 'week':
+            start = day - timedelta(days=day.weekday())
+            return start, start + timedelta(days=6)
+        start = day.replace(day=1)
+        return start, day.replace(day=monthrange(day.year, day.month)[1])
+
+    @staticmethod
+    def summarize(points):
+        """points 為依時間排序的數值清單"""
+        return {
+            'count': len(points),
+            'min': min(points),
+            'max': max(points),
+            'avg': sum(points) / len(points),
+            'last': points[-1],
+        }
+
+    @classmethod
+    def refresh(cls, pet_id, kind, day):
+        """重算 day 所在的日、週、月三個區間"""
+        cls.refresh_days(pet_id, kind, [day])
+
+    @classmethod
+    def refresh_days(cls, pet_id, kind, days):
+        """
+        重算多個日期所在的日、週、月區間：一次取回涵蓋全部區間的原始數值，
+        刪除受影響的區間後整批寫回（沒有資料的區間就此移除；查詢數與日期數無關）
+        """
+        buckets = {
+            (period, *cls.bucket_range(period, day)): []
+            for day in set(days) for period in cls.PERIODS
+        }
+        if not buckets:
+            return
+        start = min(bucket_start for _, bucket_start, _ in buckets)
+        end = max(bucket_end for _, _, bucket_end in buckets)
+        rows = DailyRecord.objects.filter(
+            pet_id=pet_id, category=kind, date__range=(start, end), value__isnull=False
+        ).order_by('date', 'created_at').values_list('date', 'value')
+        for record_date, value in rows:
+            for period in cls.PERIODS:
+                key = (period, *cls.bucket_range(period, record_date))
+                if key in buckets:
+                    buckets[key].append(value)
+
+        with transaction.atomic():
+            for period in cls.PERIODS:
+                cls.objects.filter(
+                    pet_id=pet_id, kind=kind, period=period,
+                    bucket_start__in=[bucket_start for p, bucket_start, _ in buckets if p == period]
+                ).delete()
+            cls.objects.bulk_create([
+                cls(pet_id=pet_id, kind=kind, period=period, bucket_start=bucket_start, **cls.summarize(points))
+                for (period, bucket_start, _), points in buckets.items() if points
+            ], batch_size=1000)
+
+    @classmethod
+    def schedule_refresh(cls, pet_id, kind, day):
+        transaction.on_commit(lambda: cls.refresh(pet_id, kind, day))
+
+    @classmethod
+    def schedule_refresh_days(cls, pet_id, kind, days):
+        days = set(days)
+        transaction.on_commit(lambda: cls.refresh_days(pet_id, kind, days))
+
+    @classmethod
+    def choose_period(cls, start_date, end_date, points):
+        """
+        每個輸出點至少涵蓋 (期間天數 / points) 天；挑不超過這個長度的最粗區間，
+        連「日」都太粗時回傳 None（改用原始資料）
+        """
+        days_per_point = ((end_date - start_date).days + 1) / max(points, 1)
+        chosen = None
+        for period in cls.PERIODS:
+            if cls.PERIOD_DAYS[period] <= days_per_point:
+                chosen = period
+        return chosen
+
 
 # 疫苗與驅蟲紀錄（含施打獸醫、地點）
 class VaccineRecord(models.Model):
@@ -709,20 +2141,211 @@ class VaccineRecord(models.Model):
     date = models.DateField(verbose_name='施打日期')
     location = models.CharField(max_length=200, verbose_name='施打地點')
     vet = models.ForeignKey(Profile, on_delete=models.SET_NULL, null=True, verbose_name='施打醫師') # SET_NULL：避免醫師帳號刪除時連同歷史疫苗紀錄也被刪除（資料應保留）。
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新時間')
 
     def __str__(self):
         return f"{self.pet.name} - {self.name}（{self.date}）"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        CareDueDate.refresh(self.pet_id, 'vaccine')
+
+    def delete(self, *args, **kwargs):
+        pet_id = self.pet_id
+        result = super().delete(*args, **kwargs)
+        CareDueDate.refresh(pet_id, 'vaccine')
+        return result
+
 class DewormRecord(models.Model):
     pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='deworm_records', verbose_name='寵物')
     name = models.CharField(max_length=100, verbose_name='驅蟲品牌')
     date = models.DateField(verbose_name='施打日期')
     location = models.CharField(max_length=200, verbose_name='施打地點')
     vet = models.ForeignKey(Profile, on_delete=models.SET_NULL, null=True, verbose_name='施打醫師')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新時間')
 
     def __str__(self):
         return f"{self.pet.name} - {self.name}（{self.date}）"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        CareDueDate.refresh(self.pet_id, 'deworm')
+
+    def delete(self, *args, **kwargs):
+        pet_id = self.pet_id
+        result = super().delete(*args, **kwargs)
+        CareDueDate.refresh(pet_id, 'deworm')
+        return result
+
+# 疫苗／驅蟲到期日（由施打紀錄維護，通知頁直接讀取）
+class CareDueDate(models.Model):
+    """
+    每隻寵物每種保健項目一列：最後施打日與下次到期日
+    間隔與提前提醒天數由 settings.CARE_REMINDER_RULES 設定；
+    施打紀錄新增、修改、刪除時更新，sweep_care_reminders 每日把進入提醒期的項目標記為 is_due。
+    """
+
+    KIND_CHOICES = [
+        ('vaccine', '疫苗'),
+        ('deworm', '驅蟲'),
+    ]
+    DEFAULT_RULES = {
+        'vaccine': {'interval_days': 365, 'window_days': 30},
+        'deworm': {'interval_days': 182, 'window_days': 30},
+    }
+
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='care_due_dates', verbose_name='寵物')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='care_due_dates', verbose_name='飼主')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    last_date = models.DateField(verbose_name='最後施打日')
+    due_date = models.DateField(verbose_name='下次到期日')
+    notify_from = models.DateField(verbose_name='開始提醒日')
+    is_due = models.BooleanField(default=False, verbose_name='提醒中')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = '保健到期日'
+        verbose_name_plural = '保健到期日'
+        unique_together = ['pet', 'kind']
+        indexes = [
+            models.Index(fields=['owner', 'is_due', 'due_date'], name='caredue_owner_due_idx'),
+            models.Index(fields=['is_due', 'notify_from'], name='caredue_sweep_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.pet_id} {self.get_kind_display()} → {self.due_date}"
+
+    @property
+    def days_left(self):
+        return (self.due_date - timezone.localdate()).days
+
+    @classmethod
+    def rules(cls, kind):
+        from django.conf import settings
+        return {**cls.DEFAULT_RULES[kind], **getattr(settings, 'CARE_REMINDER_RULES', {}).get(kind, {})}
+
+    @classmethod
+    def build(cls, pet_id, owner_id, kind, last_date, today=None):
+        """依最後施打日算出到期日與提醒起始日（未存檔）"""
+        today = today or timezone.localdate()
+        rules = cls.rules(kind)
+        due_date = last_date + timedelta(days=rules['interval_days'])
+        notify_from = due_date - timedelta(days=rules['window_days'])
+        return cls(
+            pet_id=pet_id, owner_id=owner_id, kind=kind, last_date=last_date,
+            due_date=due_date, notify_from=notify_from, is_due=notify_from <= today
+        )
+
+    @classmethod
+    def refresh(cls, pet_id, kind):
+        """重新計算單一寵物、單一項目的到期日（施打紀錄異動後呼叫）"""
+        record_model = VaccineRecord if kind == 'vaccine' else DewormRecord
+        rows = list(record_model.objects.filter(pet_id=pet_id).values('pet__owner_id').annotate(
+            last_date=models.Max('date')
+        )[:1])
+        row = rows[0] if rows else None
+        if not row:
+            owner_ids = list(cls.objects.filter(pet_id=pet_id, kind=kind).values_list('owner_id', flat=True))
+            cls.objects.filter(pet_id=pet_id, kind=kind).delete()
+            refresh_notification_counts(owner_ids)
+        else:
+            entry = cls.build(pet_id, row['pet__owner_id'], kind, row['last_date'])
+            cls.objects.update_or_create(
+                pet_id=pet_id, kind=kind,
+                defaults={
+                    field: getattr(entry, field)
+                    for field in ('owner_id', 'last_date', 'due_date', 'notify_from', 'is_due')
+                }
+            )
+            refresh_notification_counts([row['pet__owner_id']])
+
+    @classmethod
+    def sweep(cls, today=None):
+        """每日執行：把已進入提醒期的項目標記為 is_due，回傳受影響的飼主 ID"""
+        today = today or timezone.localdate()
+        entering = cls.objects.filter(is_due=False, notify_from__lte=today)
+        owner_ids = set(entering.values_list('owner_id', flat=True))
+        entering.update(is_due=True)
+        refresh_notification_counts(owner_ids)
+        return owner_ids
+
+    @classmethod
+    def due_for_owner(cls, owner):
+        """飼主目前需要提醒的項目（單一索引範圍查詢）"""
+        return cls.objects.filter(owner=owner, is_due=True).select_related('pet').order_by('due_date')
+
+
+class HealthAlert(models.Model):
+    """
+    體溫／體重異常提醒：每隻寵物每種量測每天最多一列
+    由 detect_health_anomalies 每日批次計算（見 petapp/anomaly.py），重跑同一天會覆蓋當天結果；
+    各物種的門檻由 settings.HEALTH_ALERT_RULES 覆寫 DEFAULT_RULES。
+    """
+
+    RULE_CHOICES = [
+        ('high', '高於正常範圍'),
+        ('low', '低於正常範圍'),
+        ('change', '短期變化過大'),
+        ('zscore', '偏離近期基準'),
+    ]
+    # low／high 為體溫正常範圍（°C，體重不設絕對範圍）；zscore 為偏離近期基準的標準差倍數；
+    # rate 為相鄰兩筆每日變化量佔基準平均的比例
+    DEFAULT_RULES = {
+        'dog': {
+            'temperature': {'low': 37.5, 'high': 39.5, 'zscore': 3.0, 'rate': 0.03},
+            'weight': {'zscore': 3.0, 'rate': 0.04},
+        },
+        'cat': {
+            'temperature': {'low': 37.5, 'high': 39.5, 'zscore': 3.0, 'rate': 0.03},
+            'weight': {'zscore': 3.0, 'rate': 0.03},
+        },
+        'other': {
+            'temperature': {'zscore': 3.0, 'rate': 0.04},
+            'weight': {'zscore': 3.0, 'rate': 0.05},
+        },
+    }
+    # 通知頁顯示最近幾天的提醒
+    SHOW_DAYS = 7
+
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='health_alerts', verbose_name='寵物')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='health_alerts', verbose_name='飼主')
+    kind = models.CharField(max_length=20, choices=MeasurementRollup._meta.get_field('kind').choices)
+    date = models.DateField(verbose_name='量測日')
+    rule = models.CharField(max_length=10, choices=RULE_CHOICES)
+    value = models.FloatField(verbose_name='量測值')
+    baseline = models.FloatField(null=True, blank=True, verbose_name='基準平均')
+    zscore = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = '健康異常提醒'
+        verbose_name_plural = '健康異常提醒'
+        unique_together = ['pet', 'kind', 'date']
+        indexes = [
+            models.Index(fields=['owner', 'date'], name='healthalert_owner_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.pet_id} {self.kind} {self.date} {self.rule}"
+
+    @classmethod
+    def rules(cls, species):
+        from django.conf import settings
+        species = species if species in cls.DEFAULT_RULES else 'other'
+        overrides = getattr(settings, 'HEALTH_ALERT_RULES', {}).get(species, {})
+        return {
+            kind: {**rules, **overrides.get(kind, {})}
+            for kind, rules in cls.DEFAULT_RULES[species].items()
+        }
+
+    @classmethod
+    def recent_for_owner(cls, owner, day=None):
+        """飼主最近 SHOW_DAYS 天的異常提醒（單一索引範圍查詢）"""
+        day = day or timezone.localdate()
+        return cls.objects.filter(
+            owner=owner, date__gt=day - timedelta(days=cls.SHOW_DAYS)
+        ).select_related('pet').order_by('-date', 'pet_id')
+
 # 健康報告（上傳 PDF 給寵物與飼主）
 class Report(models.Model):
     pet = models.ForeignKey('Pet', on_delete=models.CASCADE, related_name='reports')
@@ -730,6 +2353,53 @@ class Report(models.Model):
     title = models.CharField(max_length=200)    # 報告標題
     pdf = models.FileField(upload_to='reports/')    # 上傳 PDF
     date_uploaded = models.DateTimeField(auto_now_add=True) # 上傳日期
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class SyncChange(models.Model):
+    """
+    飼主資料異動紀錄：離線 App 以遞增的 id 作為差異同步（/api/sync/）的游標
+    寵物、每日紀錄、疫苗／驅蟲紀錄、健康報告新增、修改、刪除時，由 signal 在交易提交後寫入；
+    刪除的資料只剩這裡的 delete 紀錄（墓碑）。寵物刪除時連帶刪除的紀錄不另寫，由寵物的墓碑涵蓋。
+    """
+
+    OP_CHOICES = [
+        ('upsert', '新增／修改'),
+        ('delete', '刪除'),
+    ]
+    MODEL_NAMES = {
+        'Pet': 'pet',
+        'DailyRecord': 'daily_record',
+        'VaccineRecord': 'vaccine_record',
+        'DewormRecord': 'deworm_record',
+        'Report': 'report',
+    }
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sync_changes', verbose_name='飼主')
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = '同步異動紀錄'
+        verbose_name_plural = '同步異動紀錄'
+        indexes = [
+            models.Index(fields=['owner', 'id'], name='syncchange_owner_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.owner_id} {self.op} {self.model}:{self.object_id}"
+
+    @classmethod
+    def record(cls, owner_id, model, object_ids, op='upsert'):
+        """交易提交後寫入異動紀錄（交易回滾的變更不會留下紀錄）"""
+        object_ids = [object_id for object_id in object_ids if object_id]
+        if not owner_id or not object_ids:
+            return
+        transaction.on_commit(lambda: cls.objects.bulk_create([
+            cls(owner_id=owner_id, model=model, object_id=object_id, op=op) for object_id in object_ids
+        ], batch_size=1000))
 
 # 看診紀錄（含診斷與治療內容）
 class MedicalRecord(models.Model):
@@ -780,6 +2450,16 @@ class MedicalRecord(models.Model):
     def __str__(self):
         return f"{self.pet.name} - {self.visit_date} ({self.attending_vet.user.get_full_name() if self.attending_vet else '未指定獸醫師'})"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_doctor_stats_version(self.attending_vet_id)
+
+    def delete(self, *args, **kwargs):
+        doctor_id = self.attending_vet_id
+        result = super().delete(*args, **kwargs)
+        bump_doctor_stats_version(doctor_id)
+        return result
+
 # 獸醫的可看診排班時段（支援開始/結束時間與唯一排班組合）
 class VetAvailableTime(models.Model):
     vet = models.ForeignKey(Profile, on_delete=models.CASCADE, limit_choices_to={"account_type": "vet"}, verbose_name="獸醫")
@@ -0,0 +1,143 @@
+# petapp/series.py
+"""
+體溫／體重時間序列：任意日期範圍，以 LTTB（Largest-Triangle-Three-Buckets）降採樣到最多 N 點
+
+每個輸出點代表一個桶：value 是 LTTB 在該桶挑出的代表點（保留趨勢形狀），
+min／max／mean／count 是整個桶的統計，圖表可同時畫出趨勢線與區間範圍。
+第一點與最後一點固定保留，各自是單點的桶。
+
+期間夠長時改讀 MeasurementRollup：挑每點涵蓋天數內最粗的彙總區間（月 → 週 → 日），
+每列彙總視為一個帶有 min／max／count 的點，再交給 LTTB；連「日」都太粗時才讀原始紀錄。
+"""
+
+import numpy as np
+
+from .models import DailyRecord, MeasurementRollup
+
+MIN_POINTS = 3
+MAX_POINTS = 2000
+
+
+def lttb(x, y, threshold):
+    """
+    回傳 (挑選的索引, 桶邊界)；x 需遞增。
+    中間 n-2 點均分成 threshold-2 個桶，第 i 個桶為 [edges[i], edges[i+1])。
+    資料點數不超過 threshold 時不降採樣，edges 為 None。
+    """
+    n = len(x)
+    if threshold >= n or threshold < MIN_POINTS:
+        return np.arange(n), None
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一個桶的平均點（最後一個桶的下一點就是最後一筆資料）
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected, edges
+
+
+def bucket_stats(y, edges, mins, maxs, counts):
+    """
+    各桶的 min／max／mean／count；首尾兩點各自成桶
+    每個輸入點本身可能是彙總列（y 為平均、帶 min／max／count），平均以筆數加權
+    """
+    n = len(y)
+    starts = edges[:-1]
+    weighted = y * counts
+
+    def merge(reduce, array, first, last):
+        return np.concatenate(([first], reduce(array[:n - 1], starts), [last]))
+
+    bucket_counts = merge(np.add.reduceat, counts, counts[0], counts[-1])
+    bucket_mins = merge(np.minimum.reduceat, mins, mins[0], mins[-1])
+    bucket_maxs = merge(np.maximum.reduceat, maxs, maxs[0], maxs[-1])
+    bucket_means = merge(np.add.reduceat, weighted, weighted[0], weighted[-1]) / bucket_counts
+    return bucket_mins, bucket_maxs, bucket_means, bucket_counts
+
+
+def downsample(dates, values, points, mins=None, maxs=None, counts=None):
+    """
+    dates 為 date 清單、values 為數值清單（依時間排序），回傳最多 points 個輸出點
+    [{'date', 'value', 'min', 'max', 'mean', 'count'}]
+    讀彙總表時另傳入每列的 mins／maxs／counts
+    """
+    if not values:
+        return []
+
+    x = np.fromiter((d.toordinal() for d in dates), dtype=np.float64, count=len(dates))
+    y = np.asarray(values, dtype=np.float64)
+    mins = y if mins is None else np.asarray(mins, dtype=np.float64)
+    maxs = y if maxs is None else np.asarray(maxs, dtype=np.float64)
+    counts = np.ones(len(y), dtype=np.float64) if counts is None else np.asarray(counts, dtype=np.float64)
+    selected, edges = lttb(x, y, points)
+
+    if edges is None:
+        means = y
+    else:
+        mins, maxs, means, counts = bucket_stats(y, edges, mins, maxs, counts)
+
+    return [
+        {
+            'date': dates[index].isoformat(),
+            'value': float(y[index]),
+            'min': float(mins[bucket]),
+            'max': float(maxs[bucket]),
+            'mean': round(float(means[bucket]), 3),
+            'count': int(counts[bucket]),
+        }
+        for bucket, index in enumerate(selected)
+    ]
+
+
+def load_series(pet, kind, start_date, end_date):
+    """期間內的原始量測點，回傳 (dates, values)"""
+    rows = DailyRecord.measurements(pet, kind, start_date, end_date).values_list('date', 'value')
+    dates, values = [], []
+    for record_date, value in rows:
+        dates.append(record_date)
+        values.append(value)
+    return dates, values
+
+
+def load_rollups(pet, kind, period, start_date, end_date):
+    """期間內的彙總列（起日落在期間所屬區間內），回傳 (dates, avgs, mins, maxs, counts)"""
+    first_bucket, _ = MeasurementRollup.bucket_range(period, start_date)
+    rows = MeasurementRollup.objects.filter(
+        pet=pet, kind=kind, period=period, bucket_start__range=(first_bucket, end_date)
+    ).order_by('bucket_start').values_list('bucket_start', 'avg', 'min', 'max', 'count')
+    columns = list(zip(*rows)) or [(), (), (), (), ()]
+    return tuple(list(column) for column in columns)
+
+
+def get_series(pet, kind, start_date, end_date, points):
+    period = MeasurementRollup.choose_period(start_date, end_date, points)
+    if period:
+        dates, values, mins, maxs, counts = load_rollups(pet, kind, period, start_date, end_date)
+        result_points = downsample(dates, values, points, mins, maxs, counts)
+        raw_count = int(sum(counts))
+    else:
+        dates, values = load_series(pet, kind, start_date, end_date)
+        result_points = downsample(dates, values, points)
+        raw_count = len(values)
+
+    return {
+        'kind': kind,
+        'from': start_date.isoformat(),
+        'to': end_date.isoformat(),
+        'resolution': period or 'raw',
+        'raw_count': raw_count,
+        'points': result_points,
+    }
@@ -0,0 +1,124 @@
+# petapp/sync.py
+"""
+離線 App 差異同步：/api/sync/?since=<cursor>
+
+游標是 SyncChange 的 id（全站遞增）。since 為 0 或未帶時回傳完整資料；
+之後只讀 (owner, id) 索引上 since 之後的異動紀錄，工作量與異動筆數成正比，與歷史資料量無關。
+
+回應以串流分批輸出：{"success": true, "cursor": N, "full": bool, "changes": [...]}
+每個變更為 {"model", "id", "op": "upsert", "data": {...}} 或 {"model", "id", "op": "delete"}；
+同一筆資料可能在不同批次出現多次，依順序套用即可（後面的覆蓋前面的）。
+"""
+
+import json
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import DailyRecord, DewormRecord, Pet, Report, SyncChange, VaccineRecord
+
+CHUNK_SIZE = 500
+# 自增 id 的配置順序與交易提交順序可能略有出入，游標只推進到幾秒前的異動，避免漏掉晚提交的紀錄
+SETTLE_SECONDS = 2
+
+SYNC_MODELS = {
+    'pet': (Pet, 'owner_id', (
+        'id', 'species', 'breed', 'name', 'sterilization_status', 'chip', 'birth_date',
+        'gender', 'weight', 'feature', 'picture', 'updated_at',
+    )),
+    'daily_record': (DailyRecord, 'pet__owner_id', (
+        'id', 'pet_id', 'date', 'category', 'content', 'value', 'client_id', 'created_at', 'updated_at',
+    )),
+    'vaccine_record': (VaccineRecord, 'pet__owner_id', (
+        'id', 'pet_id', 'name', 'date', 'location', 'vet_id', 'updated_at',
+    )),
+    'deworm_record': (DewormRecord, 'pet__owner_id', (
+        'id', 'pet_id', 'name', 'date', 'location', 'vet_id', 'updated_at',
+    )),
+    'report': (Report, 'pet__owner_id', (
+        'id', 'pet_id', 'vet_id', 'title', 'pdf', 'date_uploaded', 'updated_at',
+    )),
+}
+FILE_FIELDS = ('picture', 'pdf')
+
+
+def settled_cursor():
+    """目前可安全交給用戶端的游標：SETTLE_SECONDS 秒前最後一筆異動的 id（由 id 尾端往回找，只掃最近幾秒）"""
+    cutoff = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    return SyncChange.objects.filter(created_at__lte=cutoff).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def fetch(model_name, owner_id, limit=None, **filters):
+    """飼主名下的資料（依 id 排序），file 欄位轉成網址"""
+    model, owner_field, fields = SYNC_MODELS[model_name]
+    rows = model.objects.filter(**{owner_field: owner_id}, **filters).order_by('id').values(*fields)
+    if limit:
+        rows = rows[:limit]
+    for row in rows:
+        for field in FILE_FIELDS:
+            if field in row:
+                row[field] = default_storage.url(row[field]) if row[field] else None
+        yield row
+
+
+def full_changes(owner_id):
+    """完整資料：逐種資料以 id 分頁讀取，先寵物後紀錄"""
+    for model_name in SYNC_MODELS:
+        last_id = 0
+        while True:
+            rows = list(fetch(model_name, owner_id, limit=CHUNK_SIZE, id__gt=last_id))
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            yield [{'model': model_name, 'id': row['id'], 'op': 'upsert', 'data': row} for row in rows]
+
+
+def delta_changes(owner_id, since, until):
+    """since 之後、until（含）以前的異動：每批 CHUNK_SIZE 筆異動紀錄，同批內同一筆資料只取最後一次異動"""
+    last_id = since
+    while True:
+        chunk = list(SyncChange.objects.filter(
+            owner_id=owner_id, id__gt=last_id, id__lte=until
+        ).order_by('id').values_list('id', 'model', 'object_id', 'op')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+
+        latest = {}
+        for _, model_name, object_id, op in chunk:
+            latest[(model_name, object_id)] = op
+
+        changes = []
+        for model_name in SYNC_MODELS:
+            upserts = [object_id for (name, object_id), op in latest.items() if name == model_name and op == 'upsert']
+            if upserts:
+                # 之後又被刪除的資料查不到，等後面的墓碑處理
+                changes.extend(
+                    {'model': model_name, 'id': row['id'], 'op': 'upsert', 'data': row}
+                    for row in fetch(model_name, owner_id, id__in=upserts)
+                )
+        changes.extend(
+            {'model': model_name, 'id': object_id, 'op': 'delete'}
+            for (model_name, object_id), op in latest.items() if op == 'delete'
+        )
+        yield changes
+
+
+def stream(owner_id, since=0):
+    """逐批產生 JSON 字串片段，交給 StreamingHttpResponse"""
+    until = settled_cursor()
+    full = not since
+    cursor = until if full else max(since, until)
+    yield f'{{"success": true, "cursor": {cursor}, "full": {json.dumps(full)}, "changes": ['
+
+    batches = full_changes(owner_id) if full else delta_changes(owner_id, since, until)
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        body = ', '.join(json.dumps(change, cls=DjangoJSONEncoder, ensure_ascii=False) for change in batch)
+        yield body if first else ', ' + body
+        first = False
+    yield ']}'
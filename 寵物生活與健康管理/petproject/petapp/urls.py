@@ -35,6 +35,9 @@ urlpatterns = [
     path('clinic/schedules/<int:schedule_id>/delete/', views.delete_schedule, name='delete_schedule'),  # 刪除排班
     path('clinic/schedules/toggle/<int:schedule_id>/', views.toggle_schedule_status, name='toggle_schedule_status'),
     path('clinic/schedules/copy-week/<int:doctor_id>/', views.copy_week_schedule, name='copy_week_schedule'),
+    path('clinic/schedule-templates/', views.api_schedule_templates, name='api_schedule_templates'),  # 排班範本列表／建立
+    path('clinic/schedule-templates/<int:template_id>/apply/', views.api_apply_schedule_template, name='api_apply_schedule_template'),  # 批次套用排班範本
+    path('clinic/schedule-templates/<int:template_id>/delete/', views.api_delete_schedule_template, name='api_delete_schedule_template'),  # 刪除排班範本
 
      # 診所營業時間
     path('api/clinic/business-hours/', views.api_clinic_business_hours, name='api_clinic_business_hours'),
@@ -53,9 +56,11 @@ urlpatterns = [
 
     # ============ Dashboard API ============
     path('api/dashboard/stats/', views.api_dashboard_stats, name='api_dashboard_stats'),
+    path('api/dashboard/trends/', views.api_clinic_trends, name='api_clinic_trends'),  # 逐月、逐醫師預約趨勢
     path('api/schedules/stats/', views.api_schedule_stats, name='api_schedule_stats'), 
     path('api/clinic/status/', views.api_clinic_status, name='api_clinic_status'),
     path('api/appointments/list/', views.api_appointments_list, name='api_appointments_list'),
+    path('api/clinic/search/', views.api_clinic_search, name='api_clinic_search'),  # 櫃台即時搜尋（預約、寵物、飼主）
     path('api/clinic/settings/', views.api_clinic_settings, name='api_clinic_settings'),
     
     # ============ 獸醫師工作台系統 ============
@@ -77,6 +82,8 @@ urlpatterns = [
     # ============ AJAX API（動態載入選項） ============
     path('api/doctors/', views.api_load_doctors, name='api_load_doctors'),  # 根據診所載入醫師列表
     path('api/time-slots/', views.api_load_time_slots, name='api_load_time_slots'),  # 根據條件載入可用時段
+    path('api/availability/month/', views.api_month_availability, name='api_month_availability'),  # 月曆：每日剩餘名額與最早時段
+    path('api/availability/earliest/', views.api_earliest_slots, name='api_earliest_slots'),  # 跨診所搜尋最早可預約時段
     path('api/clinics/search/', views.api_search_clinics, name='api_search_clinics'),  # 搜尋診所
     path('api/clinic/business-hours/', views.api_clinic_business_hours, name='api_clinic_business_hours'),
     path('api/business-hours/get/', views.api_get_business_hours, name='api_get_business_hours'),
@@ -84,6 +91,7 @@ urlpatterns = [
     
     # ============ 通知系統 ============
     path('api/notifications/count/', views.get_notification_count, name='get_notification_count'),
+    path('api/events/stream/', views.event_stream, name='event_stream'),  # SSE 即時推播（預約異動、明日預約數）
     path('notifications/', views.notification_page, name='notification_page'),
     # ============ 註冊與帳號管理相關路由 ============
     path('select-account-type/', views.select_account_type, name='select_account_type'),  # 註冊後選擇帳號類型
@@ -117,6 +125,9 @@ urlpatterns = [
     path('pets/<int:pet_id>/weight/edit/<int:record_id>/', views.edit_weight, name='edit_weight'),  # 編輯體重記錄
     path('pets/<int:pet_id>/weight/delete/<int:record_id>/', views.delete_weight, name='delete_weight'),  # 刪除體重記錄
     path('api/pet/<int:pet_id>/weight/<int:year>/<int:month>/', views.get_monthly_weight, name='get_monthly_weight'),  # 共用函式（列表+健康記錄）
+    path('api/pet/<int:pet_id>/series/', views.api_pet_series, name='api_pet_series'),  # 體溫／體重任意期間趨勢（LTTB 降採樣）
+    path('api/pets/records/batch/', views.api_batch_daily_records, name='api_batch_daily_records'),  # 每日紀錄批次上傳（裝置、App 同步，client_id 去重）
+    path('api/sync/', views.api_sync, name='api_sync'),  # 離線 App 差異同步（寵物、健康紀錄，since 游標）
 
     # ============ 疫苗管理 ============
     path('vaccine/add/<int:pet_id>/', views.add_vaccine, name='add_vaccine'),  # 新增疫苗記錄
@@ -1,67 +1,405 @@
 
-from datetime import date
+import hashlib
+from collections import defaultdict
+from datetime import date, datetime, timedelta
 from calendar import monthrange
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
 from django.utils.timezone import localtime
-from .models import DailyRecord
+from .models import (
+    DailyRecord, VetDoctor, VetAppointment, Pet, ClinicDailyStats, ClinicSearchToken,
+    AppointmentSlot, MedicalRecord, VetPatient,
+    get_clinic_cache_version, get_doctor_stats_version,
+)
 
-# （體溫）共用程式
-def get_temperature_data(pet, year, month):
+# （體溫／體重）共用程式
+def get_measurement_data(pet, category, year, month, value_key):
     """
-    根據寵物與月份，取得該月所有有效體溫紀錄，並整理成趨勢圖可用格式。
+    取得寵物某月的體溫或體重紀錄，直接讀取數值欄位（DailyRecord.value），整理成趨勢圖可用格式。
     """
     start_date = date(year, month, 1)
     end_date = date(year, month, monthrange(year, month)[1])
 
-    raw_records = DailyRecord.objects.filter(
-        pet=pet,
-        category='temperature',
-        date__range=(start_date, end_date)
-    ).order_by('date', 'created_at')
-
+    rows = DailyRecord.measurements(pet, category, start_date, end_date).values_list(
+        'id', 'date', 'created_at', 'value', 'content'
+    )
     records = []
-    for rec in raw_records:
-        try:
-            temp_value = float(rec.content)
-        except ValueError:
-            continue
+    for record_id, record_date, created_at, value, content in rows:
+        day = record_date.strftime('%Y-%m-%d')
         records.append({
-            'id': rec.id,
-            'date': rec.date.strftime('%Y-%m-%d'),
-            'datetime': rec.date.strftime('%Y-%m-%d'),
-            'recorded_date': rec.date.strftime('%Y-%m-%d'),
-            'submitted_at': localtime(rec.created_at).strftime('%H:%M'),
-            'temperature': temp_value,
-            'raw_content': rec.content,
+            'id': record_id,
+            'date': day,
+            'datetime': day,
+            'recorded_date': day,
+            'submitted_at': localtime(created_at).strftime('%H:%M'),
+            value_key: value,
+            'raw_content': content,
         })
     return records
 
+
+# （體溫）共用程式
+def get_temperature_data(pet, year, month):
+    """
+    根據寵物與月份，取得該月所有有效體溫紀錄，並整理成趨勢圖可用格式。
+    """
+    return get_measurement_data(pet, 'temperature', year, month, 'temperature')
+
 # （體重）共用程式
 def get_weight_data(pet, year, month):
     """
-    根據寵物與月份，取得該月所有有效體溫紀錄，並整理成趨勢圖可用格式。
+    根據寵物與月份，取得該月所有有效體重紀錄，並整理成趨勢圖可用格式。
     """
-    start_date = date(year, month, 1)
-    end_date = date(year, month, monthrange(year, month)[1])
+    return get_measurement_data(pet, 'weight', year, month, 'weight')
+
+# （健康紀錄）共用程式
+def get_health_series(pet_ids, months):
+    """
+    多隻寵物、多個月份的體溫與體重趨勢，一次查詢取回再依寵物、類別、月份分組。
+    months 為 (year, month) 清單；回傳 {pet_id: {'temperature': {'YYYY-MM': [...]}, 'weight': {...}}}，
+    沒有資料的月份也會有空清單。
+    """
+    month_keys = [f"{year}-{month:02d}" for year, month in months]
+    series = {
+        pet_id: {category: {key: [] for key in month_keys} for category in DailyRecord.MEASUREMENT_CATEGORIES}
+        for pet_id in pet_ids
+    }
+    if not series or not months:
+        return series
 
-    raw_records = DailyRecord.objects.filter(
-        pet=pet,
-        category='weight',
-        date__range=(start_date, end_date)
-    ).order_by('date', 'created_at')
+    start_date = min(date(year, month, 1) for year, month in months)
+    end_date = max(date(year, month, monthrange(year, month)[1]) for year, month in months)
 
-    records = []
-    for rec in raw_records:
-        try:
-            weight_value = float(rec.content)
-        except ValueError:
-            continue
-        records.append({
-            'id': rec.id,
-            'date': rec.date.strftime('%Y-%m-%d'),
-            'datetime': rec.date.strftime('%Y-%m-%d'),
-            'recorded_date': rec.date.strftime('%Y-%m-%d'),
-            'submitted_at': localtime(rec.created_at).strftime('%H:%M'),
-            'weight': weight_value,
-            'raw_content': rec.content,
+    rows = DailyRecord.objects.filter(
+        pet_id__in=series.keys(),
+        category__in=DailyRecord.MEASUREMENT_CATEGORIES,
+        date__range=(start_date, end_date),
+        value__isnull=False,
+    ).order_by('date', 'created_at').values_list('pet_id', 'category', 'date', 'value')
+
+    for pet_id, category, record_date, value in rows:
+        day = record_date.isoformat()
+        points = series[pet_id][category].get(day[:7])
+        if points is not None:
+            points.append({'date': day, category: value})
+    return series
+
+
+# （診所快取）共用程式
+def get_clinic_cached(clinic_id, name, builder, params=''):
+    """
+    以診所快取版本為鍵快取資料：資料變動時版本會換掉，所以永遠拿到最新結果，
+    CLINIC_CACHE_TTL 只是保險用的上限。builder 為實際計算資料的函式。
+    """
+    params_hash = hashlib.md5(params.encode('utf-8')).hexdigest() if params else ''
+    key = f'petapp:clinic:{clinic_id}:v{get_clinic_cache_version(clinic_id)}:{name}:{params_hash}'
+
+    data = cache.get(key)
+    if data is None:
+        data = builder()
+        cache.set(key, data, getattr(settings, 'CLINIC_CACHE_TTL', 60))
+    return data
+
+
+# （診所統計）共用程式
+def get_clinic_appointment_stats(clinic, include_doctors=True):
+    """
+    診所預約統計：讀取每日統計彙總表（ClinicDailyStats），所有計數以一次條件式聚合取得，
+    醫師統計再以一次分組查詢取得，成本只跟彙總列數有關、與預約歷史筆數無關。
+    供首頁、主控台與統計 API 共用。
+    """
+    today = date.today()
+    week_start = today - timedelta(days=today.weekday())
+    week_end = week_start + timedelta(days=6)
+    month_start = today.replace(day=1)
+    month_end = today.replace(day=monthrange(today.year, today.month)[1])
+
+    active = ClinicDailyStats.active_expression()
+    # 別名不能與欄位同名，聚合後再改回狀態名稱
+    sums = {
+        f'{status}_total': Coalesce(Sum(status), 0)
+        for status in ClinicDailyStats.STATUS_FIELDS
+    }
+    stats = ClinicDailyStats.objects.filter(clinic=clinic).aggregate(
+        **sums,
+        today=Coalesce(Sum(active, filter=Q(date=today)), 0),
+        today_confirmed=Coalesce(Sum('confirmed', filter=Q(date=today)), 0),
+        week=Coalesce(Sum(active, filter=Q(date__range=(week_start, week_end))), 0),
+        month=Coalesce(Sum(active, filter=Q(date__range=(month_start, month_end))), 0),
+        month_booked_minutes=Coalesce(Sum('booked_minutes', filter=Q(date__range=(month_start, month_end))), 0),
+        month_capacity_minutes=Coalesce(Sum('capacity_minutes', filter=Q(date__range=(month_start, month_end))), 0),
+    )
+    for status in ClinicDailyStats.STATUS_FIELDS:
+        stats[status] = stats.pop(f'{status}_total')
+    stats['total'] = sum(stats[status] for status in ClinicDailyStats.STATUS_FIELDS)
+    stats['by_status'] = {
+        status: stats[status]
+        for status in ['pending', 'confirmed', 'completed', 'cancelled']
+    }
+
+    if include_doctors:
+        doctors = VetDoctor.objects.filter(clinic=clinic, is_active=True).values(
+            'id', 'user__username', 'user__first_name', 'user__last_name'
+        ).annotate(
+            appointments=Coalesce(Sum(ClinicDailyStats.active_expression('daily_stats__')), 0)
+        ).order_by('user__first_name', 'id')
+
+        stats['by_doctor'] = [
+            {
+                'id': doctor['id'],
+                'name': f"{doctor['user__first_name']} {doctor['user__last_name']}".strip() or doctor['user__username'],
+                'appointments': doctor['appointments'],
+            }
+            for doctor in doctors
+        ]
+        stats['doctors_count'] = len(stats['by_doctor'])
+
+    return stats
+
+
+def get_clinic_trends(clinic, months=6):
+    """
+    診所近幾個月的預約趨勢（逐月、逐醫師），一次分組查詢 ClinicDailyStats
+    回傳 [{'month', 'appointments', 'cancelled', 'booked_minutes', 'capacity_minutes', 'utilization', 'doctors': [...]}]
+    """
+    today = date.today()
+    start = today.replace(day=1)
+    for _ in range(months - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+    end = today.replace(day=monthrange(today.year, today.month)[1])
+
+    rows = ClinicDailyStats.objects.filter(
+        clinic=clinic, date__range=(start, end)
+    ).annotate(
+        month=TruncMonth('date')
+    ).values(
+        'month', 'doctor_id', 'doctor__user__username', 'doctor__user__first_name', 'doctor__user__last_name'
+    ).annotate(
+        appointments=Sum(ClinicDailyStats.active_expression()),
+        cancelled_total=Sum('cancelled'),
+        booked_total=Sum('booked_minutes'),
+        capacity_total=Sum('capacity_minutes'),
+    ).order_by('month', 'doctor_id')
+
+    def utilization(booked, capacity):
+        return round(booked / capacity * 100, 1) if capacity else 0
+
+    trends = {}
+    for row in rows:
+        month_key = row['month'].strftime('%Y-%m')
+        month = trends.setdefault(month_key, {
+            'month': month_key, 'appointments': 0, 'cancelled': 0,
+            'booked_minutes': 0, 'capacity_minutes': 0, 'doctors': []
         })
-    return records
+        appointments = row['appointments'] or 0
+        cancelled = row['cancelled_total'] or 0
+        booked = row['booked_total'] or 0
+        capacity = row['capacity_total'] or 0
+
+        month['appointments'] += appointments
+        month['cancelled'] += cancelled
+        month['booked_minutes'] += booked
+        month['capacity_minutes'] += capacity
+        month['doctors'].append({
+            'id': row['doctor_id'],
+            'name': f"{row['doctor__user__first_name']} {row['doctor__user__last_name']}".strip() or row['doctor__user__username'],
+            'appointments': appointments,
+            'cancelled': cancelled,
+            'utilization': utilization(booked, capacity),
+        })
+
+    result = []
+    for month in trends.values():
+        month['utilization'] = utilization(month['booked_minutes'], month['capacity_minutes'])
+        result.append(month)
+    return result
+
+
+# （獸醫師工作台）共用程式
+VET_WORKBENCH_CACHE_TTL = 60 * 60 * 24
+
+
+def _doctor_subquery(queryset, group, expression, output_field=None):
+    """單一醫師的彙總值子查詢（外層以 pk 篩選，只會有一組）"""
+    return Subquery(
+        queryset.order_by().values(group).annotate(value=expression).values('value')[:1],
+        output_field=output_field,
+    )
+
+
+def _build_vet_workbench_stats(doctor_id, today):
+    week_start = today - timedelta(days=today.weekday())
+    week_end = week_start + timedelta(days=6)
+    yesterday = today - timedelta(days=1)
+    month_start = today.replace(day=1)
+
+    # 預約數：讀每日統計彙總表
+    counts = ClinicDailyStats.objects.filter(
+        doctor_id=doctor_id, date__range=(yesterday, today)
+    ).aggregate(
+        today=Coalesce(Sum(F('pending') + F('confirmed'), filter=Q(date=today)), 0),
+        yesterday=Coalesce(Sum(F('confirmed') + F('completed'), filter=Q(date=yesterday)), 0),
+    )
+
+    # 病患、病歷、本週工時：一次查詢，各項為子查詢
+    patients = VetPatient.objects.filter(doctor_id=doctor_id)
+    records = MedicalRecord.objects.filter(attending_vet_id=doctor_id)
+    slots = AppointmentSlot.objects.filter(
+        doctor_id=doctor_id, date__range=(week_start, week_end), is_available=True
+    )
+    row = VetDoctor.objects.filter(pk=doctor_id).values(
+        total_patients=_doctor_subquery(patients, 'doctor_id', Count('id')),
+        new_patients=_doctor_subquery(patients.filter(first_visit__gte=month_start), 'doctor_id', Count('id')),
+        records_total=_doctor_subquery(records, 'attending_vet_id', Count('id')),
+        records_week=_doctor_subquery(
+            records.filter(created_at__date__range=(week_start, week_end)), 'attending_vet_id', Count('id')
+        ),
+        # 依時段實際長度加總（排班的預約時長不一定是 30 分鐘）
+        week_duration=_doctor_subquery(
+            slots, 'doctor_id',
+            Sum(ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField())),
+            output_field=DurationField(),
+        ),
+    ).first() or {}
+
+    week_duration = row.get('week_duration') or timedelta()
+    return {
+        'today_appointments_count': counts['today'],
+        'appointments_change': counts['today'] - counts['yesterday'],
+        'total_patients_count': row.get('total_patients') or 0,
+        'new_patients_this_month': row.get('new_patients') or 0,
+        'medical_records_count': row.get('records_total') or 0,
+        'records_this_week': row.get('records_week') or 0,
+        'working_minutes_this_week': int(week_duration.total_seconds() // 60),
+    }
+
+
+def get_vet_workbench_stats(vet_profile, today=None):
+    """
+    獸醫師工作台統計：兩次彙總查詢，結果依醫師、日期快取
+    醫師的預約、時段或病歷變動時換統計版本（見 models.bump_doctor_stats_version），快取自然失效
+    """
+    today = today or timezone.localdate()
+    key = f'petapp:vetstats:{vet_profile.pk}:v{get_doctor_stats_version(vet_profile.pk)}:{today.isoformat()}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = _build_vet_workbench_stats(vet_profile.pk, today)
+        cache.set(key, stats, VET_WORKBENCH_CACHE_TTL)
+    return stats
+
+
+# （預約列表）共用程式
+APPOINTMENT_LIST_FIELDS = (
+    'id', 'status', 'reason', 'notes', 'contact_phone', 'created_at',
+    'pet_id', 'pet__name',
+    'owner_id', 'owner__username', 'owner__first_name', 'owner__last_name',
+    'slot__doctor_id', 'slot__doctor__user__username',
+    'slot__doctor__user__first_name', 'slot__doctor__user__last_name',
+    'slot__date', 'slot__start_time', 'slot__end_time',
+)
+
+
+def parse_appointment_cursor(cursor):
+    """解析預約列表的 keyset 游標 "YYYY-MM-DD,HH:MM:SS,id"，格式錯誤會拋出 ValueError"""
+    cursor_date, cursor_time, cursor_id = cursor.split(',')
+    return (
+        datetime.strptime(cursor_date, '%Y-%m-%d').date(),
+        datetime.strptime(cursor_time, '%H:%M:%S').time(),
+        int(cursor_id),
+    )
+
+
+def get_appointment_page(appointments, cursor=None, limit=50, with_total=False):
+    """
+    預約列表分頁：以 values() 投影只取列表需要的欄位（JOIN 一次完成），
+    依 (slot__date, slot__start_time, id) 做 keyset 分頁，每頁固定 1 次查詢，
+    with_total=True 時多一次 COUNT；limit=None 時不分頁，一次回傳全部。
+    回傳 {'rows': [...], 'next_cursor': str 或 None, 'total': int 或 None}
+    """
+    total = appointments.count() if with_total else None
+
+    if cursor:
+        cursor_date, cursor_time, cursor_id = parse_appointment_cursor(cursor)
+        appointments = appointments.filter(
+            Q(slot__date__gt=cursor_date) |
+            Q(slot__date=cursor_date, slot__start_time__gt=cursor_time) |
+            Q(slot__date=cursor_date, slot__start_time=cursor_time, id__gt=cursor_id)
+        )
+
+    rows = appointments.order_by('slot__date', 'slot__start_time', 'id').values(*APPOINTMENT_LIST_FIELDS)
+    rows = list(rows if limit is None else rows[:limit + 1])
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last['slot__date'].isoformat()},{last['slot__start_time'].strftime('%H:%M:%S')},{last['id']}"
+
+    for row in rows:
+        row['owner_name'] = f"{row['owner__first_name']} {row['owner__last_name']}".strip() or row['owner__username']
+        row['doctor_name'] = (
+            f"{row['slot__doctor__user__first_name']} {row['slot__doctor__user__last_name']}".strip()
+            or row['slot__doctor__user__username']
+        )
+
+    return {'rows': rows, 'next_cursor': next_cursor, 'total': total}
+
+
+# （櫃台搜尋）共用程式
+def search_clinic(clinic, query, limit=10):
+    """
+    診所櫃台即時搜尋：先由 ClinicSearchToken 索引取得排名，再以每種類型一次 values() 查詢補上顯示資料。
+    回傳混合結果 [{'type': 'appointment'|'pet'|'owner', 'id', 'title', 'subtitle', 'score'}]
+    """
+    ranked = list(ClinicSearchToken.matches(clinic, query)[:limit])
+    if not ranked:
+        return []
+
+    ids = defaultdict(list)
+    for row in ranked:
+        ids[row['kind']].append(row['object_id'])
+
+    details = {}
+    if ids['appointment']:
+        for row in VetAppointment.objects.filter(
+            id__in=ids['appointment'], slot__clinic=clinic
+        ).values(
+            'id', 'status', 'pet__name', 'owner__username', 'owner__first_name', 'owner__last_name',
+            'slot__date', 'slot__start_time'
+        ):
+            owner_name = f"{row['owner__first_name']} {row['owner__last_name']}".strip() or row['owner__username']
+            details[('appointment', row['id'])] = {
+                'title': f"{row['pet__name']}（{owner_name}）",
+                'subtitle': f"{row['slot__date'].strftime('%Y-%m-%d')} {row['slot__start_time'].strftime('%H:%M')}",
+                'status': row['status'],
+            }
+    if ids['pet']:
+        for row in Pet.objects.filter(id__in=ids['pet']).values(
+            'id', 'name', 'species', 'chip', 'owner__username', 'owner__first_name', 'owner__last_name'
+        ):
+            owner_name = f"{row['owner__first_name']} {row['owner__last_name']}".strip() or row['owner__username']
+            details[('pet', row['id'])] = {
+                'title': row['name'],
+                'subtitle': f"飼主：{owner_name}" + (f"，晶片：{row['chip']}" if row['chip'] else ''),
+                'species': row['species'],
+            }
+    if ids['owner']:
+        for row in User.objects.filter(id__in=ids['owner']).values(
+            'id', 'username', 'first_name', 'last_name', 'profile__phone_number'
+        ):
+            details[('owner', row['id'])] = {
+                'title': f"{row['first_name']} {row['last_name']}".strip() or row['username'],
+                'subtitle': row['profile__phone_number'] or row['username'],
+            }
+
+    results = []
+    for row in ranked:
+        detail = details.get((row['kind'], row['object_id']))
+        if detail is None:
+            continue  # 索引殘留（原資料已刪除）
+        results.append({'type': row['kind'], 'id': row['object_id'], 'score': row['score'], **detail})
+    return results
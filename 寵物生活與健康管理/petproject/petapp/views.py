@@ -1,7 +1,8 @@
 # petapp/views.py 
 
-from collections import defaultdict
-from django.http import HttpResponseRedirect, JsonResponse
+from collections import defaultdict, deque
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect, get_object_or_404
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
@@ -12,6 +13,9 @@ from allauth.account.models import EmailAddress, EmailConfirmationHMAC
 from .models import (
     Profile, Pet, VetClinic, VetDoctor, VetSchedule, VetAppointment, VetScheduleException,
     AppointmentSlot, VaccineRecord, DewormRecord, Report, MedicalRecord,PetType,DailyRecord,BusinessHoursRecord,
+    ScheduleTemplate, ScheduleTemplateEntry, ScheduleManager, SlotHold, ClinicDailyStats,
+    ClinicSearchToken, EmailOutbox, CareDueDate, VetPatient, MeasurementRollup, HealthAlert, SyncChange, get_notification_count_cached,
+    bump_clinic_cache_version,
 )
 from .forms import (
     VetClinicRegistrationForm, VetDoctorForm, AppointmentBookingForm,
@@ -27,16 +31,21 @@ from django.views.decorators.csrf import csrf_protect
 from django.contrib import messages
 from django.views.decorators.http import require_POST, require_http_methods ,require_GET
 from datetime import date, datetime, timedelta, time
-from django.core.mail import send_mail  # 匯入發信功能
 import json
-from django.db.models import Min, Max, Count, Sum, Avg, Q, F
+import asyncio
+from django.db.models import Count, Sum, Avg, Q, F
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
 
 from calendar import monthrange
 import calendar
-from django.utils.timezone import localtime
-from .utils import get_temperature_data, get_weight_data
+from . import events, series, sync
+from .utils import (
+    get_temperature_data, get_weight_data, get_clinic_appointment_stats, get_clinic_trends,
+    get_clinic_cached, get_appointment_page, parse_appointment_cursor, search_clinic, get_vet_workbench_stats,
+    get_health_series,
+)
 from dateutil.relativedelta import relativedelta
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
@@ -57,7 +66,7 @@ def require_clinic_management(view_func):
         
         try:
             # 檢查是否有 vet_profile
-            vet_profile = request.user.vet_profile
+            vet_profile = request.identity.vet_profile
             
             # 檢查是否為診所管理員或有管理權限
             if not vet_profile.is_clinic_admin and not vet_profile.can_manage_doctors:
@@ -92,7 +101,7 @@ def require_verified_vet(view_func):
             return redirect('account_login')
         
         try:
-            vet_profile = request.user.vet_profile
+            vet_profile = request.identity.vet_profile
             
             # 檢查是否為診所管理員（自動通過驗證）
             if vet_profile.is_clinic_admin:
@@ -125,7 +134,7 @@ def require_medical_license(view_func):
             return redirect('account_login')
         
         try:
-            vet_profile = request.user.vet_profile
+            vet_profile = request.identity.vet_profile
             
             # 診所管理員如果同時是獸醫師，檢查是否有執照驗證
             if vet_profile.is_clinic_admin:
@@ -162,7 +171,7 @@ def require_owner_or_vet(view_func):
             return redirect('account_login')
         
         try:
-            profile = request.user.profile
+            profile = request.identity.profile
             
             # 檢查是否為飼主或獸醫師
             if profile.account_type not in ['owner', 'veterinarian', 'clinic_admin']:
@@ -195,11 +204,8 @@ def check_pet_ownership(view_func):
                 if pet.owner != request.user:
                     # 如果是獸醫師，檢查是否有看診記錄
                     try:
-                        vet_profile = request.user.vet_profile
-                        if not VetAppointment.objects.filter(
-                            slot__doctor=vet_profile, 
-                            pet=pet
-                        ).exists():
+                        vet_profile = request.identity.vet_profile
+                        if not VetPatient.has_patient(vet_profile, pet):
                             messages.error(request, '您沒有權限查看此寵物資料')
                             return redirect('home')
                     except AttributeError:
@@ -225,7 +231,7 @@ def require_owner_account(view_func):
             return redirect('account_login')
         
         try:
-            profile = request.user.profile
+            profile = request.identity.profile
             
             if profile.account_type != 'owner':
                 messages.error(request, '此功能僅限飼主使用')
@@ -263,13 +269,7 @@ def send_appointment_confirmation_email(appointment):
 — 毛日好 Paw&Day 系統
     """
     
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        [appointment.owner.email],
-        fail_silently=True
-    )
+    EmailOutbox.enqueue(subject, message, appointment.owner.email, category='appointment_confirmed')
 
 def send_cancellation_notification_enhanced(owner_email, owner_name, pet_name, 
                                           appointment_date, appointment_time, 
@@ -294,27 +294,22 @@ def send_cancellation_notification_enhanced(owner_email, owner_name, pet_name,
 — 毛日好 Paw&Day 系統
     """
     
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        [owner_email],
-        fail_silently=True
-    )
+    EmailOutbox.enqueue(subject, message, owner_email, category='appointment_cancelled')
 
 # ============ 共用函數定義 ============
 
-def get_user_clinic_info(user):
+def get_user_clinic_info(request):
     """
-    獲取用戶的診所資訊 - 支援雙重身分
+    獲取用戶的診所資訊 - 支援雙重身分（讀取 IdentityMiddleware 解析好的 request.identity）
     """
     try:
-        vet_profile = user.vet_profile
-        clinic = vet_profile.clinic
+        identity = request.identity
+        vet_profile = identity.vet_profile
+        clinic = identity.clinic
         
         print(f"🔍 用戶身分檢查:")
-        print(f"   - Username: {user.username}")
-        print(f"   - Profile Account Type: {user.profile.account_type}")
+        print(f"   - Username: {request.user.username}")
+        print(f"   - Profile Account Type: {identity.account_type}")
         print(f"   - Is Clinic Admin: {vet_profile.is_clinic_admin}")
         print(f"   - License Verified: {vet_profile.license_verified_with_moa}")
         print(f"   - Clinic: {clinic.clinic_name if clinic else 'None'}")
@@ -336,7 +331,7 @@ def home(request):
     if request.user.is_authenticated:
         try:
             # 🔧 修復：先檢查是否有 Profile
-            profile = getattr(request.user, 'profile', None)
+            profile = request.identity.profile
             
             if profile:
                 context['user_type'] = profile.account_type
@@ -350,7 +345,7 @@ def home(request):
                 elif profile.account_type == 'clinic_admin':
                     # 🔧 修復：診所管理員邏輯
                     try:
-                        vet_doctor = getattr(request.user, 'vet_profile', None)
+                        vet_doctor = request.identity.vet_profile
                         
                         if vet_doctor and vet_doctor.clinic:
                             # 有診所，顯示管理介面
@@ -359,12 +354,8 @@ def home(request):
                             context['is_clinic_admin'] = True
                             
                             # 今日預約數
-                            today_appointments = VetAppointment.objects.filter(
-                                slot__clinic=clinic,
-                                slot__date=date.today(),
-                                status='confirmed'
-                            ).count()
-                            context['today_appointments'] = today_appointments
+                            stats = get_clinic_appointment_stats(clinic, include_doctors=False)
+                            context['today_appointments'] = stats['today_confirmed']
                             
                             print(f"✅ 診所管理員 - 診所: {clinic.clinic_name}")  # 除錯用
                             
@@ -469,7 +460,7 @@ def clinic_registration_success(request, clinic_id):
 
 def send_welcome_email(clinic):
     """發送歡迎信給新診所"""
-    admin_doctor = clinic.doctors.filter(is_clinic_admin=True).first()
+    admin_doctor = clinic.doctors.filter(is_active=True, is_active_admin=True).first()
     if admin_doctor:
         subject = "歡迎加入毛日好 Paw&Day 寵物醫療平台"
         message = f"""
@@ -497,13 +488,7 @@ def send_welcome_email(clinic):
 — 毛日好 Paw&Day 團隊
         """
         
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [admin_doctor.user.email],
-            fail_silently=True
-        )
+        EmailOutbox.enqueue(subject, message, admin_doctor.user.email, category='clinic_welcome')
 
 
 
@@ -546,11 +531,8 @@ def verify_vet_license(request):
 
 def send_vet_verification_notification(vet_doctor):
     """發送獸醫師驗證成功通知"""
-    from django.core.mail import send_mail
-    from django.conf import settings
-    
     # 通知診所管理員
-    clinic_admins = vet_doctor.clinic.doctors.filter(is_clinic_admin=True)
+    clinic_admins = vet_doctor.clinic.doctors.filter(is_active=True, is_active_admin=True)
     
     for admin in clinic_admins:
         subject = f"【毛日好】獸醫師執照驗證成功 - {vet_doctor.user.get_full_name()}"
@@ -571,71 +553,16 @@ def send_vet_verification_notification(vet_doctor):
 — 毛日好 Paw&Day 系統
         """
         
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [admin.user.email],
-            fail_silently=True
-        )
+        EmailOutbox.enqueue(subject, message, admin.user.email, category='vet_verified')
 
 # ============ 3. 診所管理介面 ============
 @login_required
 def clinic_dashboard(request):
     """診所管理主控台"""
     try:
-        # 🔧 修復：更robust的方式獲取診所資訊
-        vet_profile = None
-        clinic = None
-        
-        # 方法1：嘗試透過 vet_profile 獲取
-        try:
-            vet_profile = request.user.vet_profile
-            clinic = vet_profile.clinic
-            print(f"✅ 透過 vet_profile 找到診所: {clinic.clinic_name}")
-        except Exception as e:
-            print(f"❌ 無法透過 vet_profile 獲取診所: {e}")
-        
-        # 方法2：如果方法1失敗，嘗試透過 Profile 和診所關聯
-        if not clinic:
-            try:
-                profile = request.user.profile
-                if profile.account_type == 'clinic_admin':
-                    # 查找與該用戶關聯的診所
-                    vet_doctors = VetDoctor.objects.filter(user=request.user)
-                    if vet_doctors.exists():
-                        clinic = vet_doctors.first().clinic
-                        vet_profile = vet_doctors.first()
-                        print(f"✅ 透過查詢 VetDoctor 找到診所: {clinic.clinic_name}")
-            except Exception as e:
-                print(f"❌ 無法透過 Profile 獲取診所: {e}")
-        
-        # 方法3：如果還是沒有，查找用戶相關的所有診所
-        if not clinic:
-            try:
-                # 查找該用戶創建的診所（基於email比對）
-                user_email = request.user.email
-                clinics = VetClinic.objects.filter(clinic_email=user_email)
-                if clinics.exists():
-                    clinic = clinics.first()
-                    print(f"✅ 透過email比對找到診所: {clinic.clinic_name}")
-                    
-                    # 嘗試建立遺失的 VetDoctor 關聯
-                    vet_profile, created = VetDoctor.objects.get_or_create(
-                        user=request.user,
-                        clinic=clinic,
-                        defaults={
-                            'is_clinic_admin': True,
-                            'can_manage_appointments': True,
-                            'can_manage_doctors': True,
-                            'is_active': True,
-                            'is_verified': True
-                        }
-                    )
-                    if created:
-                        print(f"✅ 已重建 VetDoctor 關聯")
-            except Exception as e:
-                print(f"❌ 無法透過email查找診所: {e}")
+        # 由 IdentityMiddleware 一次解析好的身分（不再於讀取時補建 VetDoctor）
+        vet_profile = request.identity.vet_profile
+        clinic = request.identity.clinic
         
         # 如果還是找不到診所
         if not clinic:
@@ -648,24 +575,14 @@ def clinic_dashboard(request):
             return redirect('home')
         
         # 統計資料
+        stats = get_clinic_appointment_stats(clinic)
         context = {
             'clinic': clinic,
             'vet_profile': vet_profile,
-            'doctors_count': clinic.doctors.filter(is_active=True).count(),
-            'today_appointments': VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                slot__date=date.today(),
-                status='confirmed'
-            ).count(),
-            'pending_appointments': VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                status='pending'
-            ).count(),
-            'total_appointments_this_month': VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                slot__date__year=date.today().year,
-                slot__date__month=date.today().month
-            ).count(),
+            'doctors_count': stats['doctors_count'],
+            'today_appointments': stats['today_confirmed'],
+            'pending_appointments': stats['pending'],
+            'total_appointments_this_month': stats['month'],
         }
         
         return render(request, 'clinic/dashboard.html', context)
@@ -681,7 +598,7 @@ def manage_doctors(request):
     """管理診所醫師"""
     try:
         # 🔧 使用共用函數獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             messages.error(request, '找不到與您關聯的診所資訊')
@@ -710,7 +627,7 @@ def manage_doctors(request):
 def add_doctor(request):
     """新增獸醫師 - 支持 AJAX"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             messages.error(request, '找不到與您關聯的診所資訊')
@@ -823,7 +740,7 @@ def add_doctor(request):
 def edit_doctor(request, doctor_id):
     """編輯醫師資料 - 支援雙重身份管理"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             messages.error(request, '找不到與您關聯的診所資訊')
@@ -1006,9 +923,6 @@ def check_user_permissions(user):
 
 def send_doctor_welcome_email(doctor):
     """發送歡迎信給新醫師"""
-    from django.core.mail import send_mail
-    from django.conf import settings
-    
     subject = f"歡迎加入 {doctor.clinic.clinic_name} - 毛日好 Paw&Day"
     message = f"""
 親愛的 {doctor.user.get_full_name() or doctor.user.username} 醫師，您好：
@@ -1033,25 +947,15 @@ def send_doctor_welcome_email(doctor):
 — 毛日好 Paw&Day 團隊
     """
     
-    try:
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [doctor.user.email],
-            fail_silently=False
-        )
-        print(f"✅ 已發送歡迎信給 {doctor.user.email}")
-    except Exception as e:
-        print(f"❌ 發送歡迎信失敗: {e}")
-        raise
+    EmailOutbox.enqueue(subject, message, doctor.user.email, category='doctor_welcome')
+    print(f"✅ 已排入歡迎信給 {doctor.user.email}")
 
 @login_required 
 @require_POST
 def toggle_doctor_status(request, doctor_id):
     """啟用/停用獸醫師"""
     try:
-        vet_profile = request.user.vet_profile
+        vet_profile = request.identity.vet_profile
         clinic = vet_profile.clinic
         
         # 權限檢查：只有診所管理員可以啟用/停用醫師
@@ -1075,6 +979,9 @@ def toggle_doctor_status(request, doctor_id):
         doctor.user.is_active = doctor.is_active
         doctor.user.save()
         
+        # 醫師人數與排班都會影響儀表板統計
+        bump_clinic_cache_version(doctor.clinic_id)
+
         # 如果停用醫師，也要停用其排班
         if not doctor.is_active:
             VetSchedule.objects.filter(doctor=doctor).update(is_active=False)
@@ -1094,7 +1001,7 @@ def toggle_doctor_status(request, doctor_id):
 def api_clinic_business_hours(request):
     """診所營業時間 API"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所'})
 
@@ -1129,7 +1036,7 @@ def api_save_business_hours(request):
     """儲存診所營業時間 API"""
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所資訊'})
@@ -1195,7 +1102,7 @@ def api_get_business_hours(request):
     """獲取診所營業時間 API"""
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所資訊'})
@@ -1230,7 +1137,7 @@ def api_clinic_business_hours(request):
     """獲取診所當前營業狀態 API"""
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所資訊'})
@@ -1354,53 +1261,9 @@ def get_default_business_hours():
 def clinic_dashboard(request):
     """診所管理主控台 """
     try:
-        # 原有的診所資訊獲取邏輯保持不變
-        vet_profile = None
-        clinic = None
-        
-        # 獲取診所資訊（保持原有邏輯）
-        try:
-            vet_profile = request.user.vet_profile
-            clinic = vet_profile.clinic
-            print(f"✅ 透過 vet_profile 找到診所: {clinic.clinic_name}")
-        except Exception as e:
-            print(f"❌ 無法透過 vet_profile 獲取診所: {e}")
-        
-        if not clinic:
-            try:
-                profile = request.user.profile
-                if profile.account_type == 'clinic_admin':
-                    vet_doctors = VetDoctor.objects.filter(user=request.user)
-                    if vet_doctors.exists():
-                        clinic = vet_doctors.first().clinic
-                        vet_profile = vet_doctors.first()
-                        print(f"✅ 透過查詢 VetDoctor 找到診所: {clinic.clinic_name}")
-            except Exception as e:
-                print(f"❌ 無法透過 Profile 獲取診所: {e}")
-        
-        if not clinic:
-            try:
-                user_email = request.user.email
-                clinics = VetClinic.objects.filter(clinic_email=user_email)
-                if clinics.exists():
-                    clinic = clinics.first()
-                    print(f"✅ 透過email比對找到診所: {clinic.clinic_name}")
-                    
-                    vet_profile, created = VetDoctor.objects.get_or_create(
-                        user=request.user,
-                        clinic=clinic,
-                        defaults={
-                            'is_clinic_admin': True,
-                            'can_manage_appointments': True,
-                            'can_manage_doctors': True,
-                            'is_active': True,
-                            'is_verified': True
-                        }
-                    )
-                    if created:
-                        print(f"✅ 已重建 VetDoctor 關聯")
-            except Exception as e:
-                print(f"❌ 無法透過email查找診所: {e}")
+        # 診所資訊由 IdentityMiddleware 解析（request.identity）
+        vet_profile = request.identity.vet_profile
+        clinic = request.identity.clinic
         
         if not clinic:
             messages.error(request, '找不到與您關聯的診所資訊，請聯絡系統管理員')
@@ -1418,24 +1281,14 @@ def clinic_dashboard(request):
             business_hours_data = get_default_business_hours()
         
         # 統計資料
+        stats = get_clinic_appointment_stats(clinic)
         context = {
             'clinic': clinic,
             'vet_profile': vet_profile,
-            'doctors_count': clinic.doctors.filter(is_active=True).count(),
-            'today_appointments': VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                slot__date=date.today(),
-                status='confirmed'
-            ).count(),
-            'pending_appointments': VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                status='pending'
-            ).count(),
-            'total_appointments_this_month': VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                slot__date__year=date.today().year,
-                slot__date__month=date.today().month
-            ).count(),
+            'doctors_count': stats['doctors_count'],
+            'today_appointments': stats['today_confirmed'],
+            'pending_appointments': stats['pending'],
+            'total_appointments_this_month': stats['month'],
             'business_hours_data': business_hours_data,  # 新增營業時間數據
         }
         
@@ -1452,7 +1305,7 @@ def manage_schedules(request, doctor_id=None):
     """管理醫師排班"""
     try:
         # 🔧 使用共用函數獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             messages.error(request, '找不到與您關聯的診所資訊')
@@ -1546,7 +1399,7 @@ def add_schedule(request, doctor_id):
     
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return json_error_response('找不到診所資訊')
         
@@ -1652,7 +1505,7 @@ def add_schedule(request, doctor_id):
 def edit_schedule(request, schedule_id):
     """編輯排班"""
     try:
-        vet_profile = request.user.vet_profile
+        vet_profile = request.identity.vet_profile
         clinic = vet_profile.clinic
         
         # 取得排班記錄（必須是同一診所的醫師）
@@ -1693,7 +1546,7 @@ def edit_schedule(request, schedule_id):
 def toggle_schedule_status(request, schedule_id):
     """切換排班狀態"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所'})
         
@@ -1722,7 +1575,7 @@ def toggle_schedule_status(request, schedule_id):
 def copy_week_schedule(request, doctor_id):
     """複製上週排班"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所'})
         
@@ -1731,13 +1584,251 @@ def copy_week_schedule(request, doctor_id):
         # 權限檢查
         if doctor != vet_profile and not vet_profile.can_manage_doctors:
             return JsonResponse({'success': False, 'message': '權限不足'})
-        
-        # 這裡實作複製邏輯（暫時返回成功訊息）
+
+        try:
+            data = json.loads(request.body) if request.body else {}
+        except json.JSONDecodeError:
+            return JsonResponse({'success': False, 'message': '數據格式錯誤'}, status=400)
+
+        source = data.get('source', 'last_week')
+        overwrite = bool(data.get('overwrite', False))
+        today = date.today()
+        this_monday = today - timedelta(days=today.weekday())
+        next_monday = this_monday + timedelta(days=7)
+
+        if source == 'template':
+            templates = ScheduleTemplate.objects.filter(clinic=clinic, is_active=True)
+            template_id = data.get('template_id')
+            if template_id:
+                template = templates.filter(id=template_id).first()
+            elif templates.count() == 1:
+                template = templates.first()
+            else:
+                template = None
+
+            if not template:
+                return JsonResponse({'success': False, 'message': '請先選擇要套用的排班範本'})
+
+            weeks = max(1, min(int(data.get('weeks', 2)), 12))
+            result = ScheduleManager.apply_template(
+                template, [doctor], next_monday, weeks=weeks, overwrite=overwrite
+            )
+            return JsonResponse({
+                'success': True,
+                'message': f'已套用範本「{template.name}」：新增 {result["schedules_created"]} 筆排班、{result["slots_created"]} 個預約時段',
+                **result
+            })
+
+        # 複製上週的預約時段到下週
+        slots_created = ScheduleManager.copy_week_slots(
+            doctor, this_monday - timedelta(days=7), next_monday, overwrite=overwrite
+        )
         return JsonResponse({
-            'success': True, 
-            'message': '複製上週排班功能開發中'
+            'success': True,
+            'message': f'已複製上週排班，新增 {slots_created} 個預約時段',
+            'slots_created': slots_created
         })
-        
+
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': '；'.join(e.messages)}, status=400)
+    except (TypeError, ValueError) as e:
+        return JsonResponse({'success': False, 'message': f'資料格式錯誤: {str(e)}'}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+
+
+def serialize_schedule_template(template):
+    """排班範本轉為 JSON 格式"""
+    return {
+        'id': template.id,
+        'name': template.name,
+        'description': template.description,
+        'entries': [
+            {
+                'weekday': entry.weekday,
+                'weekdayDisplay': entry.get_weekday_display(),
+                'startTime': entry.start_time.strftime('%H:%M'),
+                'endTime': entry.end_time.strftime('%H:%M'),
+                'appointmentDuration': entry.appointment_duration,
+                'maxAppointmentsPerSlot': entry.max_appointments_per_slot,
+                'notes': entry.notes,
+            }
+            for entry in template.entries.all()
+        ]
+    }
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def api_schedule_templates(request):
+    """診所排班範本 API：GET 列出、POST 建立（可指定 entries 或從某位醫師現有排班建立）"""
+    try:
+        vet_profile, clinic = get_user_clinic_info(request)
+        if not clinic:
+            return JsonResponse({'success': False, 'message': '找不到診所'})
+
+        if request.method == 'GET':
+            templates = ScheduleTemplate.objects.filter(
+                clinic=clinic, is_active=True
+            ).prefetch_related('entries').order_by('name')
+            return JsonResponse({
+                'success': True,
+                'templates': [serialize_schedule_template(t) for t in templates]
+            })
+
+        if not vet_profile.can_manage_doctors:
+            return JsonResponse({'success': False, 'message': '權限不足'}, status=403)
+
+        data = json.loads(request.body)
+        name = (data.get('name') or '').strip()
+        if not name:
+            return JsonResponse({'success': False, 'message': '請填寫範本名稱'}, status=400)
+
+        entries = []
+        if data.get('from_doctor_id'):
+            source_doctor = get_object_or_404(VetDoctor, id=data['from_doctor_id'], clinic=clinic)
+            for schedule in VetSchedule.objects.filter(doctor=source_doctor, is_active=True):
+                entries.append(ScheduleTemplateEntry(
+                    weekday=schedule.weekday,
+                    start_time=schedule.start_time,
+                    end_time=schedule.end_time,
+                    appointment_duration=schedule.appointment_duration,
+                    max_appointments_per_slot=schedule.max_appointments_per_slot,
+                    notes=schedule.notes
+                ))
+        else:
+            for item in data.get('entries', []):
+                entries.append(ScheduleTemplateEntry(
+                    weekday=int(item['weekday']),
+                    start_time=datetime.strptime(item['start_time'], '%H:%M').time(),
+                    end_time=datetime.strptime(item['end_time'], '%H:%M').time(),
+                    appointment_duration=int(item.get('appointment_duration', clinic.default_appointment_duration)),
+                    max_appointments_per_slot=int(item.get('max_appointments_per_slot', 1)),
+                    notes=item.get('notes', '')
+                ))
+
+        if not entries:
+            return JsonResponse({'success': False, 'message': '範本至少需要一個時段'}, status=400)
+
+        # 每個時段先檢查星期、起訖時間、時長與人數範圍，範本本身的時段也不能互相重疊
+        for entry in entries:
+            try:
+                entry.clean()
+            except ValidationError as e:
+                return JsonResponse({'success': False, 'message': '；'.join(e.messages)}, status=400)
+        weekday_names = dict(VetSchedule.WEEKDAY_CHOICES)
+        overlaps = ScheduleManager.find_overlaps([
+            (entry.weekday, entry.start_time, entry.end_time,
+             f"{weekday_names[entry.weekday]} {entry.start_time.strftime('%H:%M')}-{entry.end_time.strftime('%H:%M')}")
+            for entry in entries
+        ])
+        if overlaps:
+            return JsonResponse({
+                'success': False,
+                'message': '；'.join(f'時間衝突：{b} 與 {a} 重疊' for _, a, b in overlaps)
+            }, status=400)
+
+        if ScheduleTemplate.objects.filter(clinic=clinic, name=name).exists():
+            return JsonResponse({'success': False, 'message': '範本名稱已存在'}, status=400)
+
+        with transaction.atomic():
+            template = ScheduleTemplate.objects.create(
+                clinic=clinic,
+                name=name,
+                description=data.get('description', ''),
+                created_by=request.user
+            )
+            for entry in entries:
+                entry.template = template
+            ScheduleTemplateEntry.objects.bulk_create(entries)
+
+        return JsonResponse({
+            'success': True,
+            'message': f'排班範本「{name}」已建立',
+            'template': serialize_schedule_template(template)
+        })
+
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': '數據格式錯誤'}, status=400)
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({'success': False, 'message': f'資料格式錯誤: {str(e)}'}, status=400)
+    except Exception as e:
+        print(f"❌ 排班範本 API 錯誤: {e}")
+        return JsonResponse({'success': False, 'message': str(e)}, status=500)
+
+
+@login_required
+@require_POST
+def api_apply_schedule_template(request, template_id):
+    """
+    將排班範本一次套用到多位醫師、多週
+    JSON: {doctor_ids: [...], start_date: 'YYYY-MM-DD', weeks: N, overwrite: bool}
+    """
+    try:
+        vet_profile, clinic = get_user_clinic_info(request)
+        if not clinic:
+            return JsonResponse({'success': False, 'message': '找不到診所'})
+
+        if not vet_profile.can_manage_doctors:
+            return JsonResponse({'success': False, 'message': '權限不足'}, status=403)
+
+        template = get_object_or_404(ScheduleTemplate, id=template_id, clinic=clinic, is_active=True)
+        data = json.loads(request.body)
+
+        doctors = clinic.doctors.filter(is_active=True).select_related('user')
+        doctor_ids = data.get('doctor_ids')
+        if doctor_ids:
+            doctors = doctors.filter(id__in=doctor_ids)
+        doctors = list(doctors)
+        if not doctors:
+            return JsonResponse({'success': False, 'message': '請選擇要套用的醫師'}, status=400)
+
+        start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
+        if start_date <= date.today():
+            return JsonResponse({'success': False, 'message': '開始日期必須是明天以後'}, status=400)
+        weeks = int(data.get('weeks', 1))
+        if not 1 <= weeks <= 12:
+            return JsonResponse({'success': False, 'message': '套用週數需介於 1 到 12 週'}, status=400)
+
+        result = ScheduleManager.apply_template(
+            template, doctors, start_date, weeks=weeks, overwrite=bool(data.get('overwrite', False))
+        )
+
+        return JsonResponse({
+            'success': True,
+            'message': f'已為 {len(doctors)} 位醫師套用範本「{template.name}」：新增 {result["schedules_created"]} 筆排班、{result["slots_created"]} 個預約時段',
+            **result
+        })
+
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': '；'.join(e.messages), 'errors': e.messages}, status=400)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': '數據格式錯誤'}, status=400)
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({'success': False, 'message': f'資料格式錯誤: {str(e)}'}, status=400)
+    except Exception as e:
+        print(f"❌ 套用排班範本失敗: {e}")
+        return JsonResponse({'success': False, 'message': str(e)}, status=500)
+
+
+@login_required
+@require_POST
+def api_delete_schedule_template(request, template_id):
+    """刪除排班範本（已套用的排班不受影響）"""
+    try:
+        vet_profile, clinic = get_user_clinic_info(request)
+        if not clinic:
+            return JsonResponse({'success': False, 'message': '找不到診所'})
+
+        if not vet_profile.can_manage_doctors:
+            return JsonResponse({'success': False, 'message': '權限不足'}, status=403)
+
+        template = get_object_or_404(ScheduleTemplate, id=template_id, clinic=clinic)
+        name = template.name
+        template.delete()
+
+        return JsonResponse({'success': True, 'message': f'排班範本「{name}」已刪除'})
+
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)})
 
@@ -1747,7 +1838,7 @@ def delete_schedule(request, schedule_id):
     """刪除排班 """
     try:
         # 獲取用戶診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所資訊'}, status=400)
@@ -1783,6 +1874,13 @@ def delete_schedule(request, schedule_id):
                 doctor=schedule.doctor,
                 date__gte=date.today()
             ).update(is_available=False)
+            # 預約表單最多只能預約 60 天內
+            AppointmentSlot.invalidate_month_availability(
+                schedule.doctor.clinic_id, date.today(), date.today() + timedelta(days=60)
+            )
+            ClinicDailyStats.refresh_capacity(
+                [schedule.doctor_id], date.today(), date.today() + timedelta(days=60)
+            )
             
             return JsonResponse({
                 'success': True, 
@@ -1800,6 +1898,12 @@ def delete_schedule(request, schedule_id):
                 
                 # 刪除排班
                 schedule.delete()
+                AppointmentSlot.invalidate_month_availability(
+                    schedule.doctor.clinic_id, date.today(), date.today() + timedelta(days=60)
+                )
+                ClinicDailyStats.refresh_capacity(
+                    [schedule.doctor_id], date.today(), date.today() + timedelta(days=60)
+                )
                 
                 print(f"✅ 已刪除排班和 {deleted_slots[0]} 個預約時段")
             
@@ -1865,6 +1969,10 @@ def generate_appointment_slots(doctor, schedule, days_ahead=30):
                         current_time = slot_end
             
             current_date += timedelta(days=1)
+
+        # regenerate_slots_for_schedule 會先刪除時段再呼叫這裡，即使沒有新時段也要更新
+        AppointmentSlot.invalidate_month_availability(doctor.clinic_id, start_date, end_date)
+        ClinicDailyStats.refresh_capacity([doctor.id], start_date, end_date)
         
         return slots_created
         
@@ -1896,7 +2004,7 @@ def view_appointment_detail(request, appointment_id):
     """查看預約詳情 - 支援 AJAX"""
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所資訊'})
@@ -1941,7 +2049,7 @@ def complete_appointment(request, appointment_id):
     """標記預約完成 - AJAX API"""
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所資訊'})
@@ -1983,7 +2091,7 @@ def confirm_appointment(request, appointment_id):
     """確認預約 - AJAX API"""
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所資訊'})
@@ -2031,7 +2139,7 @@ def clinic_cancel_appointment(request, appointment_id):
     """診所取消預約 """
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -2068,18 +2176,14 @@ def clinic_cancel_appointment(request, appointment_id):
         appointment_time = appointment.slot.start_time
         clinic_name = clinic.clinic_name
         
-        # 刪除預約
-        appointment.delete()
-        
-        # 發送取消通知
-        try:
+        # 刪除預約與排入取消通知在同一個交易
+        with transaction.atomic():
+            appointment.delete()
             send_cancellation_notification_enhanced(
                 owner_email, owner_name, pet_name, 
                 appointment_date, appointment_time, 
                 clinic_name, cancel_reason
             )
-        except Exception as e:
-            print(f"發送取消通知失敗: {e}")
         
         success_msg = '預約已取消並已通知飼主'
         
@@ -2112,15 +2216,26 @@ def create_appointment(request, pet_id):
         
         if request.method == 'POST':
             print(f"📝 收到預約POST請求: {request.POST}")  # 調試用
-            
+
+            # 先回收該時段逾期的保留（包括自己的），過期保留不再佔用名額
+            slot_id = request.POST.get('time_slot', '')
+            if slot_id.isdigit():
+                SlotHold.release_expired(slot_id=int(slot_id))
+
             form = AppointmentBookingForm(request.POST, pet=pet, user=request.user)
             
             if form.is_valid():
                 try:
                     with transaction.atomic():
-                        # 檢查時段是否仍可預約
                         slot = form.cleaned_data['time_slot']
-                        if not slot.can_book():
+
+                        # 有保留代碼就直接把保留的名額轉成預約
+                        slot_reserved = SlotHold.confirm(
+                            form.cleaned_data.get('hold_token'), request.user, slot
+                        )
+
+                        # 先快速檢查時段是否仍可預約（真正的佔位在 VetAppointment.save 以條件式 UPDATE 完成）
+                        if not slot_reserved and not slot.can_book():
                             messages.error(request, '此時段已被預約，請重新選擇')
                             return render(request, 'appointments/create_appointment.html', {
                                 'form': form, 
@@ -2128,7 +2243,7 @@ def create_appointment(request, pet_id):
                             })
                         
                         # 建立預約
-                        appointment = VetAppointment.objects.create(
+                        appointment = VetAppointment(
                             pet=pet,
                             owner=request.user,
                             slot=slot,
@@ -2139,6 +2254,7 @@ def create_appointment(request, pet_id):
                             booking_type='online',
                             status='confirmed'
                         )
+                        appointment.save(slot_reserved=slot_reserved)
                         
                         # 發送通知
                         try:
@@ -2148,7 +2264,11 @@ def create_appointment(request, pet_id):
                         
                         messages.success(request, '預約成功！診所將會收到通知。')
                         return redirect('appointment_success', appointment_id=appointment.id)
-                        
+
+                except ValidationError as e:
+                    # 併發搶位失敗：條件式 UPDATE 沒有佔到名額
+                    print(f"⚠️ 時段已額滿: {e}")
+                    messages.error(request, '；'.join(e.messages))
                 except Exception as e:
                     print(f"💥 預約創建失敗: {e}")
                     messages.error(request, f'預約失敗：{str(e)}')
@@ -2220,10 +2340,14 @@ def api_load_doctors(request):
 
 @require_http_methods(["GET"])
 def api_load_time_slots(request):
-    """AJAX: 根據條件載入可用時段 """
+    """
+    AJAX: 根據條件載入可用時段
+    帶 hold_slot_id 時會先為登入的飼主暫時保留該時段，回傳保留代碼供送出表單時確認
+    """
     clinic_id = request.GET.get('clinic_id')
     doctor_id = request.GET.get('doctor_id')
     date_str = request.GET.get('date')
+    hold_slot_id = request.GET.get('hold_slot_id')
     
     print(f"🕐 載入時段請求: clinic={clinic_id}, doctor={doctor_id}, date={date_str}")
     
@@ -2237,12 +2361,43 @@ def api_load_time_slots(request):
         if target_date <= date.today():
             return JsonResponse({'slots': [], 'error': 'Invalid date'})
         
+        # 順手回收過期的保留，讓名額回到可預約狀態
+        SlotHold.release_expired()
+
+        # 保留時段（需登入）
+        hold_data = None
+        held_slot_id = None
+        if hold_slot_id:
+            if not request.user.is_authenticated:
+                return JsonResponse({'slots': [], 'error': '請先登入'}, status=401)
+
+            hold_slot = get_object_or_404(
+                AppointmentSlot, id=hold_slot_id, clinic_id=clinic_id, date=target_date
+            )
+            hold = SlotHold.place(hold_slot, request.user)
+            if hold:
+                held_slot_id = hold.slot_id
+                hold_data = {
+                    'token': hold.token,
+                    'slot_id': hold.slot_id,
+                    'expires_at': hold.expires_at.isoformat(),
+                    'ttl_seconds': SlotHold.default_ttl(),
+                }
+                print(f"🔒 已保留時段 {hold.slot_id} 至 {hold.expires_at}")
+            else:
+                hold_data = {'error': '此時段已被預約，請重新選擇'}
+
         # 基本查詢
         slots_query = AppointmentSlot.objects.filter(
             clinic_id=clinic_id,
             date=target_date,
             is_available=True
-        ).filter(current_bookings__lt=F('max_bookings'))
+        )
+        open_slots = Q(current_bookings__lt=F('max_bookings'))
+        if held_slot_id:
+            # 自己保留中的時段即使已滿也要出現在清單中
+            open_slots |= Q(id=held_slot_id)
+        slots_query = slots_query.filter(open_slots)
         
         # 如果指定醫師
         if doctor_id:
@@ -2253,17 +2408,21 @@ def api_load_time_slots(request):
         slots_data = []
         for slot in slots:
             # 確保時段確實可用
-            if slot.can_book():
+            if slot.can_book() or slot.id == held_slot_id:
                 slots_data.append({
                     'id': slot.id,
                     'start_time': slot.start_time.strftime('%H:%M'),
                     'end_time': slot.end_time.strftime('%H:%M'),
                     'doctor_name': slot.doctor.user.get_full_name() or slot.doctor.user.username,
-                    'available_slots': slot.max_bookings - slot.current_bookings
+                    'available_slots': slot.max_bookings - slot.current_bookings,
+                    'held': slot.id == held_slot_id
                 })
         
         print(f"⏰ 找到 {len(slots_data)} 個可用時段")
-        return JsonResponse({'slots': slots_data})
+        response = {'slots': slots_data}
+        if hold_data:
+            response['hold'] = hold_data
+        return JsonResponse(response)
         
     except ValueError as e:
         print(f"❌ 日期格式錯誤: {e}")
@@ -2272,13 +2431,168 @@ def api_load_time_slots(request):
         print(f"💥 載入時段失敗: {e}")
         return JsonResponse({'error': str(e)}, status=500)
 
+@require_http_methods(["GET"])
+def api_month_availability(request):
+    """
+    AJAX: 預約月曆一次取得整個月每天的剩餘名額與最早可預約時間
+    參數：clinic_id（必填）、doctor_id（選填）、year、month
+    """
+    clinic_id = request.GET.get('clinic_id')
+    doctor_id = request.GET.get('doctor_id')
+
+    if not clinic_id:
+        return JsonResponse({'success': False, 'days': [], 'error': 'Missing required parameters'}, status=400)
+
+    try:
+        today = date.today()
+        clinic_id = int(clinic_id)
+        doctor_id = int(doctor_id) if doctor_id else None
+        year = int(request.GET.get('year', today.year))
+        month = int(request.GET.get('month', today.month))
+        if not 1 <= month <= 12:
+            raise ValueError('month out of range')
+
+        # 同一診所同一月份共用一份快取，指定醫師時在記憶體中篩選
+        days = {}
+        for row in AppointmentSlot.month_availability(clinic_id, year, month):
+            if row['date'] <= today:
+                continue
+            if doctor_id and row['doctor_id'] != doctor_id:
+                continue
+
+            day = days.setdefault(row['date'], {'remaining': 0, 'earliest': row['earliest']})
+            day['remaining'] += row['remaining']
+            day['earliest'] = min(day['earliest'], row['earliest'])
+
+        return JsonResponse({
+            'success': True,
+            'year': year,
+            'month': month,
+            'days': [
+                {
+                    'date': day_date.isoformat(),
+                    'remaining': info['remaining'],
+                    'earliest': info['earliest'].strftime('%H:%M'),
+                }
+                for day_date, info in sorted(days.items())
+            ]
+        })
+
+    except ValueError as e:
+        print(f"❌ 月曆參數錯誤: {e}")
+        return JsonResponse({'success': False, 'days': [], 'error': 'Invalid parameters'}, status=400)
+    except Exception as e:
+        print(f"💥 載入月曆失敗: {e}")
+        return JsonResponse({'success': False, 'days': [], 'error': str(e)}, status=500)
+
+@require_http_methods(["GET"])
+def api_earliest_slots(request):
+    """
+    AJAX: 跨診所、跨醫師搜尋最早可預約的時段
+    參數：specialization、city、date_from、date_to、time_from、time_to、limit、cursor（皆選填）
+    以 (date, start_time, id) 做 keyset 分頁，回傳 next_cursor 供下一頁使用
+    """
+    try:
+        today = date.today()
+        date_from = request.GET.get('date_from')
+        date_to = request.GET.get('date_to')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else today + timedelta(days=1)
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else today + timedelta(days=60)
+        date_from = max(date_from, today + timedelta(days=1))  # 只能預約明天以後
+
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+
+        slots_query = AppointmentSlot.objects.filter(
+            is_available=True,
+            date__range=(date_from, date_to),
+            current_bookings__lt=F('max_bookings'),
+            clinic__is_verified=True,
+            doctor__is_active=True
+        )
+
+        time_from = request.GET.get('time_from')
+        time_to = request.GET.get('time_to')
+        if time_from:
+            slots_query = slots_query.filter(start_time__gte=datetime.strptime(time_from, '%H:%M').time())
+        if time_to:
+            slots_query = slots_query.filter(start_time__lt=datetime.strptime(time_to, '%H:%M').time())
+
+        specialization = request.GET.get('specialization', '').strip()
+        if specialization:
+            slots_query = slots_query.filter(doctor__specialization__icontains=specialization)
+
+        city = request.GET.get('city', '').strip()
+        if city:
+            # 資料中「台」「臺」混用，兩種寫法都比對
+            city_names = {city, city.replace('臺', '台'), city.replace('台', '臺')}
+            city_filter = Q()
+            for name in city_names:
+                city_filter |= Q(clinic__moa_county=name) | Q(clinic__clinic_address__startswith=name)
+            slots_query = slots_query.filter(city_filter)
+
+        # keyset 分頁：從上一頁最後一筆之後繼續
+        cursor = request.GET.get('cursor')
+        if cursor:
+            cursor_date, cursor_time, cursor_id = cursor.split(',')
+            cursor_date = datetime.strptime(cursor_date, '%Y-%m-%d').date()
+            cursor_time = datetime.strptime(cursor_time, '%H:%M:%S').time()
+            cursor_id = int(cursor_id)
+            slots_query = slots_query.filter(
+                Q(date__gt=cursor_date) |
+                Q(date=cursor_date, start_time__gt=cursor_time) |
+                Q(date=cursor_date, start_time=cursor_time, id__gt=cursor_id)
+            )
+
+        slots = list(slots_query.select_related(
+            'clinic', 'doctor__user'
+        ).order_by('date', 'start_time', 'id')[:limit + 1])
+
+        has_more = len(slots) > limit
+        slots = slots[:limit]
+
+        slots_data = [
+            {
+                'id': slot.id,
+                'date': slot.date.isoformat(),
+                'start_time': slot.start_time.strftime('%H:%M'),
+                'end_time': slot.end_time.strftime('%H:%M'),
+                'available_slots': slot.max_bookings - slot.current_bookings,
+                'doctor_id': slot.doctor_id,
+                'doctor_name': slot.doctor.user.get_full_name() or slot.doctor.user.username,
+                'specialization': slot.doctor.specialization or '',
+                'clinic_id': slot.clinic_id,
+                'clinic_name': slot.clinic.clinic_name,
+                'clinic_address': slot.clinic.clinic_address,
+                'clinic_phone': slot.clinic.clinic_phone,
+            }
+            for slot in slots
+        ]
+
+        next_cursor = None
+        if has_more and slots:
+            last = slots[-1]
+            next_cursor = f"{last.date.isoformat()},{last.start_time.strftime('%H:%M:%S')},{last.id}"
+
+        return JsonResponse({
+            'success': True,
+            'slots': slots_data,
+            'next_cursor': next_cursor
+        })
+
+    except ValueError as e:
+        print(f"❌ 搜尋參數錯誤: {e}")
+        return JsonResponse({'success': False, 'slots': [], 'error': 'Invalid parameters'}, status=400)
+    except Exception as e:
+        print(f"💥 搜尋最早時段失敗: {e}")
+        return JsonResponse({'success': False, 'slots': [], 'error': str(e)}, status=500)
+
 # ============ 預約管理 ============
 @login_required
 def clinic_appointments(request):
     """增強版診所預約管理"""
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             messages.error(request, '找不到與您關聯的診所資訊')
@@ -2320,14 +2634,10 @@ def clinic_appointments(request):
         if doctor_filter != 'all':
             appointments = appointments.filter(slot__doctor_id=doctor_filter)
         
-        # 搜尋篩選
+        # 搜尋篩選（走診所搜尋索引，不對預約歷史做 LIKE 掃描）
         if search_query:
             appointments = appointments.filter(
-                Q(pet__name__icontains=search_query) |
-                Q(owner__first_name__icontains=search_query) |
-                Q(owner__username__icontains=search_query) |
-                Q(reason__icontains=search_query) |
-                Q(notes__icontains=search_query)
+                id__in=ClinicSearchToken.matches(clinic, search_query, kind='appointment').values('object_id')
             )
         
         # 排序
@@ -2336,30 +2646,43 @@ def clinic_appointments(request):
         # 取得診所醫師列表
         doctors = clinic.doctors.filter(is_active=True).order_by('user__first_name')
         
-        # 如果是 AJAX 請求，返回 JSON
+        # 如果是 AJAX 請求，返回 JSON（keyset 分頁，參數 cursor、limit、with_total）
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            appointments_data = []
-            for apt in appointments:
-                appointments_data.append({
-                    'id': apt.id,
-                    'petName': apt.pet.name,
-                    'ownerName': apt.owner.get_full_name() or apt.owner.username,
-                    'doctorId': apt.slot.doctor.id,
-                    'doctorName': apt.slot.doctor.user.get_full_name() or apt.slot.doctor.user.username,
-                    'date': apt.slot.date.strftime('%Y-%m-%d'),
-                    'startTime': apt.slot.start_time.strftime('%H:%M'),
-                    'endTime': apt.slot.end_time.strftime('%H:%M'),
-                    'status': apt.status,
-                    'reason': apt.reason or '',
-                    'notes': apt.notes or '',
-                    'contactPhone': apt.contact_phone or '',
-                    'createdAt': apt.created_at.strftime('%Y-%m-%d %H:%M')
-                })
-            
+            try:
+                limit = max(1, min(int(request.GET.get('limit', 50)), 200))
+                page = get_appointment_page(
+                    appointments,
+                    cursor=request.GET.get('cursor'),
+                    limit=limit,
+                    with_total=request.GET.get('with_total') == '1'
+                )
+            except ValueError:
+                return JsonResponse({'success': False, 'message': '分頁參數錯誤'}, status=400)
+
+            appointments_data = [
+                {
+                    'id': row['id'],
+                    'petName': row['pet__name'],
+                    'ownerName': row['owner_name'],
+                    'doctorId': row['slot__doctor_id'],
+                    'doctorName': row['doctor_name'],
+                    'date': row['slot__date'].strftime('%Y-%m-%d'),
+                    'startTime': row['slot__start_time'].strftime('%H:%M'),
+                    'endTime': row['slot__end_time'].strftime('%H:%M'),
+                    'status': row['status'],
+                    'reason': row['reason'] or '',
+                    'notes': row['notes'] or '',
+                    'contactPhone': row['contact_phone'] or '',
+                    'createdAt': row['created_at'].strftime('%Y-%m-%d %H:%M')
+                }
+                for row in page['rows']
+            ]
+
             return JsonResponse({
                 'success': True,
                 'appointments': appointments_data,
-                'total': len(appointments_data)
+                'total': page['total'] if page['total'] is not None else len(appointments_data),
+                'next_cursor': page['next_cursor']
             })
         
         context = {
@@ -2423,65 +2746,11 @@ def api_search_clinics(request):
 def vet_home(request):
     """獸醫師主頁 - 工作台總覽"""
     try:
-        vet_profile = request.user.vet_profile
-        today = timezone.now().date()
-        
-        # 獲取今日預約數量
-        today_appointments_count = VetAppointment.objects.filter(
-            slot__doctor=vet_profile,
-            slot__date=today,
-            status__in=['confirmed', 'pending']
-        ).count()
-        
-        # 獲取總病患數量（這位獸醫師曾經看過的不重複病患）
-        total_patients_count = Pet.objects.filter(
-            vetappointment__slot__doctor=vet_profile
-        ).distinct().count()
-        
-        # 獲取醫療記錄數量（這位獸醫師建立的記錄）
-        medical_records_count = MedicalRecord.objects.filter(
-            attending_vet=vet_profile
-        ).count()
-        
-        # 計算本週工時（基於排班）
-        week_start = today - timedelta(days=today.weekday())
-        week_end = week_start + timedelta(days=6)
-        
-        weekly_slots = AppointmentSlot.objects.filter(
-            doctor=vet_profile,
-            date__range=[week_start, week_end],
-            is_available=True
-        )
-        
-        # 計算總工時（假設每個 slot 是 30 分鐘）
-        working_hours_this_week = weekly_slots.count() * 0.5
-        
-        # 計算變化數據
-        yesterday = today - timedelta(days=1)
-        yesterday_appointments = VetAppointment.objects.filter(
-            slot__doctor=vet_profile,
-            slot__date=yesterday,
-            status__in=['confirmed', 'completed']
-        ).count()
-        
-        appointments_change = today_appointments_count - yesterday_appointments
-        
-        # 本月新病患（第一次來看這位獸醫師的）
-        month_start = today.replace(day=1)
-        new_patients_this_month = Pet.objects.filter(
-            vetappointment__slot__doctor=vet_profile,
-            vetappointment__slot__date__gte=month_start
-        ).annotate(
-            first_visit=Min('vetappointment__slot__date')
-        ).filter(
-            first_visit__gte=month_start
-        ).count()
+        vet_profile = request.identity.vet_profile
+        today = timezone.localdate()
         
-        # 本週新增的醫療記錄
-        records_this_week = MedicalRecord.objects.filter(
-            attending_vet=vet_profile,
-            created_at__date__range=[week_start, week_end]
-        ).count()
+        # 統計數據由工作台統計服務計算（兩次彙總查詢，依醫師、日期快取）
+        stats = get_vet_workbench_stats(vet_profile, today)
         
         # 準備 context
         context = {
@@ -2489,15 +2758,15 @@ def vet_home(request):
             'today_date': today,
             
             # 統計數據
-            'today_appointments_count': today_appointments_count,
-            'total_patients_count': total_patients_count,
-            'medical_records_count': medical_records_count,
-            'working_hours_this_week': int(working_hours_this_week),
+            'today_appointments_count': stats['today_appointments_count'],
+            'total_patients_count': stats['total_patients_count'],
+            'medical_records_count': stats['medical_records_count'],
+            'working_hours_this_week': round(stats['working_minutes_this_week'] / 60, 1),
             
             # 變化數據
-            'appointments_change': appointments_change,
-            'new_patients_this_month': new_patients_this_month,
-            'records_this_week': records_this_week,
+            'appointments_change': stats['appointments_change'],
+            'new_patients_this_month': stats['new_patients_this_month'],
+            'records_this_week': stats['records_this_week'],
         }
         
         return render(request, 'vet_pages/vet_home.html', context)
@@ -2510,15 +2779,15 @@ def vet_home(request):
 def my_patients(request):
     """我的病患列表"""
     try:
-        vet_profile = request.user.vet_profile
+        vet_profile = request.identity.vet_profile
         
         # 獲取這位獸醫師看過的所有病患
         patients = Pet.objects.filter(
-            vetappointment__slot__doctor=vet_profile
-        ).distinct().annotate(
-            last_visit=Max('vetappointment__slot__date'),
-            total_visits=Count('vetappointment')
-        ).order_by('-last_visit')
+            vet_links__doctor=vet_profile
+        ).select_related('owner').annotate(
+            last_visit=F('vet_links__last_visit'),
+            total_visits=F('vet_links__visit_count')
+        ).order_by('-last_visit', '-id')
         
         # 分頁處理
         paginator = Paginator(patients, 12)  # 每頁顯示 12 個病患
@@ -2540,7 +2809,7 @@ def my_patients(request):
 def vet_appointments(request):
     # 確保是獸醫帳號
     try:
-        vet_profile = request.user.vet_profile
+        vet_profile = request.identity.vet_profile
         if not vet_profile.is_verified:
             messages.warning(request, "您的獸醫師執照尚未通過驗證")
             return redirect('verify_vet_license')
@@ -2583,7 +2852,7 @@ def vet_appointments(request):
 def create_medical_record(request, pet_id=None):
     """建立醫療記錄"""
     try:
-        vet_profile = request.user.vet_profile
+        vet_profile = request.identity.vet_profile
         
         # 如果有指定 pet_id，獲取寵物資料
         pet = None
@@ -2591,10 +2860,7 @@ def create_medical_record(request, pet_id=None):
             try:
                 pet = Pet.objects.get(id=pet_id)
                 # 檢查這位獸醫師是否有權限為這隻寵物建立記錄
-                if not VetAppointment.objects.filter(
-                    slot__doctor=vet_profile, 
-                    pet=pet
-                ).exists():
+                if not VetPatient.has_patient(vet_profile, pet):
                     messages.error(request, '您沒有權限為此寵物建立醫療記錄')
                     return redirect('vet_home')
             except Pet.DoesNotExist:
@@ -2608,8 +2874,8 @@ def create_medical_record(request, pet_id=None):
         
         # 獲取這位獸醫師的病患列表（用於選擇）
         available_pets = Pet.objects.filter(
-            vetappointment__slot__doctor=vet_profile
-        ).distinct().order_by('name')
+            vet_links__doctor=vet_profile
+        ).order_by('name')
         
         context = {
             'vet_profile': vet_profile,
@@ -2628,7 +2894,7 @@ def create_medical_record(request, pet_id=None):
 def edit_medical_record(request, pet_id, record_id):
     """編輯醫療記錄"""
     try:
-        vet_profile = request.user.vet_profile
+        vet_profile = request.identity.vet_profile
         
         # 獲取醫療記錄
         try:
@@ -2663,7 +2929,7 @@ def edit_medical_record(request, pet_id, record_id):
 def pet_detail(request, pet_id):
     """寵物詳情（獸醫師視角）"""
     try:
-        vet_profile = request.user.vet_profile
+        vet_profile = request.identity.vet_profile
         
         # 獲取寵物資料
         try:
@@ -2673,10 +2939,7 @@ def pet_detail(request, pet_id):
             return redirect('vet_home')
         
         # 檢查權限：這位獸醫師是否曾經看過這隻寵物
-        if not VetAppointment.objects.filter(
-            slot__doctor=vet_profile, 
-            pet=pet
-        ).exists():
+        if not VetPatient.has_patient(vet_profile, pet):
             messages.error(request, '您沒有權限查看此寵物資料')
             return redirect('vet_home')
         
@@ -2691,11 +2954,18 @@ def pet_detail(request, pet_id):
             attending_vet=vet_profile
         ).order_by('-created_at')
         
+        # 近半年體溫、體重的月彙總（讀彙總表，不掃原始紀錄）
+        six_months_ago = (timezone.localdate() - relativedelta(months=5)).replace(day=1)
+        health_rollups = MeasurementRollup.objects.filter(
+            pet=pet, period='month', bucket_start__gte=six_months_ago
+        ).order_by('kind', '-bucket_start')
+        
         context = {
             'pet': pet,
             'vet_profile': vet_profile,
             'appointments': appointments,
             'medical_records': medical_records,
+            'health_rollups': health_rollups,
         }
         
         return render(request, 'vet_pages/pet_detail.html', context)
@@ -2981,7 +3251,7 @@ def delete_pet(request, pet_id):
 def health_rec(request):
     # 撈出 飼主 所擁有的所有寵物
     pets = Pet.objects.filter(owner=request.user).prefetch_related(
-        'vaccine_records', 'deworm_records', 'reports'
+        'vaccine_records__vet', 'deworm_records__vet', 'reports', 'medicalrecord_set'
     )
 
     # 健康記錄 撈資料
@@ -2995,31 +3265,11 @@ def health_rec(request):
             'pet': pet,
             'records': recs,
         })
-    pet_temperatures = {}
-    pet_weights = {}
-    # 取得當前月份以及過去 2 個月（共 3 個月）的體溫資料
+    # 取得當前月份以及過去 2 個月（共 3 個月）的體溫、體重資料，所有寵物一次查詢
     months = [datetime.now() - relativedelta(months=i) for i in range(3)]
-
-    for pet in pet_map.keys():
-        temp_by_month = {}
-        weight_by_month = {}
-        for dt in months:
-            year, month = dt.year, dt.month
-            key = f"{year}-{str(month).zfill(2)}"
-
-            temp_records = get_temperature_data(pet, year, month)
-            weight_records = get_weight_data(pet, year, month)
-
-            temp_by_month[key] = [
-                {'date': rec['date'], 'temperature': rec['temperature']}
-                for rec in temp_records
-            ]
-            weight_by_month[key] = [
-                {'date': rec['date'], 'weight': rec['weight']}
-                for rec in weight_records
-            ]
-        pet_temperatures[pet.id] = temp_by_month
-        pet_weights[pet.id] = weight_by_month
+    health_series = get_health_series([pet.id for pet in pet_map.keys()], [(dt.year, dt.month) for dt in months])
+    pet_temperatures = {pet_id: data['temperature'] for pet_id, data in health_series.items()}
+    pet_weights = {pet_id: data['weight'] for pet_id, data in health_series.items()}
 
     return render(request, 'health_records/health_rec.html', {
         'grouped_records': grouped_records,
@@ -3192,18 +3442,10 @@ def vet_cancel_appointment(request, appointment_id):
 — 毛日好（Paw&Day）系統
 """
 
-    # 刪除預約後寄信
-    appointment.delete()
-
-    print("寄信前：", owner_email)
-    send_mail(
-        subject,
-        message,
-        settings.DEFAULT_FROM_EMAIL,
-        [owner_email],
-        fail_silently=False
-    )
-    print("寄信成功")
+    # 刪除預約與排入通知信在同一個交易
+    with transaction.atomic():
+        appointment.delete()
+        EmailOutbox.enqueue(subject, message, owner_email, category='appointment_cancelled')
 
     messages.success(request, "已成功取消預約，並通知飼主。")
     return redirect('vet_appointments')
@@ -3286,11 +3528,10 @@ def cancel_appointment(request, appointment_id):
 
 — 毛日好（Paw&Day）系統"""
 
-        # 刪除資料
-        appointment.delete()
-
-        # 發送通知 Email 給獸醫
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [vet_email], fail_silently=False)
+        # 刪除預約與排入通知信在同一個交易
+        with transaction.atomic():
+            appointment.delete()
+            EmailOutbox.enqueue(subject, message, vet_email, category='appointment_cancelled')
 
         messages.success(request, "預約已取消，並已通知獸醫。")
     except Exception as e:
@@ -3337,33 +3578,14 @@ def tem_rec(request, pet_id):
     start_date = date(year, month, 1)
     end_date = date(year, month, monthrange(year, month)[1])
 
-    # 篩選當月資料
-    raw_records = DailyRecord.objects.filter(
-        pet=pet,
-        category='temperature',
-        date__range=(start_date, end_date)
-    ).order_by('date', 'created_at')
-
-    # 整理資料
-    records = []
-    for rec in raw_records:
-        try:
-            temp_value = float(rec.content)
-        except ValueError:
-            continue
-        records.append({
-            'id': rec.id,
-            'date': rec.date.strftime('%Y-%m-%d'),
-            'datetime': rec.date.strftime('%Y-%m-%d'),
-            'recorded_date': rec.date.strftime('%Y-%m-%d'),
-            'submitted_at': localtime(rec.created_at).strftime('%H:%M'),
-            'temperature': temp_value,
-            'raw_content': rec.content,
-        })
+    # 當月資料（直接讀數值欄位）與統計
+    records = get_temperature_data(pet, year, month)
+    summary = DailyRecord.measurement_summary(pet, 'temperature', start_date, end_date)
 
     context = {
         'pet': pet,
         'records': records,
+        'summary': summary,
         'current_month': f"{year}-{month:02d}",
         'current_month_display': f"{year} 年 {month} 月",
         'is_current_month': is_current_month,
@@ -3484,21 +3706,11 @@ def get_monthly_tem(request, pet_id, year, month):
     start_date = date(year, month, 1)
     end_date = date(year, month, monthrange(year, month)[1])
 
-    raw_records = DailyRecord.objects.filter(
-        pet=pet,
-        category='temperature',
-        date__range=(start_date, end_date)
-    ).order_by('date', 'created_at')
-    result = []
-    for rec in raw_records:
-        try:
-            temp = float(rec.content)
-        except ValueError:
-            continue
-        result.append({
-            'date': rec.date.strftime('%Y-%m-%d'),
-            'temperature': temp,
-        })
+    rows = DailyRecord.measurements(pet, 'temperature', start_date, end_date).values_list('date', 'value')
+    result = [
+        {'date': record_date.strftime('%Y-%m-%d'), 'temperature': value}
+        for record_date, value in rows
+    ]
     return JsonResponse(result, safe=False)
 
 # （體重）共用函式
@@ -3508,23 +3720,205 @@ def get_monthly_weight(request, pet_id, year, month):
     start_date = date(year, month, 1)
     end_date = date(year, month, monthrange(year, month)[1])
 
-    raw_records = DailyRecord.objects.filter(
-        pet=pet,
-        category='weight',
-        date__range=(start_date, end_date)
-    ).order_by('date', 'created_at')
+    rows = DailyRecord.measurements(pet, 'weight', start_date, end_date).values_list('date', 'value')
+    result = [
+        {'date': record_date.strftime('%Y-%m-%d'), 'weight': value}
+        for record_date, value in rows
+    ]
+    return JsonResponse(result, safe=False)
+
+# （體溫／體重）任意期間趨勢 API
+@login_required
+@require_GET
+def api_pet_series(request, pet_id):
+    """
+    任意期間的體溫或體重趨勢，以 LTTB 降採樣到最多 points 點（參數 kind、from、to、points）
+    每點附帶所屬區間的 min／max／mean／count；飼主本人或看診過的獸醫師可查看
+    """
+    pet = get_object_or_404(Pet, id=pet_id)
+    if pet.owner_id != request.user.id and not (
+        request.identity.vet_profile and VetPatient.has_patient(request.identity.vet_profile, pet)
+    ):
+        return JsonResponse({'success': False, 'message': '您沒有權限查看此寵物資料'}, status=403)
+
+    kind = request.GET.get('kind', 'temperature')
+    if kind not in DailyRecord.MEASUREMENT_CATEGORIES:
+        return JsonResponse({'success': False, 'message': 'kind 只能是 temperature 或 weight'}, status=400)
+
+    try:
+        end_date = datetime.strptime(request.GET['to'], '%Y-%m-%d').date() if request.GET.get('to') else timezone.localdate()
+        start_date = (
+            datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from')
+            else end_date - timedelta(days=365)
+        )
+        points = int(request.GET.get('points', 200))
+    except ValueError:
+        return JsonResponse({'success': False, 'message': '參數格式錯誤（日期為 YYYY-MM-DD，points 為整數）'}, status=400)
+
+    if start_date > end_date:
+        return JsonResponse({'success': False, 'message': '開始日期不可晚於結束日期'}, status=400)
+    points = max(series.MIN_POINTS, min(points, series.MAX_POINTS))
+
+    data = series.get_series(pet, kind, start_date, end_date, points)
+    return JsonResponse({'success': True, **data})
+
+
+# 每日紀錄批次上傳（智慧體重計、餵食 App 同步積存資料）
+RECORD_BATCH_MAX = 5000
 
-    result = []
-    for rec in raw_records:
+
+@login_required
+@require_POST
+def api_batch_daily_records(request):
+    """
+    一次寫入多筆自己寵物的每日紀錄：{"records": [{pet_id, category, date, value 或 content, client_id}]}
+    每筆都必須帶 client_id（用戶端產生的唯一編號），沒帶的視為錯誤，重送整批才不會重複寫入；
+    寵物權限整批查一次；client_id 與既有紀錄或同批前面的項目重複時略過（可安全重送）；
+    通過檢查的項目以 bulk_create 寫入，回傳每一筆的結果（created／duplicate／error）
+    """
+    try:
+        items = json.loads(request.body).get('records')
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'success': False, 'message': '請以 JSON 格式傳送 records 陣列'}, status=400)
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'success': False, 'message': '請以 JSON 格式傳送 records 陣列'}, status=400)
+    if len(items) > RECORD_BATCH_MAX:
+        return JsonResponse({'success': False, 'message': f'單次最多 {RECORD_BATCH_MAX} 筆'}, status=400)
+
+    today = timezone.localdate()
+    categories = dict(DailyRecord.CATEGORY_CHOICES)
+    results = [None] * len(items)
+
+    def fail(index, client_id, message):
+        results[index] = {'index': index, 'client_id': client_id, 'status': 'error', 'message': message}
+
+    # 第一輪：欄位檢查
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            fail(index, None, '格式錯誤')
+            continue
+        client_id = item.get('client_id')
+        client_id = str(client_id)[:64] if client_id not in (None, '') else None
+        if not client_id:
+            fail(index, None, '缺少 client_id')
+            continue
         try:
-            weight = float(rec.content)
-        except ValueError:
+            pet_id = int(item.get('pet_id'))
+            record_date = datetime.strptime(str(item.get('date')), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            fail(index, client_id, 'pet_id 或 date 格式錯誤（日期為 YYYY-MM-DD）')
             continue
-        result.append({
-            'date': rec.date.strftime('%Y-%m-%d'),
-            'weight': weight,
-        })
-    return JsonResponse(result, safe=False)
+        category = item.get('category')
+        if category not in categories:
+            fail(index, client_id, '不支援的類別')
+            continue
+        if record_date > today:
+            fail(index, client_id, '日期不可超過今天')
+            continue
+
+        content = item.get('content')
+        if content in (None, '') and item.get('value') is not None:
+            content = item['value']
+        content = '' if content is None else str(content).strip()
+        if category in DailyRecord.MEASUREMENT_CATEGORIES:
+            if DailyRecord.parse_value(category, content) is None:
+                fail(index, client_id, f'{categories[category]}必須是數值')
+                continue
+        elif not content:
+            fail(index, client_id, '缺少內容')
+            continue
+        parsed.append((index, client_id, pet_id, category, record_date, content))
+
+    # 寵物權限：一次查出這批涉及的寵物中屬於自己的
+    owned = set(Pet.objects.filter(
+        owner=request.user, id__in={pet_id for _, _, pet_id, _, _, _ in parsed}
+    ).values_list('id', flat=True))
+
+    # client_id 去重：既有紀錄一次查詢，同批重複以第一筆為準
+    client_keys = {(pet_id, client_id) for _, client_id, pet_id, _, _, _ in parsed if pet_id in owned}
+    existing = {}
+    if client_keys:
+        for record_id, pet_id, client_id in DailyRecord.objects.filter(
+            pet_id__in={pet_id for pet_id, _ in client_keys},
+            client_id__in={client_id for _, client_id in client_keys},
+        ).values_list('id', 'pet_id', 'client_id'):
+            existing[(pet_id, client_id)] = record_id
+
+    to_create = []
+    seen = {}
+    for index, client_id, pet_id, category, record_date, content in parsed:
+        if pet_id not in owned:
+            fail(index, client_id, '找不到寵物或無權限')
+            continue
+        key = (pet_id, client_id)
+        if key in existing:
+            results[index] = {'index': index, 'client_id': client_id, 'status': 'duplicate', 'id': existing[key]}
+            continue
+        if key in seen:
+            results[index] = {'index': index, 'client_id': client_id, 'status': 'duplicate', 'duplicate_of': seen[key]}
+            continue
+        seen[key] = index
+        # bulk_create 不經過 DailyRecord.save 與 signal，數值欄位在這裡一併填好
+        record = DailyRecord(
+            pet_id=pet_id, category=category, date=record_date, content=content,
+            value=DailyRecord.parse_value(category, content), client_id=client_id,
+        )
+        to_create.append((index, client_id, record))
+
+    try:
+        with transaction.atomic():
+            DailyRecord.objects.bulk_create([record for _, _, record in to_create], batch_size=1000)
+            # 彙總整批重算：每隻寵物、每種量測一次
+            touched = defaultdict(set)
+            for _, _, record in to_create:
+                if record.category in DailyRecord.MEASUREMENT_CATEGORIES:
+                    touched[(record.pet_id, record.category)].add(record.date)
+            for (pet_id, kind), days in touched.items():
+                MeasurementRollup.schedule_refresh_days(pet_id, kind, days)
+    except IntegrityError:
+        # 同一個 client_id 被另一個請求同時寫入；重送時會被判定為重複
+        return JsonResponse({'success': False, 'message': '部分紀錄正由其他請求寫入，請稍後重送'}, status=409)
+
+    # 資料庫不回傳主鍵（MySQL）時，以 client_id 補查
+    missing = {(record.pet_id, record.client_id) for _, _, record in to_create if record.pk is None}
+    if missing:
+        for record_id, pet_id, client_id in DailyRecord.objects.filter(
+            pet_id__in={pet_id for pet_id, _ in missing},
+            client_id__in={client_id for _, client_id in missing},
+        ).values_list('id', 'pet_id', 'client_id'):
+            existing[(pet_id, client_id)] = record_id
+    created_ids = []
+    for index, client_id, record in to_create:
+        record_id = record.pk or existing.get((record.pet_id, record.client_id))
+        created_ids.append(record_id)
+        results[index] = {'index': index, 'client_id': client_id, 'status': 'created', 'id': record_id}
+    SyncChange.record(request.user.id, 'daily_record', created_ids)
+
+    summary = {status: 0 for status in ('created', 'duplicate', 'error')}
+    for result in results:
+        summary[result['status']] += 1
+    print(f"✅ 批次紀錄上傳：使用者 {request.user.id}，{summary}")
+    return JsonResponse({'success': True, 'summary': summary, 'results': results})
+
+
+@login_required
+@require_GET
+def api_sync(request):
+    """
+    離線 App 差異同步：回傳 since 游標之後自己寵物與健康紀錄的新增、修改、刪除（since 省略為完整資料）
+    回應以串流分批輸出，下次同步帶回應中的 cursor（格式見 petapp/sync.py）
+    """
+    try:
+        since = int(request.GET.get('since') or 0)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'since 必須是整數游標'}, status=400)
+    if since < 0:
+        return JsonResponse({'success': False, 'message': 'since 必須是整數游標'}, status=400)
+
+    response = StreamingHttpResponse(sync.stream(request.user.id, since), content_type='application/json')
+    response['Cache-Control'] = 'no-store'
+    return response
 
 
 
@@ -3552,32 +3946,14 @@ def weight_rec(request, pet_id):
     start_date = date(year, month, 1)
     end_date = date(year, month, monthrange(year, month)[1])
 
-    # 篩選當月資料
-    raw_records = DailyRecord.objects.filter(
-        pet=pet,
-        category='weight',
-        date__range=(start_date, end_date)
-    ).order_by('date', 'created_at')
+    # 當月資料（直接讀數值欄位）與統計
+    records = get_weight_data(pet, year, month)
+    summary = DailyRecord.measurement_summary(pet, 'weight', start_date, end_date)
 
-    # 整理資料
-    records = []
-    for rec in raw_records:
-        try:
-            weight_value = float(rec.content)
-        except ValueError:
-            continue
-        records.append({
-            'id': rec.id,
-            'date': rec.date.strftime('%Y-%m-%d'),
-            'datetime': rec.date.strftime('%Y-%m-%d'),  # 使用者填的日期
-            'recorded_date': rec.date.strftime('%Y-%m-%d'),  # ✅ 額外：使用者填的
-            'submitted_at': localtime(rec.created_at).strftime('%H:%M'),
-            'weight': weight_value,
-            'raw_content': rec.content,
-        })
     context = {
         'pet': pet,
         'records': records,
+        'summary': summary,
         'current_month': f"{year}-{month:02d}",
         'current_month_display': f"{year} 年 {month} 月",
         'is_current_month': is_current_month,
@@ -3864,34 +4240,12 @@ def delete_report(request, report_id):
 # 通知
 @login_required
 def get_notification_count(request):
-    """獲取用戶通知數量 - API端點"""
+    """獲取用戶通知數量 - API端點（讀取每日通知計數快取，命中時只有一次快取讀取）"""
     try:
         user = request.user
-        tomorrow = timezone.now().date() + timedelta(days=1)
-        count = 0
-
-        if hasattr(user, 'profile'):
-            account_type = user.profile.account_type
-            
-            if account_type == 'owner':
-                # 飼主：明日預約數量
-                count = VetAppointment.objects.filter(
-                    owner=user, 
-                    slot__date=tomorrow,
-                    status__in=['pending', 'confirmed']
-                ).count()
-                
-            elif account_type in ['veterinarian', 'clinic_admin']:
-                # 獸醫師：明日看診數量
-                try:
-                    vet_profile = user.vet_profile
-                    count = VetAppointment.objects.filter(
-                        slot__doctor=vet_profile, 
-                        slot__date=tomorrow,
-                        status__in=['pending', 'confirmed']
-                    ).count()
-                except AttributeError:
-                    count = 0
+        today = timezone.localdate()
+        tomorrow = today + timedelta(days=1)
+        count = get_notification_count_cached(user.id, today)
 
         return JsonResponse({
             'success': True,
@@ -3907,6 +4261,67 @@ def get_notification_count(request):
             'error': str(e)
         }, status=500)
 
+# 即時事件推播（SSE，需以 ASGI 伺服器執行）
+@login_required
+@require_GET
+async def event_stream(request):
+    """
+    SSE 端點：訂閱自己的事件頻道（飼主、看診醫師、診所管理員），有事件才推送
+    連線建立時查一次身分，之後閒置只送心跳，不再查資料庫
+    """
+    if not isinstance(request, ASGIRequest):
+        # WSGI 會把串流整個讀完才回應，無法長連線
+        return JsonResponse({'success': False, 'message': '即時推播需在 ASGI 下執行'}, status=501)
+
+    user = await request.auser()
+    vet_profile = await VetDoctor.objects.filter(user=user, is_active=True).values(
+        'id', 'clinic_id', 'is_active_admin'
+    ).afirst()
+
+    channels = [f'user:{user.id}']
+    if vet_profile:
+        channels.append(f"doctor:{vet_profile['id']}")
+        if vet_profile['is_active_admin']:
+            channels.append(f"clinic:{vet_profile['clinic_id']}")
+
+    heartbeat = getattr(settings, 'SSE_HEARTBEAT_SECONDS', 25)
+
+    async def stream():
+        yield 'retry: 5000\n\n'
+        messages_iter = events.subscribe(channels).__aiter__()
+        next_message = None
+        seen_ids = deque(maxlen=50)  # 同一事件可能從多個頻道送來
+        try:
+            while True:
+                if next_message is None:
+                    next_message = asyncio.ensure_future(messages_iter.__anext__())
+                done, _ = await asyncio.wait({next_message}, timeout=heartbeat)
+                if not done:
+                    yield ': ping\n\n'
+                    continue
+                message = next_message.result()
+                next_message = None
+                payload = json.loads(message)
+                if payload.get('id') in seen_ids:
+                    continue
+                seen_ids.append(payload.get('id'))
+                yield f"event: {payload.get('type', 'message')}\ndata: {message}\n\n"
+        finally:
+            # 連線中斷：先取消等待中的讀取，訂閱產生器結束後才會移除訂閱
+            if next_message is not None:
+                next_message.cancel()
+                try:
+                    await next_message
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+            await messages_iter.aclose()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # 關閉 nginx 緩衝，事件才會即時送達
+    return response
+
+
 # 通知頁面邏輯
 @login_required
 def notification_page(request):
@@ -3917,6 +4332,7 @@ def notification_page(request):
     appointments = []
     vaccine_reminders = []
     deworm_reminders = []
+    health_alerts = []
     role = None
 
     try:
@@ -3931,60 +4347,27 @@ def notification_page(request):
                     status__in=['pending', 'confirmed']
                 ).select_related('slot__doctor__user', 'slot__clinic', 'pet')
 
-                # 疫苗提醒邏輯
+                # 疫苗／驅蟲提醒：讀取預先計算好的到期日（一次索引查詢）
                 try:
-                    latest_vaccine_dates = (VaccineRecord.objects
-                        .filter(pet__owner=user)
-                        .values('pet')
-                        .annotate(last_vaccine_date=Max('date'))
-                    )
-
-                    for item in latest_vaccine_dates:
-                        pet_id = item['pet']
-                        last_date = item['last_vaccine_date']
-                        if last_date:
-                            days_diff = (today - last_date).days
-
-                            # 提前一個月或一天提醒
-                            if days_diff in [365 - 30, 365 - 1]:
-                                try:
-                                    pet = Pet.objects.get(id=pet_id)
-                                    vaccine_reminders.append({
-                                        'pet': pet,
-                                        'last_date': last_date,
-                                        'days_left': 365 - days_diff
-                                    })
-                                except Pet.DoesNotExist:
-                                    continue
+                    for item in CareDueDate.due_for_owner(user):
+                        reminder = {
+                            'pet': item.pet,
+                            'last_date': item.last_date,
+                            'due_date': item.due_date,
+                            'days_left': item.days_left,
+                        }
+                        if item.kind == 'vaccine':
+                            vaccine_reminders.append(reminder)
+                        else:
+                            deworm_reminders.append(reminder)
                 except Exception as e:
-                    print(f"疫苗提醒處理錯誤: {e}")
+                    print(f"疫苗／驅蟲提醒處理錯誤: {e}")
 
-                # 驅蟲提醒邏輯
+                # 體溫／體重異常（detect_health_anomalies 每日計算）
                 try:
-                    latest_deworm_dates = (DewormRecord.objects
-                        .filter(pet__owner=user)
-                        .values('pet')
-                        .annotate(last_deworm_date=Max('date'))
-                    )
-
-                    for item in latest_deworm_dates:
-                        pet_id = item['pet']
-                        last_date = item['last_deworm_date']
-                        if last_date:
-                            days_diff = (today - last_date).days
-
-                            if days_diff in [182 - 30, 182 - 1]:  # 半年約182天
-                                try:
-                                    pet = Pet.objects.get(id=pet_id)
-                                    deworm_reminders.append({
-                                        'pet': pet,
-                                        'last_date': last_date,
-                                        'days_left': 182 - days_diff
-                                    })
-                                except Pet.DoesNotExist:
-                                    continue
+                    health_alerts = list(HealthAlert.recent_for_owner(user, today))
                 except Exception as e:
-                    print(f"驅蟲提醒處理錯誤: {e}")
+                    print(f"健康異常提醒處理錯誤: {e}")
 
             elif role in ['veterinarian', 'clinic_admin']:
                 try:
@@ -4006,6 +4389,7 @@ def notification_page(request):
         'tomorrow': tomorrow,
         'vaccine_reminders': vaccine_reminders,
         'deworm_reminders': deworm_reminders,
+        'health_alerts': health_alerts,
     })
 
 # 在 views.py 中添加這些函數
@@ -4015,53 +4399,61 @@ def notification_page(request):
 def api_dashboard_stats(request):
     """Dashboard 統計數據 API"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所'})
 
-        today = date.today()
-        
-        stats = {
-            'todayAppointments': VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                slot__date=today,
-                status='confirmed'
-            ).count(),
-            'pendingAppointments': VetAppointment.objects.filter(
-                slot__clinic=clinic,  
-                status='pending'
-            ).count(),
-            'doctorsCount': clinic.doctors.filter(is_active=True).count(),
-            'totalAppointmentsThisMonth': VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                slot__date__year=today.year,
-                slot__date__month=today.month
-            ).count(),
-        }
+        def build_stats():
+            clinic_stats = get_clinic_appointment_stats(clinic)
+            return {
+                'todayAppointments': clinic_stats['today_confirmed'],
+                'pendingAppointments': clinic_stats['pending'],
+                'doctorsCount': clinic_stats['doctors_count'],
+                'totalAppointmentsThisMonth': clinic_stats['month'],
+            }
+
+        # 依診所快取版本快取，資料有變動才會重新計算
+        stats = get_clinic_cached(clinic.id, 'dashboard_stats', build_stats, params=date.today().isoformat())
         
         return JsonResponse({'success': True, 'stats': stats})
         
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)})
 
+@login_required
+@require_http_methods(["GET"])
+def api_clinic_trends(request):
+    """預約趨勢 API：近 N 個月逐月、逐醫師的預約數與時段使用率"""
+    try:
+        vet_profile, clinic = get_user_clinic_info(request)
+        if not clinic:
+            return JsonResponse({'success': False, 'message': '找不到診所'})
+
+        months = max(1, min(int(request.GET.get('months', 6)), 24))
+
+        return JsonResponse({'success': True, 'trends': get_clinic_trends(clinic, months)})
+
+    except ValueError:
+        return JsonResponse({'success': False, 'message': '參數格式錯誤'}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+
 @login_required  
 @require_http_methods(["GET"])
 def api_schedule_stats(request):
     """排班統計數據 API"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所'})
 
-        stats = {
-            'activeSchedules': VetSchedule.objects.filter(
-                doctor__clinic=clinic,
-                is_active=True
-            ).count(),
-            'totalSchedules': VetSchedule.objects.filter(
-                doctor__clinic=clinic
-            ).count(),
-        }
+        def build_stats():
+            return VetSchedule.objects.filter(doctor__clinic=clinic).aggregate(
+                activeSchedules=Count('id', filter=Q(is_active=True)),
+                totalSchedules=Count('id'),
+            )
+
+        stats = get_clinic_cached(clinic.id, 'schedule_stats', build_stats)
         
         return JsonResponse({'success': True, 'stats': stats})
         
@@ -4073,69 +4465,76 @@ def api_schedule_stats(request):
 def api_clinic_status(request):
     """診所營業狀態 API"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所'})
 
         now = timezone.now()
-        current_weekday = now.weekday()
-        current_time = now.time()
-        
-        # 檢查今天是否有排班
-        today_schedules = VetSchedule.objects.filter(
-            doctor__clinic=clinic,
-            weekday=current_weekday,
-            is_active=True
-        )
-        
-        is_open = False
-        current_schedule = None
-        next_schedule = None
-        
-        # 檢查是否在營業時間內
-        for schedule in today_schedules:
-            if schedule.start_time <= current_time <= schedule.end_time:
-                is_open = True  
-                current_schedule = schedule
-                break
-        
-        # 如果沒營業，找下一個時段
-        if not is_open:
-            future_schedules = today_schedules.filter(start_time__gt=current_time).order_by('start_time')
-            if future_schedules.exists():
-                next_schedule = future_schedules.first()
-        
-        # 準備狀態資訊
-        if is_open and current_schedule:
-            status_text = f"營業中 (至 {current_schedule.end_time.strftime('%H:%M')})"
-            status_type = "open"
-        elif next_schedule:
-            status_text = f"休診中 ({next_schedule.start_time.strftime('%H:%M')} 開診)"  
-            status_type = "closed_next"
-        else:
-            # 檢查明天的排班
-            tomorrow_schedules = VetSchedule.objects.filter(
+
+        def build_status():
+            current_weekday = now.weekday()
+            current_time = now.time()
+
+            # 檢查今天是否有排班
+            today_schedules = VetSchedule.objects.filter(
                 doctor__clinic=clinic,
-                weekday=(current_weekday + 1) % 7,
+                weekday=current_weekday,
                 is_active=True
-            ).order_by('start_time')
-            
-            if tomorrow_schedules.exists():
-                next_schedule = tomorrow_schedules.first()
-                status_text = f"休診中 (明日 {next_schedule.start_time.strftime('%H:%M')} 開診)"
+            )
+
+            is_open = False
+            current_schedule = None
+            next_schedule = None
+
+            # 檢查是否在營業時間內
+            for schedule in today_schedules:
+                if schedule.start_time <= current_time <= schedule.end_time:
+                    is_open = True  
+                    current_schedule = schedule
+                    break
+
+            # 如果沒營業，找下一個時段
+            if not is_open:
+                future_schedules = today_schedules.filter(start_time__gt=current_time).order_by('start_time')
+                if future_schedules.exists():
+                    next_schedule = future_schedules.first()
+
+            # 準備狀態資訊
+            if is_open and current_schedule:
+                status_text = f"營業中 (至 {current_schedule.end_time.strftime('%H:%M')})"
+                status_type = "open"
+            elif next_schedule:
+                status_text = f"休診中 ({next_schedule.start_time.strftime('%H:%M')} 開診)"  
+                status_type = "closed_next"
             else:
-                status_text = "休診中"
-            status_type = "closed"
-        
-        return JsonResponse({
-            'success': True,
-            'status': {
+                # 檢查明天的排班
+                tomorrow_schedules = VetSchedule.objects.filter(
+                    doctor__clinic=clinic,
+                    weekday=(current_weekday + 1) % 7,
+                    is_active=True
+                ).order_by('start_time')
+
+                if tomorrow_schedules.exists():
+                    next_schedule = tomorrow_schedules.first()
+                    status_text = f"休診中 (明日 {next_schedule.start_time.strftime('%H:%M')} 開診)"
+                else:
+                    status_text = "休診中"
+                status_type = "closed"
+
+            return {
                 'isOpen': is_open,
                 'statusText': status_text,
                 'statusType': status_type,
                 'currentTime': current_time.strftime('%H:%M'),
                 'hasSchedulesToday': today_schedules.exists()
             }
+
+        # 營業狀態與現在時間有關，快取鍵包含到分鐘
+        status = get_clinic_cached(clinic.id, 'clinic_status', build_status, params=now.strftime('%Y-%m-%d %H:%M'))
+
+        return JsonResponse({
+            'success': True,
+            'status': status
         })
         
     except Exception as e:
@@ -4148,76 +4547,24 @@ def api_appointment_stats(request):
     """預約統計 API"""
     try:
         # 獲取診所資訊
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所資訊'})
         
-        today = date.today()
-        
-        # 基本統計
-        total_appointments = VetAppointment.objects.filter(slot__clinic=clinic).count()
-        
-        confirmed_appointments = VetAppointment.objects.filter(
-            slot__clinic=clinic,
-            status='confirmed'
-        ).count()
-        
-        pending_appointments = VetAppointment.objects.filter(
-            slot__clinic=clinic,
-            status='pending'
-        ).count()
-        
-        today_appointments = VetAppointment.objects.filter(
-            slot__clinic=clinic,
-            slot__date=today
-        ).count()
-        
-        # 本週統計
-        week_start = today - timedelta(days=today.weekday())
-        week_end = week_start + timedelta(days=6)
-        
-        week_appointments = VetAppointment.objects.filter(
-            slot__clinic=clinic,
-            slot__date__range=[week_start, week_end]
-        ).count()
-        
-        # 按狀態分組統計
-        status_stats = {}
-        statuses = ['pending', 'confirmed', 'completed', 'cancelled']
-        
-        for status in statuses:
-            count = VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                status=status
-            ).count()
-            status_stats[status] = count
-        
-        # 按醫師分組統計
-        doctor_stats = []
-        doctors = clinic.doctors.filter(is_active=True)
-        
-        for doctor in doctors:
-            doctor_appointments = VetAppointment.objects.filter(
-                slot__doctor=doctor
-            ).count()
-            
-            doctor_stats.append({
-                'id': doctor.id,
-                'name': doctor.user.get_full_name() or doctor.user.username,
-                'appointments': doctor_appointments
-            })
+        # 所有計數一次聚合，醫師統計一次分組查詢
+        stats = get_clinic_appointment_stats(clinic)
         
         return JsonResponse({
             'success': True,
             'stats': {
-                'total': total_appointments,
-                'confirmed': confirmed_appointments,
-                'pending': pending_appointments,
-                'today': today_appointments,
-                'week': week_appointments,
-                'by_status': status_stats,
-                'by_doctor': doctor_stats
+                'total': stats['total'],
+                'confirmed': stats['confirmed'],
+                'pending': stats['pending'],
+                'today': stats['today'],
+                'week': stats['week'],
+                'by_status': stats['by_status'],
+                'by_doctor': stats['by_doctor']
             }
         })
         
@@ -4234,60 +4581,96 @@ def api_appointment_stats(request):
 def api_appointments_list(request):
     """預約列表 API"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所'})
 
         date_filter = request.GET.get('date', 'today')
         today = date.today()
-        
-        if date_filter == 'today':
-            target_date = today
-        elif date_filter == 'tomorrow':
-            target_date = today + timedelta(days=1)
-        elif date_filter == 'week':
-            week_start = today
-            week_end = today + timedelta(days=7)
-            appointments = VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                slot__date__range=[week_start, week_end]
-            ).order_by('slot__date', 'slot__start_time')
-        else:
-            target_date = today
-            
-        if date_filter != 'week':
-            appointments = VetAppointment.objects.filter(
-                slot__clinic=clinic,
-                slot__date=target_date
-            ).order_by('slot__start_time')
-        
-        appointments_data = []
-        for apt in appointments:
-            appointments_data.append({
-                'id': apt.id,
-                'time': apt.slot.start_time.strftime('%H:%M'),
-                'date': apt.slot.date.strftime('%Y-%m-%d') if date_filter == 'week' else None,
-                'owner_name': apt.owner.get_full_name() or apt.owner.username,
-                'pet_name': apt.pet.name,
-                'doctor_name': apt.slot.doctor.user.get_full_name() or apt.slot.doctor.user.username,
-                'status': apt.status,
-                'reason': apt.reason or ''
-            })
-        
+
+        # 帶 cursor 或 limit 才分頁（每頁預設 50 筆）；都沒帶時回傳整段期間，與儀表板原本的用法相容
+        cursor = request.GET.get('cursor')
+        limit = None
+        if cursor or 'limit' in request.GET:
+            try:
+                if cursor:
+                    parse_appointment_cursor(cursor)
+                limit = max(1, min(int(request.GET.get('limit', 50)), 200))
+            except ValueError:
+                return JsonResponse({'success': False, 'message': '分頁參數錯誤'}, status=400)
+
+        def build_list():
+            appointments = VetAppointment.objects.filter(slot__clinic=clinic)
+            if date_filter == 'week':
+                appointments = appointments.filter(slot__date__range=[today, today + timedelta(days=7)])
+            elif date_filter == 'tomorrow':
+                appointments = appointments.filter(slot__date=today + timedelta(days=1))
+            else:
+                appointments = appointments.filter(slot__date=today)
+
+            page = get_appointment_page(appointments, cursor=cursor, limit=limit)
+            page['rows'] = [
+                {
+                    'id': row['id'],
+                    'time': row['slot__start_time'].strftime('%H:%M'),
+                    'date': row['slot__date'].strftime('%Y-%m-%d') if date_filter == 'week' else None,
+                    'owner_name': row['owner_name'],
+                    'pet_name': row['pet__name'],
+                    'doctor_name': row['doctor_name'],
+                    'status': row['status'],
+                    'reason': row['reason'] or ''
+                }
+                for row in page['rows']
+            ]
+            return page
+
+        # 依診所快取版本快取，預約有任何變動就會換版本
+        page = get_clinic_cached(
+            clinic.id, 'appointments_list', build_list,
+            params=f"{today.isoformat()}|{request.GET.urlencode()}"
+        )
+
         return JsonResponse({
             'success': True, 
-            'appointments': appointments_data
+            'appointments': page['rows'],
+            'next_cursor': page['next_cursor']
         })
         
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)})
     
+@login_required
+@require_http_methods(["GET"])
+def api_clinic_search(request):
+    """櫃台即時搜尋 API：預約、寵物、飼主混合排名結果（參數 q、limit）"""
+    try:
+        vet_profile, clinic = get_user_clinic_info(request)
+        if not clinic:
+            return JsonResponse({'success': False, 'message': '找不到診所'})
+
+        query = request.GET.get('q', '').strip()
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 10)), 30))
+        except ValueError:
+            limit = 10
+
+        return JsonResponse({
+            'success': True,
+            'query': query,
+            'results': search_clinic(clinic, query, limit) if query else []
+        })
+
+    except Exception as e:
+        print(f"💥 櫃台搜尋失敗: {e}")
+        return JsonResponse({'success': False, 'message': str(e)})
+
+
 @login_required
 @require_http_methods(["POST"])
 def api_clinic_settings(request):
     """診所設定更新 API"""
     try:
-        vet_profile, clinic = get_user_clinic_info(request.user)
+        vet_profile, clinic = get_user_clinic_info(request)
         if not clinic:
             return JsonResponse({'success': False, 'message': '找不到診所'})
         
@@ -3,6 +3,9 @@ ASGI config for petproject project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+SSE 即時推播（/api/events/stream/）需要以 ASGI 伺服器執行，例如：
+    uvicorn petproject.asgi:application
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -75,6 +75,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',                # 一般請求處理
     'django.middleware.csrf.CsrfViewMiddleware',                # 防止 CSRF 攻擊
     'django.contrib.auth.middleware.AuthenticationMiddleware',  # 驗證機制
+    'petapp.middleware.IdentityMiddleware',                     # 使用者身分（Profile／獸醫師／診所）
     'django.contrib.messages.middleware.MessageMiddleware',     # 提示訊息機制
     'django.middleware.clickjacking.XFrameOptionsMiddleware',   # 防止點擊劫持攻擊
 
@@ -206,10 +207,74 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 ADMIN_EMAIL = config('ADMIN_EMAIL')
 
+# 待寄信件佇列（EmailOutbox）：由 python manage.py send_outbox_emails --loop 寄出
+# 失敗後等待 BACKOFF × 2^(次數-1) 秒重試，最多 BACKOFF_MAX 秒，超過 MAX_ATTEMPTS 次標記為失敗
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=6, cast=int)
+EMAIL_OUTBOX_BACKOFF_SECONDS = config('EMAIL_OUTBOX_BACKOFF_SECONDS', default=60, cast=int)
+EMAIL_OUTBOX_BACKOFF_MAX_SECONDS = config('EMAIL_OUTBOX_BACKOFF_MAX_SECONDS', default=3600, cast=int)
+
 # EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 
 
+# ===== 快取設定 =====
+# CACHE_BACKEND：locmem（預設，測試／單一程序）、file 或 redis（正式環境多程序時請用 file 或 redis）
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('CACHE_LOCATION', default='redis://127.0.0.1:6379/1'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / '.cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'petapp',
+        }
+    }
+
+# 診所儀表板／預約列表 API 的快取秒數（資料變動時會立即換版本，這只是保險用的上限）
+CLINIC_CACHE_TTL = config('CLINIC_CACHE_TTL', default=60, cast=int)
+
+# 登入身分快照（Profile／VetDoctor／診所）最多沿用的秒數，逾時重新查詢；locmem 時不使用快照
+IDENTITY_SNAPSHOT_TTL = config('IDENTITY_SNAPSHOT_TTL', default=60, cast=int)
+
+
+
+# ===== 預約設定 =====
+# 飼主選好時段後暫時保留的秒數（保留期間其他人無法預約該名額）
+SLOT_HOLD_TTL_SECONDS = config('SLOT_HOLD_TTL_SECONDS', default=300, cast=int)
+
+# 疫苗／驅蟲提醒：施打間隔天數與到期前幾天開始提醒（調整後請執行 sweep_care_reminders --rebuild）
+CARE_REMINDER_RULES = {
+    'vaccine': {'interval_days': 365, 'window_days': 30},
+    'deworm': {'interval_days': 182, 'window_days': 30},
+}
+
+# 體溫／體重異常門檻：依物種、量測種類覆寫 HealthAlert.DEFAULT_RULES 的部分欄位
+# 例：{'cat': {'weight': {'rate': 0.02}}}；由 detect_health_anomalies 每日執行
+HEALTH_ALERT_RULES = {}
+
+
+
+# ===== 即時推播（SSE）設定 =====
+# /api/events/stream/ 需以 ASGI 伺服器（uvicorn、daphne）執行 petproject.asgi:application
+# 單一程序用 MemoryBackend；多程序或多台主機請改用 RedisBackend（EVENT_BROKER_LOCATION 未設定時沿用 redis 快取位置）
+EVENT_BROKER_BACKEND = config('EVENT_BROKER_BACKEND', default='petapp.events.MemoryBackend')
+EVENT_BROKER_LOCATION = config('EVENT_BROKER_LOCATION', default='')
+SSE_HEARTBEAT_SECONDS = config('SSE_HEARTBEAT_SECONDS', default=25, cast=int)
+
+
+
 # ===== 靜態與媒體檔案設定 =====
 # 靜態檔案設定（CSS、JS）
 STATIC_URL = 'static/'  # 靜態檔案 URL 路徑前綴
@@ -100,6 +100,7 @@ class AppointmentFormController {
         this.addListener('#id_time_slot', 'change', (e) => {
             this.validateField('time_slot');
             this.updateProgress();
+            this.holdSelectedSlot(e.target.value);
         });
         
         // 實時驗證
@@ -533,6 +534,43 @@ class AppointmentFormController {
         }
     }
 
+    async holdSelectedSlot(slotId) {
+        // 選好時段後先暫時保留，避免填寫表單期間被別人預約走
+        const tokenInput = document.getElementById('id_hold_token');
+        if (tokenInput) tokenInput.value = '';
+        if (!slotId) return;
+
+        const clinicId = this.getFieldValue('clinic');
+        const doctorId = this.getFieldValue('doctor');
+        const date = this.getFieldValue('appointment_date');
+        if (!clinicId || !date) return;
+
+        try {
+            const params = { clinic_id: clinicId, date: date, hold_slot_id: slotId };
+            if (doctorId) params.doctor_id = doctorId;
+
+            const response = await this.fetchWithRetry('/api/time-slots/', {
+                method: 'GET',
+                headers: { 'X-Requested-With': 'XMLHttpRequest' },
+                signal: AbortSignal.timeout(10000)
+            }, params);
+
+            const data = await response.json();
+            const hold = data.hold || {};
+            if (hold.token) {
+                if (tokenInput) tokenInput.value = hold.token;
+                const minutes = Math.max(1, Math.round(hold.ttl_seconds / 60));
+                this.updateSlotsStatus(`已為您保留此時段 ${minutes} 分鐘，請在時間內完成預約`, 'success');
+            } else if (hold.error) {
+                this.updateTimeSlotOptions(data.slots || []);
+                this.updateSlotsStatus(hold.error, 'error');
+            }
+        } catch (error) {
+            // 保留失敗不影響送出，後端仍會再檢查一次名額
+            console.error('保留時段失敗:', error);
+        }
+    }
+
     updateTimeSlotOptions(slots) {
         const slotSelect = document.getElementById('id_time_slot');
         if (!slotSelect) return;
@@ -7,7 +7,8 @@ window.PawDayApp = {
   
   // 配置選項
   config: {
-    notificationUpdateInterval: 30000, // 30秒更新一次通知
+    notificationUpdateInterval: 30000, // 30秒更新一次通知（無法使用即時推播時）
+    eventStreamUrl: '/api/events/stream/',
     messageAutoHideDelay: 5000,        // 5秒後自動隱藏訊息
     loadingTimeout: 30000,             // 30秒載入超時
     apiTimeout: 15000                  // 15秒API請求超時
@@ -18,6 +19,7 @@ window.PawDayApp = {
     isLoggedIn: false,
     userType: null,
     notificationTimer: null,
+    eventSource: null,
     isLoading: false
   },
 
@@ -310,10 +312,12 @@ window.PawDayApp = {
     // 初始載入通知數量
     this.updateNotificationCount();
 
-    // 定期更新通知數量
-    this.state.notificationTimer = setInterval(() => {
-      this.updateNotificationCount();
-    }, this.config.notificationUpdateInterval);
+    // 優先使用 SSE 即時推播，不支援或連線失敗時退回定期輪詢
+    if (!this.setupEventStream()) {
+      this.state.notificationTimer = setInterval(() => {
+        this.updateNotificationCount();
+      }, this.config.notificationUpdateInterval);
+    }
 
     // 頁面隱藏時停止更新，顯示時恢復
     document.addEventListener('visibilitychange', () => {
@@ -325,6 +329,43 @@ window.PawDayApp = {
     });
   },
 
+  /**
+   * 設定即時推播（SSE），事件會轉發成 document 上的 pd:event 供各頁面使用
+   */
+  setupEventStream: function() {
+    if (!window.EventSource) return false;
+
+    const source = new EventSource(this.config.eventStreamUrl);
+    this.state.eventSource = source;
+
+    const forward = (event) => {
+      let payload = {};
+      try {
+        payload = JSON.parse(event.data);
+      } catch (error) {
+        PD.debug.error('無法解析推播事件:', error);
+        return;
+      }
+      document.dispatchEvent(new CustomEvent('pd:event', { detail: payload }));
+      this.updateNotificationCount();
+    };
+
+    ['appointment_created', 'appointment_cancelled', 'appointment_confirmed',
+     'appointment_status_changed', 'tomorrow_count'].forEach(type => {
+      source.addEventListener(type, forward);
+    });
+
+    source.onerror = () => {
+      // 伺服器不支援（例如以 WSGI 執行）時會直接關閉，改回輪詢
+      if (source.readyState === EventSource.CLOSED) {
+        PD.debug.log('即時推播無法使用，改為定期更新');
+        this.state.eventSource = null;
+        this.startNotificationUpdates();
+      }
+    };
+    return true;
+  },
+
   /**
    * 更新通知數量
    */
@@ -367,6 +408,7 @@ window.PawDayApp = {
    * 開始通知更新
    */
   startNotificationUpdates: function() {
+    if (this.state.eventSource) return;  // 已有即時推播就不需要輪詢
     if (!this.state.notificationTimer && this.state.isLoggedIn) {
       this.state.notificationTimer = setInterval(() => {
         this.updateNotificationCount();
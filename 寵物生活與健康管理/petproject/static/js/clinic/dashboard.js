@@ -1118,6 +1118,14 @@ function initializeRefreshTimer() {
         loadAppointments(currentDateFilter);
     }, 300000); // 5 分鐘
     
+    // 收到即時推播（新預約、取消、確認）時立即刷新
+    document.addEventListener('pd:event', (event) => {
+        const type = event.detail && event.detail.type;
+        if (type && type.startsWith('appointment_')) {
+            loadAppointments(currentDateFilter);
+        }
+    });
+    
     console.log('🔄 自動刷新功能初始化完成');
 }
 